@@ -0,0 +1,101 @@
+"""
+Streaming ZIP archives
+Builds a ZIP of a directory tree on the fly while the response is being sent,
+without temp files and without buffering the whole archive
+"""
+
+import io
+import os
+import time
+import zipfile
+from typing import Callable, Iterator, Optional
+
+from . import listing
+
+ARCHIVE_CHUNK_SIZE = 256 * 1024
+
+COMPRESSION_METHODS = {
+    "store": zipfile.ZIP_STORED,
+    "deflate": zipfile.ZIP_DEFLATED,
+}
+
+
+class _StreamBuffer(io.RawIOBase):
+    """
+    Write-only, non-seekable sink for ZipFile. Because it cannot seek,
+    zipfile writes sizes and CRCs in data descriptors after each member
+    instead of going back to patch local headers.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self.pending = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if data:
+            self._chunks.append(bytes(data))
+            self.pending += len(data)
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        self.pending = 0
+        return data
+
+
+def _zip_info(arcname: str, mtime: float, compress_type: int, size: int = 0) -> zipfile.ZipInfo:
+    # ZIP timestamps can't represent dates before 1980
+    date_time = time.localtime(max(mtime, 315532800))[:6]
+    info = zipfile.ZipInfo(arcname, date_time=date_time)
+    info.compress_type = compress_type
+    # Setting the size up front lets zipfile decide on ZIP64 headers per member
+    info.file_size = size
+    return info
+
+
+def stream_zip(root: str, base_name: str, method: str = "deflate",
+               include: Optional[Callable[[str], bool]] = None) -> Iterator[bytes]:
+    """
+    Yield a ZIP archive of `root` in chunks. Members are stored under
+    `base_name/`. ZIP64 extensions are used automatically for large members,
+    large archives and more than 65535 entries. `include` optionally
+    filters members by their relative path.
+
+    This is a plain generator: the response only asks for the next chunk
+    once the previous one has been sent, so a slow client slows the walk
+    down instead of data piling up in memory.
+    """
+    compress_type = COMPRESSION_METHODS[method]
+    sink = _StreamBuffer()
+    with zipfile.ZipFile(sink, mode="w", compression=compress_type, allowZip64=True) as zf:
+        zf.writestr(_zip_info(f"{base_name}/", os.path.getmtime(root), zipfile.ZIP_STORED), b"")
+        for rel_path, record in listing.walk_tree(root):
+            if include is not None and not include(rel_path):
+                continue
+            arcname = f"{base_name}/{rel_path}"
+            if record.is_dir:
+                zf.writestr(_zip_info(arcname + "/", record.mtime, zipfile.ZIP_STORED), b"")
+                continue
+            try:
+                src = open(os.path.join(root, rel_path), "rb")
+            except OSError:
+                # Removed or unreadable since the directory was scanned
+                continue
+            with src, zf.open(_zip_info(arcname, record.mtime, compress_type, record.size), "w") as dest:
+                while True:
+                    chunk = src.read(ARCHIVE_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    if sink.pending >= ARCHIVE_CHUNK_SIZE:
+                        yield sink.drain()
+            if sink.pending >= ARCHIVE_CHUNK_SIZE:
+                yield sink.drain()
+    # Central directory, written when the ZipFile closes
+    if sink.pending:
+        yield sink.drain()
@@ -0,0 +1,194 @@
+"""
+Collaboration backplane
+Pub/sub between server workers, so editors connected to different uvicorn
+workers see each other's edits, presence and cursors.
+
+Backends, selected with COLLAB_BACKPLANE:
+- local: single worker, nothing is published (the default)
+- sqlite: a shared SQLite file polled by every worker on the same host
+  (COLLAB_BACKPLANE_PATH, COLLAB_BACKPLANE_POLL_MS)
+- "package.module:factory": any other broker. The factory is called with no
+  arguments and must return a Backplane; register_backplane() does the same
+  for code that is imported anyway.
+"""
+
+import asyncio
+import importlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Optional
+
+COLLAB_BACKPLANE = os.getenv("COLLAB_BACKPLANE", "local")
+COLLAB_BACKPLANE_PATH = os.getenv("COLLAB_BACKPLANE_PATH", "./collab_backplane.db")
+COLLAB_BACKPLANE_POLL_MS = int(os.getenv("COLLAB_BACKPLANE_POLL_MS", "50"))
+
+# Identifies this process in published messages
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+Handler = Callable[[dict], Awaitable[None]]
+
+
+class Backplane:
+    """
+    Interface for backplanes. Messages are JSON-serializable dicts; the
+    backplane adds "origin" and never hands a worker its own messages.
+    """
+
+    name = "base"
+    worker_id = WORKER_ID
+
+    async def start(self, handler: Handler):
+        """Start delivering messages from other workers to `handler`"""
+
+    async def publish(self, message: dict):
+        """Send a message to all other workers"""
+
+    async def stop(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "worker_id": self.worker_id}
+
+
+class LocalBackplane(Backplane):
+    """Single worker: there is nobody to publish to"""
+
+    name = "local"
+
+
+class SQLiteBackplane(Backplane):
+    """
+    Messages are appended to a table in a shared SQLite file and every worker
+    polls for rows newer than the last one it has seen. Old rows are pruned.
+    Good enough for a handful of workers on one host; use an external broker
+    across hosts.
+    """
+
+    name = "sqlite"
+    RETENTION_SECONDS = 60
+
+    def __init__(self, path: str = COLLAB_BACKPLANE_PATH, poll_interval: float = COLLAB_BACKPLANE_POLL_MS / 1000):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()  # Polls and publishes run in different threads
+        self._task: Optional[asyncio.Task] = None
+        self._last_id = 0
+        self.published = 0
+        self.received = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS collab_messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    origin TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created REAL NOT NULL
+                )
+            """)
+            self._conn = conn
+        return self._conn
+
+    def _init(self):
+        # Start after the newest existing row: history is not replayed
+        with self._db_lock:
+            row = self._connect().execute("SELECT MAX(id) FROM collab_messages").fetchone()
+        self._last_id = row[0] or 0
+
+    def _insert(self, payload: str):
+        with self._db_lock:
+            self._connect().execute(
+                "INSERT INTO collab_messages (origin, payload, created) VALUES (?, ?, ?)",
+                (self.worker_id, payload, time.time())
+            )
+
+    def _fetch(self):
+        with self._db_lock:
+            rows = self._connect().execute(
+                "SELECT id, origin, payload FROM collab_messages WHERE id > ? ORDER BY id",
+                (self._last_id,)
+            ).fetchall()
+        if rows:
+            self._last_id = rows[-1][0]
+        return rows
+
+    def _prune(self):
+        with self._db_lock:
+            self._connect().execute("DELETE FROM collab_messages WHERE created < ?", (time.time() - self.RETENTION_SECONDS,))
+
+    async def start(self, handler: Handler):
+        await asyncio.to_thread(self._init)
+        self._task = asyncio.create_task(self._poll(handler))
+
+    async def _poll(self, handler: Handler):
+        last_prune = time.monotonic()
+        while True:
+            try:
+                rows = await asyncio.to_thread(self._fetch)
+                for _, origin, payload in rows:
+                    if origin == self.worker_id:
+                        continue
+                    self.received += 1
+                    try:
+                        await handler(json.loads(payload))
+                    except Exception as e:
+                        print(f"Backplane handler error: {e}")
+                if time.monotonic() - last_prune > self.RETENTION_SECONDS:
+                    await asyncio.to_thread(self._prune)
+                    last_prune = time.monotonic()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Backplane poll error: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def publish(self, message: dict):
+        payload = json.dumps({**message, "origin": self.worker_id})
+        await asyncio.to_thread(self._insert, payload)
+        self.published += 1
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> dict:
+        return {**super().stats(), "path": os.path.abspath(self.path), "published": self.published, "received": self.received}
+
+
+_registry: Dict[str, Callable[[], Backplane]] = {
+    "local": LocalBackplane,
+    "sqlite": SQLiteBackplane,
+}
+
+
+def register_backplane(name: str, factory: Callable[[], Backplane]):
+    """Make a backplane available under COLLAB_BACKPLANE=<name>"""
+    _registry[name] = factory
+
+
+def create_backplane(name: str = COLLAB_BACKPLANE) -> Backplane:
+    if name in _registry:
+        return _registry[name]()
+    if ":" in name:
+        module_name, _, attr = name.partition(":")
+        factory = getattr(importlib.import_module(module_name), attr)
+        return factory()
+    raise ValueError(f"Unknown COLLAB_BACKPLANE: {name}")
@@ -0,0 +1,926 @@
+"""
+Collaborative editing rooms
+Tracks the WebSocket connections editing each file and relays edits,
+presence and cursors. With a shared backplane, rooms span all workers:
+edits are forwarded to the other workers and each worker publishes the
+users and cursors it holds, which are merged into the lists clients see.
+
+Text files get a shared document per room (see ot.py). Clients that send
+{"type": "sync", "version": v} get the text, or the operations since v,
+and then exchange operations instead of the whole file:
+- client -> server {"type": "op", "version": base, "op": [...], "id": ...}
+- server -> sender {"type": "ack", "version": n, "id": ...}
+- server -> others {"type": "op", "version": n, "op": [...], "id": ...}
+Clients that never sync keep sending and receiving full content_update
+messages; their edits are diffed into operations.
+
+Across workers, the worker with the lowest id among those with editors in
+the room is the authority: it orders and applies every operation and
+publishes the result, the other workers forward their clients' operations
+to it and keep replicas.
+
+Documents are written back to disk by the authority (write-behind): once
+edits pause for COLLAB_FLUSH_DELAY_SECONDS, at least every
+COLLAB_FLUSH_MAX_DELAY_SECONDS while they don't, when the last editor on
+the worker leaves and on shutdown.
+"""
+
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from fastapi import WebSocket
+
+from . import dir_sizes, executors, search, usage
+from .backplane import Backplane, create_backplane
+from .listing_cache import listing_cache
+from .ot import Document, OperationError, StaleVersion, diff
+from .uploads import write_text_atomic
+
+# Workers republish their presence this often; entries from workers that
+# stop doing so (e.g. crashed) are dropped after the timeout
+PRESENCE_HEARTBEAT_SECONDS = 10
+PRESENCE_TIMEOUT_SECONDS = 30
+
+# Outbound messages queued per connection before the slow-consumer policy applies
+COLLAB_SEND_QUEUE_SIZE = int(os.getenv("COLLAB_SEND_QUEUE_SIZE", "256"))
+# drop: discard new messages, coalesce: replace superseded snapshots and
+# disconnect if still full, disconnect: close the socket
+COLLAB_SLOW_CONSUMER_POLICY = os.getenv("COLLAB_SLOW_CONSUMER_POLICY", "coalesce").lower()
+COLLAB_SEND_TIMEOUT_SECONDS = float(os.getenv("COLLAB_SEND_TIMEOUT_SECONDS", "10"))
+SLOW_CONSUMER_POLICIES = ("drop", "coalesce", "disconnect")
+
+# Larger files are not loaded as shared documents; their rooms relay full content
+COLLAB_DOCUMENT_MAX_BYTES = int(os.getenv("COLLAB_DOCUMENT_MAX_BYTES", str(5 * 1024 * 1024)))
+# How long a worker joining a room waits for the current text from the authority
+COLLAB_SNAPSHOT_TIMEOUT_SECONDS = float(os.getenv("COLLAB_SNAPSHOT_TIMEOUT_SECONDS", "2"))
+# Write-behind: flush once edits pause this long, and at least this often while they don't
+COLLAB_FLUSH_DELAY_SECONDS = float(os.getenv("COLLAB_FLUSH_DELAY_SECONDS", "2"))
+COLLAB_FLUSH_MAX_DELAY_SECONDS = float(os.getenv("COLLAB_FLUSH_MAX_DELAY_SECONDS", "10"))
+
+# Cursor moves and presence changes are batched per room and sent once per tick
+COLLAB_CURSOR_TICK_MS = max(1.0, float(os.getenv("COLLAB_CURSOR_TICK_MS", "30")))
+
+# Fan-out latency samples kept per room
+LATENCY_SAMPLES = 500
+
+# WebSocket close codes for clients that can't keep up (1013: try again
+# later) and for sockets a send failed on (1011: server error); either way
+# the client reconnects and resyncs
+WS_CLOSE_SLOW_CONSUMER = 1013
+WS_CLOSE_SEND_FAILED = 1011
+
+
+def _percentiles(samples) -> dict:
+    ordered = sorted(samples)
+    if not ordered:
+        return {"count": 0, "p50_ms": None, "p95_ms": None, "max_ms": None}
+    pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+    return {"count": len(ordered), "p50_ms": pick(0.5), "p95_ms": pick(0.95), "max_ms": round(ordered[-1] * 1000, 2)}
+
+
+class RoomStats:
+    """Counters for one room; latency is enqueue-to-sent per message"""
+
+    def __init__(self):
+        self.latency = deque(maxlen=LATENCY_SAMPLES)
+        self.joins = 0
+        self.leaves = 0
+        self.peak_connections = 0
+        self.received = 0
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.disconnected = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "joins": self.joins,
+            "leaves": self.leaves,
+            "peak_connections": self.peak_connections,
+            "received": self.received,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "slow_disconnects": self.disconnected,
+            "fanout_latency": _percentiles(self.latency),
+        }
+
+
+class ClientSender:
+    """
+    Bounded outbound queue for one socket, drained by its own writer task,
+    so a slow client only delays its own messages. Messages with a
+    coalesce key are snapshots (user lists, cursors, full content): a newer
+    one replaces a queued one with the same key instead of queueing behind it.
+    """
+
+    def __init__(self, websocket: WebSocket, stats: RoomStats, on_dead: Callable[[], None],
+                 max_queue: int = COLLAB_SEND_QUEUE_SIZE, policy: str = COLLAB_SLOW_CONSUMER_POLICY):
+        self.websocket = websocket
+        self.stats = stats
+        self.max_queue = max_queue
+        self.policy = policy if policy in SLOW_CONSUMER_POLICIES else "coalesce"
+        self._on_dead = on_dead
+        self._queue: deque = deque()  # [coalesce_key, message, enqueued_at]
+        self._pending: Dict[str, list] = {}  # coalesce_key -> queued entry
+        self._wakeup = asyncio.Event()
+        self._closed = False
+        self._task = asyncio.create_task(self._run())
+
+    def send(self, message: str, coalesce_key: Optional[str] = None):
+        if self._closed:
+            return
+        now = time.perf_counter()
+        if coalesce_key is not None and self.policy == "coalesce":
+            entry = self._pending.get(coalesce_key)
+            if entry is not None:
+                # Keep the queue position, send the newest state
+                entry[1] = message
+                self.stats.coalesced += 1
+                return
+        if len(self._queue) >= self.max_queue:
+            if self.policy == "drop":
+                self.stats.dropped += 1
+                return
+            self.stats.disconnected += 1
+            self._fail(WS_CLOSE_SLOW_CONSUMER)
+            return
+        entry = [coalesce_key, message, now]
+        self._queue.append(entry)
+        if coalesce_key is not None:
+            self._pending[coalesce_key] = entry
+        self._wakeup.set()
+
+    async def _run(self):
+        try:
+            while True:
+                if not self._queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                entry = self._queue.popleft()
+                if entry[0] is not None and self._pending.get(entry[0]) is entry:
+                    del self._pending[entry[0]]
+                await asyncio.wait_for(self.websocket.send_text(entry[1]), COLLAB_SEND_TIMEOUT_SECONDS)
+                self.stats.sent += 1
+                self.stats.latency.append(time.perf_counter() - entry[2])
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            # Stalled past the timeout
+            self._fail(WS_CLOSE_SLOW_CONSUMER)
+        except Exception:
+            # Closed or broken
+            self._fail(WS_CLOSE_SEND_FAILED)
+
+    def _fail(self, close_code: int):
+        """Leave the room and close the socket, so a client that is still there reconnects"""
+        if self._closed:
+            return
+        self.close()
+        asyncio.create_task(self._close_socket(close_code))
+        self._on_dead()
+
+    async def _close_socket(self, close_code: int):
+        try:
+            await asyncio.wait_for(self.websocket.close(code=close_code), COLLAB_SEND_TIMEOUT_SECONDS)
+        except Exception:
+            pass
+
+    def close(self):
+        self._closed = True
+        self._queue.clear()
+        self._pending.clear()
+        if self._task is not asyncio.current_task():
+            self._task.cancel()
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+
+class Connection:
+    """One client socket in a room"""
+
+    __slots__ = ("id", "websocket", "username", "room", "can_write", "cursor_position", "last_seen", "sender", "synced")
+
+    def __init__(self, conn_id: str, websocket: WebSocket, username: str, room: str, can_write: bool = True):
+        self.id = conn_id
+        self.websocket = websocket
+        self.username = username
+        self.room = room
+        self.can_write = can_write  # Read-only editors may follow the document but not change it
+        self.cursor_position = 0
+        self.last_seen = time.time()
+        self.sender: Optional[ClientSender] = None
+        self.synced = False  # Speaks the operation protocol
+
+    def cursor(self) -> dict:
+        return {"id": self.id, "username": self.username, "position": self.cursor_position}
+
+
+def _read_document(file_path: str) -> Optional[str]:
+    """File content if it is UTF-8 text small enough to edit collaboratively"""
+    try:
+        if os.path.getsize(file_path) > COLLAB_DOCUMENT_MAX_BYTES:
+            return None
+        # Newlines are normalized to \n, as browsers do in text areas
+        with open(file_path, "r", encoding="utf-8") as f:
+            return f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def _write_document(file_path: str, content: str) -> Optional[int]:
+    """
+    Atomically replace the file with `content` (temp file and rename) and
+    return the change in its size. Returns None without writing if the file
+    is gone, e.g. deleted or renamed while open, so a flush doesn't bring it back.
+    """
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    write_text_atomic(file_path, content)
+    return os.stat(file_path).st_size - st.st_size
+
+
+class RoomDocument:
+    """A room's shared text and its replication and persistence state on this worker"""
+
+    def __init__(self, document: Document):
+        self.document = document
+        self.ready = asyncio.Event()  # Set once in step with the authority
+        self.forwarded: Dict[str, str] = {}  # op id -> submitting connection id, for ops sent to the authority
+        self.flushed_version: Optional[int] = document.version  # None if unknown
+        self.changed_at = 0.0
+        self.flush_task: Optional[asyncio.Task] = None
+        self.flush_lock = asyncio.Lock()
+
+    @property
+    def dirty(self) -> bool:
+        return self.flushed_version != self.document.version
+
+
+class ConnectionManager:
+    def __init__(self, backplane: Backplane = None):
+        # Registry: connection id -> Connection, indexed by room (file_path)
+        # and by user; dicts keep join order and make join/leave O(1)
+        self.connections: Dict[str, Connection] = {}
+        self.active_connections: Dict[str, Dict[str, Connection]] = {}
+        self.user_connections: Dict[str, Dict[str, Connection]] = {}
+        self.connections_opened = 0
+        self.connections_closed = 0
+        self.messages_received = 0
+        # Map file_path -> {worker_id: {"users", "cursors", "seen"}} for other workers
+        self.remote_presence: Dict[str, Dict[str, dict]] = {}
+        self.room_stats: Dict[str, RoomStats] = {}
+        # Map file_path -> RoomDocument, or None for files that can't be shared as text
+        self.documents: Dict[str, Optional[RoomDocument]] = {}
+        self._loading: Dict[str, asyncio.Task] = {}
+        self._flushes: set = set()  # Flushes started on last disconnect
+        self._saves: Dict[str, asyncio.Future] = {}  # save request id -> reply from the authority
+        self.flush_count = 0
+        # Presence batched until the next tick
+        self._pending_full: set = set()  # Rooms whose user list changed: full users and cursors
+        self._pending_cursors: Dict[str, Dict[str, dict]] = {}  # room -> connection id -> moved cursor
+        self._pending_publish: set = set()  # Rooms whose local presence other workers haven't seen
+        self._tick_scheduled = False
+        self.backplane = backplane or create_backplane()
+        self._heartbeat_task = None
+
+    async def start(self):
+        await self.backplane.start(self._on_backplane_message)
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def stop(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        # Don't lose buffered edits on a graceful restart
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+        for file_path, room_doc in list(self.documents.items()):
+            if room_doc is not None and self._is_authority(file_path):
+                await self._flush(file_path, room_doc)
+        await self.backplane.stop()
+
+    async def connect(self, websocket: WebSocket, file_path: str, username: str, can_write: bool = True) -> Connection:
+        await websocket.accept()
+        conn = Connection(uuid.uuid4().hex[:12], websocket, username, file_path, can_write)
+        stats = self.room_stats.setdefault(file_path, RoomStats())
+        conn.sender = ClientSender(websocket, stats, lambda: self._on_dead_connection(conn))
+        self.connections[conn.id] = conn
+        room = self.active_connections.setdefault(file_path, {})
+        room[conn.id] = conn
+        self.user_connections.setdefault(username, {})[conn.id] = conn
+        self.connections_opened += 1
+        stats.joins += 1
+        stats.peak_connections = max(stats.peak_connections, len(room))
+        # Send current user list and cursor positions
+        await self.broadcast_user_list(file_path)
+        return conn
+
+    def disconnect(self, conn: Connection):
+        if self.connections.pop(conn.id, None) is None:
+            return
+        conn.sender.close()
+        self.connections_closed += 1
+        user = self.user_connections.get(conn.username)
+        if user is not None:
+            user.pop(conn.id, None)
+            if not user:
+                del self.user_connections[conn.username]
+
+        file_path = conn.room
+        room = self.active_connections[file_path]
+        self.room_stats[file_path].leaves += 1
+        if len(room) > 1:
+            del room[conn.id]
+            return
+        was_authority = self._is_authority(file_path)
+        del self.active_connections[file_path]
+        self.room_stats.pop(file_path, None)
+        room_doc = self.documents.pop(file_path, None)
+        if room_doc is not None and room_doc.dirty and was_authority:
+            task = asyncio.create_task(self._flush(file_path, room_doc))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    def _on_dead_connection(self, conn: Connection):
+        """A send failed or the client fell too far behind: drop it from the room"""
+        if conn.id not in self.connections:
+            return
+        self.disconnect(conn)
+        asyncio.create_task(self.broadcast_user_list(conn.room))
+
+    def get(self, conn_id: str) -> Optional[Connection]:
+        return self.connections.get(conn_id)
+
+    def connections_for_user(self, username: str) -> List[Connection]:
+        return list(self.user_connections.get(username, {}).values())
+
+    def touch(self, conn: Connection):
+        """Record a message received from the client"""
+        conn.last_seen = time.time()
+        self.messages_received += 1
+        stats = self.room_stats.get(conn.room)
+        if stats is not None:
+            stats.received += 1
+
+    @property
+    def connection_count(self) -> int:
+        return len(self.connections)
+
+    def is_room_active(self, file_path: str) -> bool:
+        """Whether anyone, on any worker, has the file open"""
+        if file_path in self.active_connections:
+            return True
+        return any(entry["users"] for entry in self.remote_presence.get(file_path, {}).values())
+
+    # --- Presence ---
+
+    def _room(self, file_path: str):
+        room = self.active_connections.get(file_path)
+        return room.values() if room else ()
+
+    def _local_users(self, file_path: str) -> List[str]:
+        return [conn.username for conn in self._room(file_path)]
+
+    def _local_cursors(self, file_path: str) -> List[dict]:
+        return [conn.cursor() for conn in self._room(file_path)]
+
+    def _all_users(self, file_path: str) -> List[str]:
+        users = self._local_users(file_path)
+        for entry in self.remote_presence.get(file_path, {}).values():
+            users.extend(entry["users"])
+        return users
+
+    def _all_cursors(self, file_path: str) -> List[dict]:
+        cursors = self._local_cursors(file_path)
+        for entry in self.remote_presence.get(file_path, {}).values():
+            cursors.extend(entry["cursors"])
+        return cursors
+
+    async def _send_local(self, file_path: str, message: str, sender: Connection = None, coalesce_key: str = None):
+        """Queue a message for every local connection in the room; never blocks on a client"""
+        for conn in self._room(file_path):
+            if conn is not sender:
+                conn.sender.send(message, coalesce_key)
+
+    async def _publish_presence(self, file_path: str):
+        await self.backplane.publish({
+            "kind": "presence",
+            "room": file_path,
+            "users": self._local_users(file_path),
+            "cursors": self._local_cursors(file_path),
+        })
+
+    def _schedule_tick(self):
+        if not self._tick_scheduled:
+            self._tick_scheduled = True
+            asyncio.get_running_loop().call_later(COLLAB_CURSOR_TICK_MS / 1000, self._run_tick)
+
+    def _run_tick(self):
+        self._tick_scheduled = False
+        asyncio.create_task(self._flush_presence())
+
+    async def _flush_presence(self):
+        """
+        Send what changed since the last tick: the full user list and cursors
+        for rooms where someone joined or left, otherwise only the cursors
+        that moved, in one message per client.
+        """
+        full, self._pending_full = self._pending_full, set()
+        moved, self._pending_cursors = self._pending_cursors, {}
+        publish, self._pending_publish = self._pending_publish, set()
+        try:
+            for file_path in full:
+                if file_path in self.active_connections:
+                    await self._send_local(file_path, json.dumps({"type": "users_update", "users": self._all_users(file_path)}), coalesce_key="users_update")
+                    await self._send_local(file_path, json.dumps({"type": "cursors_update", "cursors": self._all_cursors(file_path)}), coalesce_key="cursors_update")
+            for file_path, cursors in moved.items():
+                if file_path in full:
+                    continue
+                message = json.dumps({"type": "cursors_update", "partial": True, "cursors": list(cursors.values())})
+                for conn in self._room(file_path):
+                    # Nobody needs to hear only about their own cursor
+                    if len(cursors) > 1 or conn.id not in cursors:
+                        conn.sender.send(message)
+            for file_path in publish:
+                await self._publish_presence(file_path)
+        except Exception as e:
+            print(f"Presence tick error: {e}")
+
+    async def broadcast_user_list(self, file_path: str):
+        """Send the user list and all cursors to the room on the next tick"""
+        self._pending_full.add(file_path)
+        self._pending_publish.add(file_path)
+        self._schedule_tick()
+
+    async def broadcast_cursors(self, file_path: str):
+        """Send all cursor positions to the room on the next tick"""
+        await self.broadcast_user_list(file_path)
+
+    def update_cursor(self, conn: Connection, position: int):
+        """Record a cursor move; it goes out with the next tick"""
+        if conn.id not in self.connections:
+            return False
+        conn.cursor_position = position
+        self._pending_cursors.setdefault(conn.room, {})[conn.id] = conn.cursor()
+        self._pending_publish.add(conn.room)
+        self._schedule_tick()
+        return True
+
+    # --- Edits ---
+
+    async def broadcast_change(self, message: str, file_path: str, sender: Optional[Connection], coalesce_key: str = None):
+        """
+        Relay an edit to everyone else in the room. Pass a coalesce_key for
+        messages that carry the whole state (e.g. full content), so a client
+        that is behind only receives the newest one.
+        """
+        if file_path in self.active_connections:
+            await self._send_local(file_path, message, sender, coalesce_key)
+        await self.backplane.publish({"kind": "change", "room": file_path, "message": message, "coalesce_key": coalesce_key})
+
+    def _authority(self, file_path: str) -> str:
+        workers = list(self.remote_presence.get(file_path, {}))
+        if file_path in self.active_connections:
+            workers.append(self.backplane.worker_id)
+        return min(workers) if workers else self.backplane.worker_id
+
+    def _is_authority(self, file_path: str) -> bool:
+        return self._authority(file_path) == self.backplane.worker_id
+
+    async def _get_document(self, file_path: str) -> Optional[RoomDocument]:
+        """The room's document, loading it (or fetching it from the authority) on first use"""
+        if file_path in self.documents:
+            room_doc = self.documents[file_path]
+        else:
+            task = self._loading.get(file_path)
+            if task is None:
+                task = asyncio.create_task(self._load_document(file_path))
+                self._loading[file_path] = task
+                task.add_done_callback(lambda _: self._loading.pop(file_path, None))
+            room_doc = await asyncio.shield(task)
+        if room_doc is not None:
+            await room_doc.ready.wait()
+        return room_doc
+
+    async def _load_document(self, file_path: str) -> Optional[RoomDocument]:
+        content = await executors.run_disk(_read_document, file_path)
+        room_doc = RoomDocument(Document(content)) if content is not None else None
+        if file_path not in self.active_connections:
+            # Everyone left while loading
+            return room_doc
+        self.documents[file_path] = room_doc
+        if room_doc is None:
+            return None
+        if self._is_authority(file_path):
+            room_doc.ready.set()
+            return room_doc
+        await self.backplane.publish({"kind": "snapshot_request", "room": file_path, "to": self._authority(file_path)})
+        try:
+            await asyncio.wait_for(room_doc.ready.wait(), COLLAB_SNAPSHOT_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            # The file on disk is the best we have; ops from the authority will resync us
+            print(f"No snapshot from the authority for {file_path}, using the file on disk")
+            room_doc.ready.set()
+        return room_doc
+
+    def _send_snapshot(self, conn: Connection, document: Document):
+        conn.sender.send(json.dumps({"type": "sync", "version": document.version, "content": document.content}))
+
+    def _refuse_edit(self, conn: Connection):
+        conn.sender.send(json.dumps({"type": "error", "code": "ERR_READ_ONLY", "message": "You have read-only access to this file"}))
+
+    async def handle_document_message(self, conn: Connection, message: dict) -> bool:
+        """
+        Handle a sync, op or content_update message. Returns False for a
+        content_update when the file has no shared document (binary or too
+        large), in which case the caller relays it as it is. Edits from a
+        read-only connection are refused and answered with the current text.
+        """
+        kind = message.get("type")
+        file_path = conn.room
+        if kind in ("op", "content_update") and not conn.can_write:
+            self._refuse_edit(conn)
+            room_doc = await self._get_document(file_path)
+            if room_doc is not None and conn.id in self.connections:
+                self._send_snapshot(conn, room_doc.document)
+            return True
+        room_doc = await self._get_document(file_path)
+        if room_doc is None:
+            if kind == "content_update":
+                return False
+            # No shared document: the client keeps sending full content
+            conn.sender.send(json.dumps({"type": "sync", "version": None}))
+            return True
+        if conn.id not in self.connections:
+            return True
+        document = room_doc.document
+        if kind == "sync":
+            conn.synced = True
+            version = message.get("version")
+            entries = document.history_since(version) if type(version) is int else None
+            if entries is None:
+                self._send_snapshot(conn, document)
+            else:
+                conn.sender.send(json.dumps({
+                    "type": "sync",
+                    "version": document.version,
+                    "from": version,
+                    "ops": [{"op": op, "id": op_id} for op, op_id in entries],
+                }))
+        elif kind == "op":
+            op_id = message.get("id")
+            await self._submit(conn, file_path, room_doc, message.get("version"), message.get("op"), str(op_id) if op_id else None)
+        else:
+            content = message.get("content")
+            if isinstance(content, str) and content != document.content:
+                await self._submit(conn, file_path, room_doc, document.version, diff(document.content, content), None)
+        return True
+
+    async def _submit(self, conn: Connection, file_path: str, room_doc: RoomDocument, base_version, op, op_id: Optional[str]):
+        if self._is_authority(file_path):
+            if not await self._apply(file_path, room_doc, base_version, op, op_id, conn.id):
+                self._send_snapshot(conn, room_doc.document)
+            return
+        op_id = op_id or uuid.uuid4().hex
+        room_doc.forwarded[op_id] = conn.id
+        await self.backplane.publish({
+            "kind": "op_submit",
+            "room": file_path,
+            "to": self._authority(file_path),
+            "version": base_version,
+            "op": op,
+            "id": op_id,
+        })
+
+    async def _apply(self, file_path: str, room_doc: RoomDocument, base_version, op, op_id: Optional[str],
+                     submitter: Optional[str]) -> bool:
+        """Authority only: apply an operation, deliver it locally and publish it to the replicas"""
+        document = room_doc.document
+        try:
+            if type(base_version) is not int:
+                raise OperationError("Missing base version")
+            applied = document.apply(base_version, op, op_id)
+        except (OperationError, StaleVersion) as e:
+            print(f"Rejected operation for {file_path}: {e}")
+            return False
+        self._deliver_op(file_path, document, applied, op_id, submitter)
+        self._schedule_flush(file_path, room_doc)
+        await self.backplane.publish({
+            "kind": "op_applied",
+            "room": file_path,
+            "version": document.version,
+            "op": applied,
+            "id": op_id,
+        })
+        return True
+
+    def _deliver_op(self, file_path: str, document: Document, op: list, op_id: Optional[str], submitter: Optional[str]):
+        """
+        Send an applied operation to local clients: an ack to the submitting
+        connection, the op to the others, full content to clients without the protocol
+        """
+        op_message = None
+        content_message = None
+        for conn in self._room(file_path):
+            if not conn.synced:
+                if conn.id != submitter:
+                    content_message = content_message or json.dumps({"type": "content_update", "content": document.content})
+                    conn.sender.send(content_message, "content_update")
+            elif conn.id == submitter:
+                conn.sender.send(json.dumps({"type": "ack", "version": document.version, "id": op_id}))
+            else:
+                op_message = op_message or json.dumps({"type": "op", "version": document.version, "op": op, "id": op_id})
+                conn.sender.send(op_message)
+
+    # --- Persistence ---
+
+    def _schedule_flush(self, file_path: str, room_doc: RoomDocument):
+        room_doc.changed_at = time.monotonic()
+        if room_doc.flush_task is None:
+            room_doc.flush_task = asyncio.create_task(self._flush_later(file_path, room_doc))
+
+    async def _flush_later(self, file_path: str, room_doc: RoomDocument):
+        started = time.monotonic()
+        try:
+            while True:
+                now = time.monotonic()
+                idle = now - room_doc.changed_at
+                if idle >= COLLAB_FLUSH_DELAY_SECONDS or now - started >= COLLAB_FLUSH_MAX_DELAY_SECONDS:
+                    break
+                await asyncio.sleep(min(COLLAB_FLUSH_DELAY_SECONDS - idle, COLLAB_FLUSH_MAX_DELAY_SECONDS - (now - started)))
+        finally:
+            room_doc.flush_task = None
+        if self._is_authority(file_path):
+            await self._flush(file_path, room_doc)
+
+    async def _flush(self, file_path: str, room_doc: RoomDocument) -> bool:
+        """Write the document back if it changed; returns whether the file now holds it"""
+        async with room_doc.flush_lock:
+            if not room_doc.dirty:
+                return True
+            document = room_doc.document
+            version, content = document.version, document.content
+            try:
+                size_change = await executors.run_disk(_write_document, file_path, content)
+            except OSError as e:
+                print(f"Error writing {file_path}: {e}")
+                return False
+            room_doc.flushed_version = version
+            if size_change is None:
+                return False
+            self.flush_count += 1
+            listing_cache.invalidate_parent(file_path)
+            if size_change:
+                await executors.run_db(usage.ledger.record, file_path, size_change)
+                await executors.run_db(dir_sizes.index.record, file_path, size_change)
+            await executors.run_db(search.index.updated, file_path)
+            return True
+
+    async def save_document(self, file_path: str, version: Optional[int], content: str) -> Optional[bool]:
+        """
+        Explicit save from an editor using the operation protocol. content is
+        its text at `version`; if it still differs from the document at that
+        version, the difference is applied as an operation first so edits the
+        client hadn't sent are kept. The save is made by the authority.
+        Returns True once the file holds the document, False if there is no
+        shared document (the caller writes content itself) and None if the
+        worker holding it didn't answer.
+        """
+        if self._is_authority(file_path):
+            room_doc = self.documents.get(file_path)
+            if room_doc is None:
+                return False
+            return await self._save(file_path, room_doc, version, content)
+        request_id = uuid.uuid4().hex
+        reply = asyncio.get_running_loop().create_future()
+        self._saves[request_id] = reply
+        try:
+            await self.backplane.publish({
+                "kind": "save",
+                "room": file_path,
+                "to": self._authority(file_path),
+                "version": version,
+                "content": content,
+                "id": request_id,
+            })
+            return await asyncio.wait_for(reply, COLLAB_SNAPSHOT_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self._saves.pop(request_id, None)
+
+    async def _save(self, file_path: str, room_doc: RoomDocument, version, content) -> bool:
+        """Authority only: apply what the saving client hadn't sent, then write the document"""
+        document = room_doc.document
+        if isinstance(content, str):
+            content = content.replace("\r\n", "\n")
+            # Older versions can't be diffed against; the client only saves once its edits are acknowledged
+            if version == document.version and content != document.content:
+                op = await executors.run_cpu(diff, document.content, content)
+                await self._apply(file_path, room_doc, version, op, None, None)
+        return await self._flush(file_path, room_doc)
+
+    async def replace_content(self, file_path: str, content: str) -> bool:
+        """
+        The whole file was written (upload, or a save from a client without
+        the operation protocol): turn it into an operation on the shared
+        document. Returns False if this worker has no document for the room,
+        in which case the caller should broadcast the full content.
+        """
+        content = content.replace("\r\n", "\n")
+        room_doc = self.documents.get(file_path)
+        if room_doc is None or not room_doc.ready.is_set():
+            if file_path in self.remote_presence:
+                await self.backplane.publish({"kind": "replace", "room": file_path, "content": content})
+            return False
+        document = room_doc.document
+        if content == document.content:
+            return True
+        # Diffing a large file takes a while; edits applied meanwhile are
+        # transformed against the diff like any concurrent operation
+        base_version = document.version
+        op = await executors.run_cpu(diff, document.content, content)
+        if self._is_authority(file_path):
+            await self._apply(file_path, room_doc, base_version, op, None, None)
+        else:
+            await self.backplane.publish({
+                "kind": "op_submit",
+                "room": file_path,
+                "to": self._authority(file_path),
+                "version": base_version,
+                "op": op,
+                "id": uuid.uuid4().hex,
+            })
+        return True
+
+    # --- Backplane ---
+
+    async def _on_backplane_message(self, message: dict):
+        room = message.get("room")
+        kind = message.get("kind")
+        if kind == "change":
+            await self._send_local(room, message["message"], coalesce_key=message.get("coalesce_key"))
+        elif kind in ("op_submit", "op_applied", "op_rejected", "snapshot_request", "snapshot", "replace", "save", "saved"):
+            if message.get("to", self.backplane.worker_id) == self.backplane.worker_id:
+                await self._on_document_message(room, kind, message)
+        elif kind == "presence":
+            rooms = self.remote_presence.setdefault(room, {})
+            previous = rooms.get(message["origin"])
+            if message["users"]:
+                rooms[message["origin"]] = {"users": message["users"], "cursors": message["cursors"], "seen": time.time()}
+            else:
+                rooms.pop(message["origin"], None)
+                if not rooms:
+                    del self.remote_presence[room]
+            room_doc = self.documents.get(room)
+            if room_doc is not None and room_doc.dirty and self._is_authority(room):
+                # Took over from a worker that left; its last flush may predate edits we hold
+                self._schedule_flush(room, room_doc)
+            if room not in self.active_connections:
+                return
+            # Heartbeats usually repeat what we already have
+            if previous is None or previous["users"] != message["users"]:
+                self._pending_full.add(room)
+                self._schedule_tick()
+            elif previous["cursors"] != message["cursors"]:
+                known = {cursor.get("id"): cursor for cursor in previous["cursors"]}
+                moved = self._pending_cursors.setdefault(room, {})
+                for cursor in message["cursors"]:
+                    if known.get(cursor.get("id")) != cursor:
+                        moved[cursor.get("id")] = cursor
+                self._schedule_tick()
+
+    async def _on_document_message(self, room: str, kind: str, message: dict):
+        if kind == "snapshot_request":
+            if room in self.active_connections:
+                # Loading may read the file; don't hold up the backplane
+                asyncio.create_task(self._send_snapshot_to(room, message["origin"]))
+            return
+
+        if kind == "saved":
+            reply = self._saves.get(message.get("id"))
+            if reply is not None and not reply.done():
+                reply.set_result(bool(message.get("saved")))
+            return
+
+        room_doc = self.documents.get(room)
+        if room_doc is None:
+            if kind == "op_submit":
+                await self.backplane.publish({"kind": "op_rejected", "room": room, "to": message["origin"], "id": message.get("id")})
+            elif kind == "save":
+                await self.backplane.publish({"kind": "saved", "room": room, "to": message["origin"], "id": message.get("id"), "saved": False})
+            return
+        document = room_doc.document
+
+        if kind == "save":
+            saved = self._is_authority(room) and await self._save(room, room_doc, message.get("version"), message.get("content"))
+            await self.backplane.publish({"kind": "saved", "room": room, "to": message["origin"], "id": message.get("id"), "saved": saved})
+        elif kind == "op_submit":
+            if not await self._apply(room, room_doc, message.get("version"), message.get("op"), message.get("id"), None):
+                await self.backplane.publish({"kind": "op_rejected", "room": room, "to": message["origin"], "id": message.get("id")})
+        elif kind == "replace":
+            if self._is_authority(room) and message["content"] != document.content:
+                await self._apply(room, room_doc, document.version, diff(document.content, message["content"]), None, None)
+        elif kind == "op_applied":
+            if self._is_authority(room):
+                # Another worker hadn't seen our presence yet; it resyncs from our ops
+                return
+            if message["version"] != document.version + 1:
+                # Missed an update
+                await self.backplane.publish({"kind": "snapshot_request", "room": room, "to": message["origin"]})
+                return
+            try:
+                document.apply(document.version, message["op"], message.get("id"))
+            except OperationError:
+                await self.backplane.publish({"kind": "snapshot_request", "room": room, "to": message["origin"]})
+                return
+            submitter = room_doc.forwarded.pop(message.get("id"), None)
+            self._deliver_op(room, document, message["op"], message.get("id"), submitter)
+        elif kind == "op_rejected":
+            conn = self.connections.get(room_doc.forwarded.pop(message.get("id"), None))
+            if conn is not None:
+                self._send_snapshot(conn, document)
+        elif kind == "snapshot":
+            if room_doc.ready.is_set() and message["version"] == document.version and message["content"] == document.content:
+                return
+            document.reset(message["content"], message["version"])
+            room_doc.flushed_version = None
+            if room_doc.ready.is_set():
+                # Clients have diverged from the new text: start them over
+                room_doc.forwarded.clear()
+                for conn in self._room(room):
+                    if conn.synced:
+                        self._send_snapshot(conn, document)
+                    else:
+                        conn.sender.send(json.dumps({"type": "content_update", "content": document.content}), "content_update")
+            room_doc.ready.set()
+
+    async def _send_snapshot_to(self, room: str, worker: str):
+        try:
+            room_doc = await self._get_document(room)
+            if room_doc is not None:
+                await self.backplane.publish({
+                    "kind": "snapshot",
+                    "room": room,
+                    "to": worker,
+                    "version": room_doc.document.version,
+                    "content": room_doc.document.content,
+                })
+        except Exception as e:
+            print(f"Error sending snapshot for {room}: {e}")
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(PRESENCE_HEARTBEAT_SECONDS)
+            try:
+                for file_path in list(self.active_connections):
+                    await self._publish_presence(file_path)
+                # Forget workers that went away without saying so
+                cutoff = time.time() - PRESENCE_TIMEOUT_SECONDS
+                for file_path, workers in list(self.remote_presence.items()):
+                    stale = [worker for worker, entry in workers.items() if entry["seen"] < cutoff]
+                    for worker in stale:
+                        del workers[worker]
+                    if not workers:
+                        del self.remote_presence[file_path]
+                    if stale and file_path in self.active_connections:
+                        self._pending_full.add(file_path)
+                        self._schedule_tick()
+            except Exception as e:
+                print(f"Presence heartbeat error: {e}")
+
+    def stats(self) -> dict:
+        return {
+            **self.backplane.stats(),
+            "connections": len(self.connections),
+            "connected_users": len(self.user_connections),
+            "connections_opened": self.connections_opened,
+            "connections_closed": self.connections_closed,
+            "messages_received": self.messages_received,
+            "local_rooms": len(self.active_connections),
+            "documents": sum(1 for room_doc in self.documents.values() if room_doc is not None),
+            "dirty_documents": sum(1 for room_doc in self.documents.values() if room_doc is not None and room_doc.dirty),
+            "document_flushes": self.flush_count,
+            "remote_rooms": len(self.remote_presence),
+            "cursor_tick_ms": COLLAB_CURSOR_TICK_MS,
+            "slow_consumer_policy": COLLAB_SLOW_CONSUMER_POLICY,
+            "send_queue_size": COLLAB_SEND_QUEUE_SIZE,
+            "queued_messages": sum(conn.sender.queued for conn in self.connections.values()),
+            "rooms": {
+                room: {**stats.to_dict(), "connections": len(self.active_connections.get(room, ()))}
+                for room, stats in self.room_stats.items()
+            },
+        }
+
+
+manager = ConnectionManager()
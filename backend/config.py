@@ -36,6 +36,38 @@ DEFAULT_CONFIG = {
         "max_concurrent_connections": 100,
         "max_folder_upload_files": 1000,
     },
+    "uploads": {
+        "max_resumable_file_size_mb": 10240,
+        "resumable_chunk_size_mb": 8,  # Chunk size suggested to clients
+        "resumable_session_ttl_hours": 24,  # Sessions idle this long are garbage-collected
+    },
+    "downloads": {
+        # Cache-Control per media type: exact type, then major type, then "default"
+        "cache_control": {
+            "default": "private, no-cache",
+            "image": "private, max-age=3600",
+            "video": "private, max-age=3600",
+            "audio": "private, max-age=3600",
+        },
+    },
+    "database": {  # Read at startup
+        "url": "",  # SQLAlchemy URL; empty uses the SQLite file at path
+        "path": "./fileserver.db",
+        "pool_size": 10,
+        "max_overflow": 20,
+        "pool_timeout_seconds": 30,
+        # SQLite only
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "busy_timeout_ms": 5000,
+        "cache_size_mb": 64,
+        "mmap_size_mb": 256,
+    },
+    "cache": {
+        "listing_cache_enabled": True,
+        "listing_cache_max_entries": 200000,  # Total directory entries held across all cached listings
+        "listing_cache_ttl_seconds": 300,
+    },
     "smtp": {
         "enabled": False,
         "mode": "relay",
@@ -160,6 +192,39 @@ class ServerConfig:
                     if value and (not isinstance(value, int) or value <= 0):
                         return False, f"{key} must be a positive integer"
             
+            # Validate upload settings
+            if "uploads" in config:
+                for key in ["max_resumable_file_size_mb", "resumable_chunk_size_mb", "resumable_session_ttl_hours"]:
+                    value = config["uploads"].get(key)
+                    if value is not None and (not isinstance(value, (int, float)) or value <= 0):
+                        return False, f"{key} must be a positive number"
+            
+            # Validate cache settings
+            if "cache" in config:
+                max_entries = config["cache"].get("listing_cache_max_entries")
+                if max_entries is not None and (not isinstance(max_entries, int) or max_entries < 0):
+                    return False, "listing_cache_max_entries must be a non-negative integer"
+                ttl = config["cache"].get("listing_cache_ttl_seconds")
+                if ttl is not None and (not isinstance(ttl, (int, float)) or ttl < 0):
+                    return False, "listing_cache_ttl_seconds must be a non-negative number"
+            
+            # Validate database settings
+            if "database" in config:
+                for key in ["pool_size", "busy_timeout_ms"]:
+                    value = config["database"].get(key)
+                    if value is not None and (not isinstance(value, int) or value <= 0):
+                        return False, f"{key} must be a positive integer"
+                for key in ["max_overflow", "pool_timeout_seconds", "cache_size_mb", "mmap_size_mb"]:
+                    value = config["database"].get(key)
+                    if value is not None and (not isinstance(value, (int, float)) or value < 0):
+                        return False, f"{key} must be a non-negative number"
+                journal_mode = config["database"].get("journal_mode")
+                if journal_mode is not None and str(journal_mode).lower() not in ("wal", "delete", "truncate", "persist", "memory", "off"):
+                    return False, "journal_mode must be one of wal, delete, truncate, persist, memory, off"
+                synchronous = config["database"].get("synchronous")
+                if synchronous is not None and str(synchronous).lower() not in ("off", "normal", "full", "extra"):
+                    return False, "synchronous must be one of off, normal, full, extra"
+            
             return True, None
         except Exception as e:
             return False, f"Validation error: {str(e)}"
@@ -1,10 +1,27 @@
 from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.exc import IntegrityError
 import secrets
-from . import models, schemas, auth
+from . import models, schemas, auth, permissions, hashing
+from .principal_cache import principal_cache
+from .share_index import share_index
 
 def get_user(db: Session, username: str):
     return db.query(models.User).options(joinedload(models.User.groups)).filter(models.User.username == username).first()
 
+def detach_user(db: Session, user: models.User):
+    """
+    Detach a loaded user (and its groups and folder permissions) from the
+    session so it can be cached and shared across requests. Everything the
+    API reads from a user is loaded before detaching.
+    """
+    groups = list(user.groups)
+    for group in groups:
+        for fp in list(group.folder_permissions):
+            db.expunge(fp)
+        db.expunge(group)
+    db.expunge(user)
+    return user
+
 def get_users(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.User).options(joinedload(models.User.groups)).offset(skip).limit(limit).all()
 
@@ -39,6 +56,9 @@ def create_user(db: Session, user: schemas.UserCreate):
 def delete_user(db: Session, username: str):
     db.query(models.User).filter(models.User.username == username).delete()
     db.commit()
+    principal_cache.invalidate_user(username)
+    # Shares this user owned no longer resolve
+    share_index.invalidate_all()
 
 def update_user_password(db: Session, username: str, new_password: str):
     user = get_user(db, username)
@@ -47,6 +67,7 @@ def update_user_password(db: Session, username: str, new_password: str):
         user.require_password_change = False  # Clear the flag when password is changed
         db.commit()
         db.refresh(user)
+        principal_cache.invalidate_user(username)
     return user
 
 def update_user(db: Session, username: str, user_update: schemas.UserUpdate):
@@ -76,6 +97,11 @@ def update_user(db: Session, username: str, user_update: schemas.UserUpdate):
     
     db.commit()
     db.refresh(user)
+    principal_cache.invalidate_user(username)
+    principal_cache.invalidate_user(user.username)
+    if user_update.root_path is not None or user_update.username is not None:
+        # Shares this user owns resolve against their root
+        share_index.invalidate_all()
     return user
 
 # Group operations
@@ -161,11 +187,15 @@ def update_group(db: Session, group_name: str, group_update: schemas.GroupUpdate
     
     db.commit()
     db.refresh(db_group)
+    permissions.bump_version()
+    principal_cache.invalidate_all()
     return db_group
 
 def delete_group(db: Session, group_name: str):
     db.query(models.Group).filter(models.Group.name == group_name).delete()
     db.commit()
+    permissions.bump_version()
+    principal_cache.invalidate_all()
 
 def update_user_groups(db: Session, user: models.User, group_names: list[str]):
     # Clear existing groups
@@ -179,6 +209,8 @@ def update_user_groups(db: Session, user: models.User, group_names: list[str]):
     
     db.commit()
     db.refresh(user)
+    permissions.bump_version()
+    principal_cache.invalidate_user(user.username)
 
 def authenticate_user(db: Session, username: str, password: str):
     # Try fetching by username
@@ -189,8 +221,13 @@ def authenticate_user(db: Session, username: str, password: str):
         
     if not user:
         return False
-    if not auth.verify_password(password, user.hashed_password):
+    ok, new_hash = hashing.service.verify_and_update(password, user.hashed_password)
+    if not ok:
         return False
+    if new_hash:
+        # Stored hash uses an outdated scheme or cost; upgrade it now that we have the password
+        user.hashed_password = new_hash
+        db.commit()
     return user
 
 def update_password(db: Session, username: str, password: str):
@@ -210,8 +247,10 @@ def create_folder_share(db: Session, folder_path: str, owner_username: str, shar
     return db_share
 
 def generate_url_id():
-    chars = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
-    return "".join(secrets.choice(chars) for _ in range(16))
+    # 12 random bytes -> 16 URL-safe characters (96 bits). Collisions are
+    # practically impossible, so callers rely on the unique index as a backstop
+    # instead of probing the table with a SELECT per generated ID.
+    return secrets.token_urlsafe(12)
 
 def get_or_create_file_entry(db: Session, path: str, is_directory: bool = False) -> models.FileEntry:
     path = path.replace("\\", "/") # Normalize separators
@@ -220,12 +259,7 @@ def get_or_create_file_entry(db: Session, path: str, is_directory: bool = False)
     if entry:
         return entry
     
-    while True:
-        url_id = generate_url_id()
-        if not db.query(models.FileEntry).filter(models.FileEntry.url_id == url_id).first():
-            break
-            
-    entry = models.FileEntry(path=path, url_id=url_id, is_directory=is_directory)
+    entry = models.FileEntry(path=path, url_id=generate_url_id(), is_directory=is_directory)
     db.add(entry)
     try:
         db.commit()
@@ -239,3 +273,66 @@ def get_or_create_file_entry(db: Session, path: str, is_directory: bool = False)
 
 def get_file_entry_by_id(db: Session, url_id: str):
     return db.query(models.FileEntry).filter(models.FileEntry.url_id == url_id).first()
+
+
+# SQLite limits the number of bound parameters per statement, so IN (...)
+# lookups are issued in chunks of this size.
+FILE_ENTRY_LOOKUP_CHUNK = 500
+
+def get_file_entry_ids(db: Session, paths: list[str]) -> dict[str, str]:
+    """Return a {path: url_id} map for the given paths that already have entries."""
+    found = {}
+    for i in range(0, len(paths), FILE_ENTRY_LOOKUP_CHUNK):
+        chunk = paths[i:i + FILE_ENTRY_LOOKUP_CHUNK]
+        rows = db.query(models.FileEntry.path, models.FileEntry.url_id).filter(
+            models.FileEntry.path.in_(chunk)
+        )
+        for path, url_id in rows:
+            found[path] = url_id
+    return found
+
+def get_or_create_file_entries(db: Session, entries: dict[str, bool]) -> dict[str, str]:
+    """
+    Batch version of get_or_create_file_entry used by directory listings.
+    Takes {path: is_directory} and returns {path: url_id} for every path.
+
+    Existing IDs are fetched with chunked IN (...) queries and only the missing
+    rows are inserted, in a single transaction with one commit.
+    """
+    normalized = {path.replace("\\", "/"): is_dir for path, is_dir in entries.items()}
+    paths = list(normalized)
+    url_ids = get_file_entry_ids(db, paths)
+
+    missing = [path for path in paths if path not in url_ids]
+    if not missing:
+        return url_ids
+
+    new_ids = {}
+    used = set()
+    for path in missing:
+        url_id = generate_url_id()
+        while url_id in used:
+            url_id = generate_url_id()
+        used.add(url_id)
+        new_ids[path] = url_id
+
+    try:
+        db.execute(
+            models.FileEntry.__table__.insert(),
+            [{"path": path, "url_id": url_id, "is_directory": normalized[path]} for path, url_id in new_ids.items()]
+        )
+        db.commit()
+        url_ids.update(new_ids)
+    except IntegrityError:
+        db.rollback()
+        # Another request inserted some of these paths concurrently (or, in
+        # theory, an ID collided). Fall back to the row-by-row path, which
+        # handles both cases, for whatever is still missing.
+        url_ids.update(get_file_entry_ids(db, missing))
+        for path in missing:
+            if path not in url_ids:
+                entry = get_or_create_file_entry(db, path, is_directory=normalized[path])
+                if entry:
+                    url_ids[path] = entry.url_id
+
+    return url_ids
@@ -1,12 +1,85 @@
-from sqlalchemy import create_engine
+"""
+Database engine and sessions
+The URL comes from the "database" section of server_config.json: an explicit
+url, or else the path of the SQLite file. SQLite connections are put in WAL
+mode with the configured pragmas as they are opened, so readers are not
+blocked by a writer and writers wait for the lock instead of failing.
+"""
+
+import os
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./fileserver.db"
+from . import config
+
+
+def _settings() -> dict:
+    return {**config.DEFAULT_CONFIG["database"], **config.get_config().get_section("database")}
+
+
+def database_url(settings: dict) -> str:
+    return settings.get("url") or f"sqlite:///{settings.get('path') or './fileserver.db'}"
+
+
+def sqlite_pragmas(settings: dict) -> dict:
+    """PRAGMA name -> value applied to every new SQLite connection"""
+    return {
+        "journal_mode": settings["journal_mode"],
+        "synchronous": settings["synchronous"],
+        "busy_timeout": int(settings["busy_timeout_ms"]),
+        # Negative cache_size is in KiB rather than pages
+        "cache_size": -int(settings["cache_size_mb"] * 1024),
+        "mmap_size": int(settings["mmap_size_mb"] * 1024 * 1024),
+        "temp_store": "memory",
+    }
+
+
+def build_engine(settings: dict):
+    url = make_url(database_url(settings))
+    if url.get_backend_name() != "sqlite":
+        return create_engine(
+            url,
+            pool_size=int(settings["pool_size"]),
+            max_overflow=int(settings["max_overflow"]),
+            pool_timeout=float(settings["pool_timeout_seconds"]),
+            pool_pre_ping=True,
+        )
+
+    if url.database and url.database != ":memory:":
+        engine = create_engine(
+            url,
+            connect_args={"check_same_thread": False},
+            pool_size=int(settings["pool_size"]),
+            max_overflow=int(settings["max_overflow"]),
+            pool_timeout=float(settings["pool_timeout_seconds"]),
+        )
+    else:
+        engine = create_engine(url, connect_args={"check_same_thread": False})
+
+    pragmas = sqlite_pragmas(settings)
+
+    @event.listens_for(engine, "connect")
+    def _apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return engine
+
+
+def database_path() -> str:
+    """Absolute path of the SQLite database file, or the URL for other backends"""
+    url = engine.url
+    if url.get_backend_name() == "sqlite" and url.database:
+        return os.path.abspath(url.database)
+    return url.render_as_string(hide_password=True)
+
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+engine = build_engine(_settings())
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
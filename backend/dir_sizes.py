@@ -0,0 +1,235 @@
+"""
+Directory size index
+Keeps the recursive size and file count of every directory in the dir_sizes
+table, so listings and the du endpoint can show where space goes without
+walking the tree. Write endpoints report the size change of each file they
+touch and it is added to every directory above the file; created, deleted
+and renamed directories add, drop or move their rows.
+
+A background recompute walks the storage when the index is missing and
+again once per DIR_SIZE_RECOMPUTE_INTERVAL_SECONDS, correcting drift from
+changes made outside the server. Until the first walk finishes, sizes are
+reported as unknown. Changes made during a walk are journalled like those
+to the usage ledger (see usage.WalkJournal).
+"""
+
+import asyncio
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, func, literal
+from sqlalchemy.exc import IntegrityError
+
+from . import database, executors, models, usage
+
+DIR_SIZE_RECOMPUTE_INTERVAL_SECONDS = float(os.getenv("DIR_SIZE_RECOMPUTE_INTERVAL_SECONDS", "86400"))
+
+# Rows per statement when the recompute writes its results, and per IN
+# clause when looking sizes up
+BATCH_SIZE = 5000
+
+
+def _subtree(column, rel_path: str):
+    """Rows for rel_path and every directory below it ("0" sorts right after "/")"""
+    return (column == rel_path) | ((column > rel_path + "/") & (column < rel_path + "0"))
+
+
+def _chunks(items: List, size: int = BATCH_SIZE) -> Iterable[List]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class DirSizeIndex:
+    def __init__(self, recompute_interval: float = DIR_SIZE_RECOMPUTE_INTERVAL_SECONDS):
+        self.recompute_interval = recompute_interval
+        self.last_recompute: Optional[dict] = None
+        self.journal = usage.WalkJournal("dir_sizes")
+        self._task: Optional[asyncio.Task] = None
+
+    # --- Incremental updates ---
+
+    def _apply(self, rel_dirs: List[str], delta_bytes: int, delta_files: int, kind: str, rel_path: str):
+        """Add a change to the given directories, adding rows for new ones, and journal it"""
+        table = models.DirSize
+        for attempt in range(2):
+            db = database.SessionLocal()
+            try:
+                existing = {path for (path,) in db.query(table.path).filter(table.path.in_(rel_dirs))}
+                # Without an index yet, the first recompute counts the change
+                if "" in existing:
+                    if delta_bytes or delta_files:
+                        db.query(table).filter(table.path.in_(existing)).update({
+                            table.bytes: table.bytes + delta_bytes,
+                            table.files: table.files + delta_files,
+                        }, synchronize_session=False)
+                    # Directories created since the last recompute start from this change
+                    db.add_all(
+                        table(path=path, bytes=delta_bytes, files=delta_files, recomputed_at=0)
+                        for path in rel_dirs if path not in existing
+                    )
+                self.journal.log(db, kind, rel_path, delta_bytes, delta_files)
+                db.commit()
+                return
+            except IntegrityError:
+                # Another request added one of the rows first; retry as an update
+                db.rollback()
+            finally:
+                db.close()
+
+    def record(self, abs_path: str, delta_bytes: int, delta_files: int = 0):
+        """A file at abs_path grew by delta_bytes (and delta_files files appeared)"""
+        rel_path = usage.relative_path(abs_path)
+        if not rel_path or (not delta_bytes and not delta_files):
+            return
+        self._apply(usage.ancestors(rel_path)[:-1], delta_bytes, delta_files, "change", rel_path)
+
+    def created(self, abs_dir: str):
+        """A directory (and any missing parents) was created"""
+        rel_path = usage.relative_path(abs_dir)
+        if rel_path:
+            self._apply(usage.ancestors(rel_path), 0, 0, "created", rel_path)
+
+    def removed(self, abs_path: str, freed_bytes: int, freed_files: int, is_dir: bool):
+        """A file or directory tree holding freed_bytes in freed_files files was deleted"""
+        rel_path = usage.relative_path(abs_path)
+        if not rel_path:
+            return
+        self._apply(usage.ancestors(rel_path)[:-1], -freed_bytes, -freed_files, "removed" if is_dir else "change", rel_path)
+        db = database.SessionLocal()
+        try:
+            db.query(models.DirSize).filter(_subtree(models.DirSize.path, rel_path)).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def moved(self, old_abs_path: str, new_abs_path: str):
+        """A directory was renamed within the same parent; its rows follow it"""
+        old_rel, new_rel = usage.relative_path(old_abs_path), usage.relative_path(new_abs_path)
+        if not old_rel or not new_rel:
+            return
+        table = models.DirSize
+        db = database.SessionLocal()
+        try:
+            db.query(table).filter(_subtree(table.path, old_rel)).update({
+                table.path: literal(new_rel) + func.substr(table.path, len(old_rel) + 1),
+            }, synchronize_session=False)
+            self.journal.log(db, "moved", old_rel, target=new_rel)
+            db.commit()
+        finally:
+            db.close()
+
+    # --- Queries ---
+
+    def sizes(self, db, rel_paths: List[str]) -> Dict[str, Tuple[int, int]]:
+        """{storage-relative dir: (bytes, files)} for the indexed directories among rel_paths"""
+        result = {}
+        table = models.DirSize
+        for chunk in _chunks(rel_paths, 500):
+            for path, size, count in db.query(table.path, table.bytes, table.files).filter(table.path.in_(chunk)):
+                result[path] = (max(0, size or 0), max(0, count or 0))
+        return result
+
+    # --- Full recompute ---
+
+    def recompute(self) -> Optional[dict]:
+        """
+        Rebuild the index from one walk of the storage. As with the usage
+        ledger, changes recorded while the walk runs are kept. Returns None if
+        another worker is already recomputing.
+        """
+        started = time.time()
+        if not self.journal.begin(self.recompute_interval):
+            return None
+        table = models.DirSize.__table__
+        try:
+            read_at: Dict[str, float] = {}
+            own = self.journal.walk(read_at)
+            db = database.SessionLocal()
+            try:
+                self.journal.replay(own, read_at, self.journal.end(db))
+                totals: Dict[str, List[int]] = {}
+                for rel_dir, (dir_bytes, dir_files) in own.items():
+                    totals.setdefault(rel_dir, [0, 0])
+                    if dir_bytes or dir_files:
+                        for key in usage.ancestors(rel_dir):
+                            total = totals.setdefault(key, [0, 0])
+                            total[0] += dir_bytes
+                            total[1] += dir_files
+
+                before = {path: (size, count) for path, size, count in db.query(models.DirSize.path, models.DirSize.bytes, models.DirSize.files)}
+                changed, added = [], []
+                for path, (size, count) in totals.items():
+                    old = before.get(path)
+                    if old is None:
+                        added.append({"path": path, "bytes": size, "files": count, "recomputed_at": started})
+                    elif old != (size, count):
+                        changed.append({"p": path, "new_bytes": size, "new_files": count})
+                removed = [path for path in before if path not in totals]
+
+                update = table.update().where(table.c.path == bindparam("p")).values(
+                    bytes=bindparam("new_bytes"),
+                    files=bindparam("new_files"),
+                    recomputed_at=started,
+                )
+                for chunk in _chunks(changed):
+                    db.execute(update, chunk)
+                for chunk in _chunks(added):
+                    db.execute(table.insert(), chunk)
+                for chunk in _chunks(removed):
+                    db.execute(table.delete().where(table.c.path.in_(chunk)))
+                db.execute(table.update().where(table.c.path == "").values(recomputed_at=started))
+                db.commit()
+            finally:
+                db.close()
+        except Exception:
+            self.journal.abort()
+            raise
+        self.last_recompute = {
+            "at": started,
+            "duration_seconds": round(time.time() - started, 3),
+            "directories": len(totals),
+            "changed": len(changed) + len(added) + len(removed),
+        }
+        return self.last_recompute
+
+    def _due_in(self) -> float:
+        """Seconds until the next recompute; now if the index was never built (by any worker)"""
+        db = database.SessionLocal()
+        try:
+            root = db.query(models.DirSize.recomputed_at).filter(models.DirSize.path == "").first()
+        finally:
+            db.close()
+        if root is None:
+            return 0
+        return (root[0] or 0) + self.recompute_interval - time.time()
+
+    async def _run(self):
+        while True:
+            try:
+                due_in = await executors.run_db(self._due_in)
+                if due_in <= 0:
+                    result = await executors.run_disk(self.recompute)
+                    if result is not None:
+                        print(f"Directory sizes recomputed: {result['directories']} directories in {result['duration_seconds']}s, {result['changed']} rows changed")
+                    due_in = self.recompute_interval
+            except Exception as e:
+                print(f"Directory size recompute failed: {e}")
+                due_in = 60
+            await asyncio.sleep(max(1.0, due_in))
+
+    def start(self):
+        if self._task is None and self.recompute_interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+index = DirSizeIndex()
@@ -0,0 +1,182 @@
+"""
+File download responses
+Adds strong validators (ETag, Last-Modified), conditional GET (304) and
+single/multi-range requests (206) on top of plain file responses
+"""
+
+import mimetypes
+import os
+import secrets
+from email.utils import formatdate, parsedate_to_datetime
+from typing import List, Optional, Tuple
+
+from fastapi import Request
+from starlette.responses import FileResponse, Response, StreamingResponse
+
+from . import config
+
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+# Requests asking for more ranges than this get the whole file instead
+MAX_RANGES = 64
+
+DEFAULT_CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(st: os.stat_result) -> str:
+    """Strong validator from inode, size and modification time"""
+    return f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def cache_control_for(media_type: str) -> str:
+    """Cache-Control policy for a media type, configured per major type"""
+    policies = config.get_config().get("downloads", "cache_control", {}) or {}
+    major = media_type.split("/", 1)[0]
+    return policies.get(media_type) or policies.get(major) or policies.get("default") or DEFAULT_CACHE_CONTROL
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match comparison (weak comparison, as RFC 9110 requires for it)"""
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    return any(tag == etag or tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def _not_modified_since(header: str, st: os.stat_result) -> bool:
+    try:
+        since = parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return False
+    return int(st.st_mtime) <= since
+
+
+def _if_range_matches(header: str, etag: str, st: os.stat_result) -> bool:
+    """If-Range needs a strong ETag match or an exact Last-Modified date"""
+    header = header.strip()
+    if header.startswith('"') or header.startswith("W/"):
+        return header == etag
+    try:
+        return int(parsedate_to_datetime(header).timestamp()) == int(st.st_mtime)
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return False
+
+
+def parse_range_header(header: str, size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Parse a `Range: bytes=...` header into inclusive (start, end) pairs.
+    Returns None if the header should be ignored (syntax we don't handle)
+    and an empty list if no range is satisfiable.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+    ranges = []
+    parts = spec.split(",")
+    if len(parts) > MAX_RANGES:
+        return None
+    for part in parts:
+        start_str, sep, end_str = part.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            if start_str == "":
+                # Suffix range: last N bytes
+                length = int(end_str)
+                if length <= 0:
+                    continue
+                start, end = max(0, size - length), size - 1
+            else:
+                start = int(start_str)
+                end = int(end_str) if end_str else size - 1
+                if start > end:
+                    return None
+                end = min(end, size - 1)
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, end))
+    return ranges
+
+
+def _read_range(path: str, start: int, end: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _multipart_ranges(path: str, ranges, size: int, media_type: str, boundary: str):
+    """Part headers and the streaming body for a multipart/byteranges response"""
+    headers = [
+        (
+            f"--{boundary}\r\nContent-Type: {media_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        ).encode("latin-1")
+        for start, end in ranges
+    ]
+    closing = f"\r\n--{boundary}--\r\n".encode("latin-1")
+    length = sum(len(h) for h in headers) + sum(end - start + 1 for start, end in ranges) + 2 * (len(ranges) - 1) + len(closing)
+
+    def body():
+        for i, ((start, end), part_header) in enumerate(zip(ranges, headers)):
+            if i:
+                yield b"\r\n"
+            yield part_header
+            yield from _read_range(path, start, end)
+        yield closing
+
+    return length, body()
+
+
+def file_response(request: Request, path: str) -> Response:
+    """Serve a file honouring conditional and Range request headers"""
+    st = os.stat(path)
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    etag = make_etag(st)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Cache-Control": cache_control_for(media_type),
+        "Accept-Ranges": "bytes",
+    }
+
+    # Conditional GET: If-None-Match takes precedence over If-Modified-Since
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+    else:
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since and _not_modified_since(if_modified_since, st):
+            return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or _if_range_matches(if_range, etag, st)):
+        ranges = parse_range_header(range_header, st.st_size)
+        if ranges is not None:
+            if not ranges:
+                headers["Content-Range"] = f"bytes */{st.st_size}"
+                return Response(status_code=416, headers=headers)
+
+            if len(ranges) == 1:
+                start, end = ranges[0]
+                headers["Content-Range"] = f"bytes {start}-{end}/{st.st_size}"
+                headers["Content-Length"] = str(end - start + 1)
+                return StreamingResponse(
+                    _read_range(path, start, end), status_code=206, media_type=media_type, headers=headers
+                )
+
+            boundary = secrets.token_hex(16)
+            length, body = _multipart_ranges(path, ranges, st.st_size, media_type, boundary)
+            headers["Content-Length"] = str(length)
+            return StreamingResponse(
+                body, status_code=206, media_type=f"multipart/byteranges; boundary={boundary}", headers=headers
+            )
+
+    return FileResponse(path, media_type=media_type, stat_result=st, headers=headers)
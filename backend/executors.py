@@ -0,0 +1,156 @@
+"""
+Thread pools for blocking work in async handlers, and an event loop lag monitor
+Async endpoints and the collaboration manager must not block the loop: one
+slow disk write would stall every request and WebSocket on the worker.
+Blocking calls go to one of three bounded pools, so a burst of one kind of
+work (e.g. slow disk I/O) cannot starve the others:
+- disk: filesystem calls and file reads/writes (also passed to aiofiles)
+- db: SQLAlchemy sessions, sized to the connection pool
+- cpu: CPU-bound work such as diffing large documents
+
+The monitor wakes up every LOOP_LAG_INTERVAL_MS and warns when it ran more
+than LOOP_LAG_WARN_MS late, which means some callback blocked the loop.
+"""
+
+import asyncio
+import functools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+EXECUTOR_DISK_WORKERS = int(os.getenv("EXECUTOR_DISK_WORKERS", "16"))
+EXECUTOR_DB_WORKERS = int(os.getenv("EXECUTOR_DB_WORKERS", "10"))
+EXECUTOR_CPU_WORKERS = int(os.getenv("EXECUTOR_CPU_WORKERS", str(os.cpu_count() or 2)))
+LOOP_LAG_INTERVAL_MS = int(os.getenv("LOOP_LAG_INTERVAL_MS", "100"))
+LOOP_LAG_WARN_MS = int(os.getenv("LOOP_LAG_WARN_MS", "100"))
+
+LAG_SAMPLES = 600
+
+
+class Pool:
+    """A named, size-bounded thread pool with queue and latency counters"""
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"{name}-pool")
+        self._lock = threading.Lock()
+        self.pending = 0  # Submitted and not finished, including queued
+        self.completed = 0
+        self.max_wait_ms = 0.0  # Longest time a call waited for a free thread
+
+    def _call(self, fn: Callable[[], T], submitted: float) -> T:
+        wait_ms = (time.perf_counter() - submitted) * 1000
+        with self._lock:
+            if wait_ms > self.max_wait_ms:
+                self.max_wait_ms = wait_ms
+        try:
+            return fn()
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """Run fn(*args, **kwargs) in the pool and await the result"""
+        with self._lock:
+            self.pending += 1
+        call = functools.partial(self._call, functools.partial(fn, *args, **kwargs), time.perf_counter())
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "pending": self.pending,
+                "queued": max(0, self.pending - self.max_workers),
+                "completed": self.completed,
+                "max_wait_ms": round(self.max_wait_ms, 1),
+            }
+
+
+disk = Pool("disk", EXECUTOR_DISK_WORKERS)
+db = Pool("db", EXECUTOR_DB_WORKERS)
+cpu = Pool("cpu", EXECUTOR_CPU_WORKERS)
+
+
+async def run_disk(fn: Callable[..., T], *args, **kwargs) -> T:
+    return await disk.run(fn, *args, **kwargs)
+
+
+async def run_db(fn: Callable[..., T], *args, **kwargs) -> T:
+    return await db.run(fn, *args, **kwargs)
+
+
+async def run_cpu(fn: Callable[..., T], *args, **kwargs) -> T:
+    return await cpu.run(fn, *args, **kwargs)
+
+
+class LoopLagMonitor:
+    def __init__(self, interval_ms: int = LOOP_LAG_INTERVAL_MS, warn_ms: int = LOOP_LAG_WARN_MS):
+        self.interval_ms = interval_ms
+        self.warn_ms = warn_ms
+        self.samples = deque(maxlen=LAG_SAMPLES)
+        self.max_lag_ms = 0.0
+        self.warnings = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        interval = self.interval_ms / 1000
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            lag_ms = max(0.0, (loop.time() - expected) * 1000)
+            self.samples.append(lag_ms)
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+            if lag_ms >= self.warn_ms:
+                self.warnings += 1
+                print(f"Warning: event loop blocked for {lag_ms:.0f} ms")
+
+    def start(self):
+        if self._task is None and self.interval_ms > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        samples = sorted(self.samples)
+        return {
+            "interval_ms": self.interval_ms,
+            "warn_ms": self.warn_ms,
+            "p50_ms": round(samples[len(samples) // 2], 1) if samples else None,
+            "p99_ms": round(samples[int(len(samples) * 0.99)], 1) if samples else None,
+            "max_ms": round(self.max_lag_ms, 1),
+            "warnings": self.warnings,
+        }
+
+
+loop_monitor = LoopLagMonitor()
+
+
+def stats() -> dict:
+    return {
+        "pools": {pool.name: pool.stats() for pool in (disk, db, cpu)},
+        "loop_lag": loop_monitor.stats(),
+    }
+
+
+def shutdown():
+    for pool in (disk, db, cpu):
+        pool.shutdown()
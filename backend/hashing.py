@@ -0,0 +1,201 @@
+"""
+Password hashing service
+Runs bcrypt/argon2 in a process pool so hashing a password doesn't hold the
+GIL of the worker serving other requests. Callers block on the result (the
+sync endpoints already run in the threadpool). The number of hashes waiting
+for the pool is capped; past the cap requests fail fast with 503 instead of
+queueing up for seconds.
+
+Configured with PASSWORD_HASH_SCHEME (bcrypt|argon2), BCRYPT_ROUNDS,
+ARGON2_TIME_COST, ARGON2_MEMORY_COST_KB, ARGON2_PARALLELISM,
+PASSWORD_HASH_WORKERS (0 hashes inline) and PASSWORD_HASH_MAX_PENDING.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+PASSWORD_HASH_SCHEME = os.getenv("PASSWORD_HASH_SCHEME", "bcrypt").lower()
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST_KB = int(os.getenv("ARGON2_MEMORY_COST_KB", "65536"))
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "4"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+
+# Latency samples kept for percentiles
+LATENCY_SAMPLES = 1000
+
+
+def _argon2_available() -> bool:
+    try:
+        import argon2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def build_context() -> CryptContext:
+    """
+    CryptContext for the configured scheme. Hashes made with another scheme
+    or different cost settings still verify, and are reported as needing
+    an update so they get rehashed on the next successful login.
+    """
+    scheme = PASSWORD_HASH_SCHEME
+    has_argon2 = _argon2_available()
+    if scheme == "argon2" and not has_argon2:
+        print("Warning: PASSWORD_HASH_SCHEME=argon2 but argon2-cffi is not installed, using bcrypt")
+        scheme = "bcrypt"
+    elif scheme not in ("bcrypt", "argon2"):
+        print(f"Warning: Unknown PASSWORD_HASH_SCHEME '{scheme}', using bcrypt")
+        scheme = "bcrypt"
+
+    schemes = [scheme] + [s for s in ("bcrypt", "argon2") if s != scheme and (s != "argon2" or has_argon2)]
+    settings = {"bcrypt__rounds": BCRYPT_ROUNDS}
+    if has_argon2:
+        settings.update({
+            "argon2__time_cost": ARGON2_TIME_COST,
+            "argon2__memory_cost": ARGON2_MEMORY_COST_KB,
+            "argon2__parallelism": ARGON2_PARALLELISM,
+        })
+    return CryptContext(schemes=schemes, deprecated="auto", **settings)
+
+
+pwd_context = build_context()
+
+
+# Worker functions: module level so the pool can pickle them. Each worker
+# process imports this module and builds the same context from the
+# inherited environment.
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    try:
+        return pwd_context.verify_and_update(password, hashed)
+    except (ValueError, TypeError):
+        # Malformed or unknown hash
+        return False, None
+
+
+def _timed(fn, *args):
+    """Run fn in a worker, reporting when it started so queue wait can be measured"""
+    return time.time(), fn(*args)
+
+
+class HashingStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.rejected = 0
+        self.pending = 0  # Submitted and not finished, running or queued
+        self.peak_pending = 0
+        self.rehashed = 0
+        self._latency = {kind: deque(maxlen=LATENCY_SAMPLES) for kind in ("hash", "verify", "queue_wait", "login")}
+
+    def record(self, kind: str, seconds: float):
+        with self._lock:
+            self._latency[kind].append(seconds)
+
+    def snapshot(self) -> dict:
+        def percentiles(samples):
+            ordered = sorted(samples)
+            if not ordered:
+                return {"count": 0, "p50_ms": None, "p95_ms": None, "max_ms": None}
+            pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+            return {"count": len(ordered), "p50_ms": pick(0.5), "p95_ms": pick(0.95), "max_ms": round(ordered[-1] * 1000, 2)}
+
+        with self._lock:
+            latency = {kind: percentiles(samples) for kind, samples in self._latency.items()}
+            return {
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "pending": self.pending,
+                "peak_pending": self.peak_pending,
+                "rehashed": self.rehashed,
+                "latency": latency,
+            }
+
+
+class HashingService:
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.stats = HashingStats()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def _run(self, kind: str, fn, *args):
+        stats = self.stats
+        with stats._lock:
+            if stats.pending >= self.max_pending:
+                stats.rejected += 1
+                raise HTTPException(status_code=503, detail="Server is busy, please try again shortly", headers={"Retry-After": "1"})
+            stats.pending += 1
+            stats.peak_pending = max(stats.peak_pending, stats.pending)
+
+        submitted = time.time()
+        try:
+            if self.workers <= 0:
+                started, result = _timed(fn, *args)
+            else:
+                started, result = self._get_pool().submit(_timed, fn, *args).result()
+        finally:
+            with stats._lock:
+                stats.pending -= 1
+                stats.completed += 1
+        stats.record(kind, time.time() - submitted)
+        stats.record("queue_wait", max(0.0, started - submitted))
+        return result
+
+    def hash(self, password: str) -> str:
+        return self._run("hash", _hash, password)
+
+    def verify_and_update(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """
+        Check a password. Returns (ok, new_hash), where new_hash is set when
+        the stored hash uses an outdated scheme or cost and should be saved.
+        """
+        ok, new_hash = self._run("verify", _verify_and_update, password, hashed)
+        if new_hash:
+            with self.stats._lock:
+                self.stats.rehashed += 1
+        return ok, new_hash
+
+    def verify(self, password: str, hashed: str) -> bool:
+        return self.verify_and_update(password, hashed)[0]
+
+    def describe(self) -> dict:
+        stats = self.stats.snapshot()
+        return {
+            "scheme": pwd_context.default_scheme(),
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            **stats,
+            # Hashes waiting for a free worker
+            "queue_depth": max(0, stats["pending"] - max(self.workers, 1)),
+        }
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+service = HashingService()
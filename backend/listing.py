@@ -0,0 +1,192 @@
+"""
+Directory listing engine
+Scans directories with os.scandir so every entry costs at most one stat call
+"""
+
+import base64
+import heapq
+import json
+import os
+import stat
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+
+# Internal server state under the storage root (e.g. resumable upload parts)
+HIDDEN_NAMES = frozenset({".fileserver"})
+
+
+class DirRecord(NamedTuple):
+    """Compact listing record for a single directory entry"""
+    name: str
+    is_dir: bool
+    size: int
+    mtime: float
+
+
+def _make_record(entry: os.DirEntry) -> Optional[DirRecord]:
+    """Build a record from a DirEntry using its cached stat result"""
+    if entry.name in HIDDEN_NAMES:
+        return None
+    try:
+        # On Windows the stat data comes with the directory scan for free,
+        # elsewhere this is the single stat call for the entry.
+        st = entry.stat()
+    except OSError:
+        # Broken symlink or entry removed while scanning
+        return None
+    is_dir = stat.S_ISDIR(st.st_mode)
+    return DirRecord(entry.name, is_dir, 0 if is_dir else st.st_size, st.st_mtime)
+
+
+def iter_directory(path: str) -> Iterator[DirRecord]:
+    """Yield a record for every entry in a directory"""
+    with os.scandir(path) as it:
+        for entry in it:
+            record = _make_record(entry)
+            if record is not None:
+                yield record
+
+
+def scan_directory(path: str) -> List[DirRecord]:
+    """Return records for every entry in a directory"""
+    return list(iter_directory(path))
+
+
+def walk_tree(root: str) -> Iterator[Tuple[str, DirRecord]]:
+    """
+    Walk a directory tree depth-first, yielding (relative_path, record) pairs.
+    Relative paths use '/' separators. Symlinked directories are reported but
+    not descended into, so links cannot create cycles.
+    """
+    stack = [("", root)]
+    while stack:
+        rel_dir, abs_dir = stack.pop()
+        try:
+            it = os.scandir(abs_dir)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                record = _make_record(entry)
+                if record is None:
+                    continue
+                rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                yield rel_path, record
+                if record.is_dir and not entry.is_symlink():
+                    stack.append((rel_path, entry.path))
+
+
+# --- Sorting & pagination ---
+
+SORT_KEYS = ("name", "size", "mtime", "type")
+
+
+def _key_function(sort: str, descending: bool, dirs_first: bool):
+    """
+    Build a total-order key for records. The name is always the final
+    tiebreaker, so keys are unique within a directory and can be used as
+    keyset-pagination cursors.
+    """
+    if sort not in SORT_KEYS:
+        raise ValueError(f"Unknown sort key: {sort}")
+
+    def key(record: DirRecord):
+        if sort == "name":
+            primary = record.name.lower()
+        elif sort == "size":
+            primary = record.size
+        elif sort == "mtime":
+            primary = record.mtime
+        else:
+            primary = "" if record.is_dir else os.path.splitext(record.name)[1].lower()
+        if dirs_first:
+            # Descending pages are taken from the top of the order, so the
+            # directory rank is flipped to keep folders first either way.
+            dir_rank = int(record.is_dir) if descending else int(not record.is_dir)
+        else:
+            dir_rank = 0
+        return (dir_rank, primary, record.name)
+
+    return key
+
+
+def encode_cursor(key: tuple, sort: str, descending: bool, dirs_first: bool, prefix: str) -> str:
+    """Encode the sort key of the last returned record as an opaque token"""
+    payload = json.dumps([list(key), sort, descending, dirs_first, prefix], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str, descending: bool, dirs_first: bool, prefix: str) -> tuple:
+    """Decode a continuation token, checking it belongs to the same query"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        key, c_sort, c_descending, c_dirs_first, c_prefix = json.loads(base64.urlsafe_b64decode(padded))
+        key = tuple(key)
+    except Exception:
+        raise ValueError("Malformed cursor")
+    if (c_sort, c_descending, c_dirs_first, c_prefix) != (sort, descending, dirs_first, prefix):
+        raise ValueError("Cursor does not match the listing parameters")
+    numeric = sort in ("size", "mtime")
+    if (
+        len(key) != 3
+        or not isinstance(key[0], int)
+        or not isinstance(key[2], str)
+        or (isinstance(key[1], (int, float)) and not isinstance(key[1], bool)) != numeric
+        or (not numeric and not isinstance(key[1], str))
+    ):
+        raise ValueError("Malformed cursor")
+    return key
+
+
+class ListingPage(NamedTuple):
+    records: List[DirRecord]
+    next_cursor: Optional[str]
+    total: int
+
+
+def page_records(
+    records: Iterable[DirRecord],
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    sort: str = "name",
+    descending: bool = False,
+    dirs_first: bool = True,
+    prefix: str = "",
+) -> ListingPage:
+    """
+    Select one sorted page of records.
+
+    Records are consumed as a stream and only the requested page is kept
+    (heap selection, O(n log limit)), so large directories are never sorted
+    or held in full. `total` counts every record matching the prefix filter.
+    Raises ValueError for unknown sort keys or invalid cursors.
+    """
+    key = _key_function(sort, descending, dirs_first)
+    after = decode_cursor(cursor, sort, descending, dirs_first, prefix) if cursor else None
+    prefix_lower = prefix.lower()
+    total = 0
+
+    def candidates():
+        nonlocal total
+        for record in records:
+            if prefix_lower and not record.name.lower().startswith(prefix_lower):
+                continue
+            total += 1
+            k = key(record)
+            if after is not None and (k <= after if not descending else k >= after):
+                continue
+            yield k, record
+
+    if limit is None:
+        selected = sorted(candidates(), key=lambda pair: pair[0], reverse=descending)
+    elif descending:
+        selected = heapq.nlargest(limit + 1, candidates(), key=lambda pair: pair[0])
+    else:
+        selected = heapq.nsmallest(limit + 1, candidates(), key=lambda pair: pair[0])
+
+    next_cursor = None
+    if limit is not None and len(selected) > limit:
+        selected = selected[:limit]
+        next_cursor = encode_cursor(selected[-1][0], sort, descending, dirs_first, prefix)
+
+    return ListingPage([record for _, record in selected], next_cursor, total)
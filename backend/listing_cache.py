@@ -0,0 +1,144 @@
+"""
+Directory listing cache
+In-process LRU cache of directory scans, validated against directory mtime
+and explicitly invalidated by the write endpoints
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from . import config, listing
+
+# A directory modified this recently may still change within the same mtime
+# tick, so its scan is not cached yet (same idea as git's "racy" index check).
+RACY_MTIME_WINDOW_SECONDS = 2.0
+
+
+class _CachedListing:
+    __slots__ = ("mtime_ns", "cached_at", "records", "url_ids")
+
+    def __init__(self, mtime_ns: int, records: Tuple[listing.DirRecord, ...]):
+        self.mtime_ns = mtime_ns
+        self.cached_at = time.monotonic()
+        self.records = records
+        # name -> url_id, filled lazily as pages of the listing are served
+        self.url_ids: Dict[str, str] = {}
+
+
+class ListingCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _CachedListing]" = OrderedDict()
+        self._record_count = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.normcase(os.path.abspath(path))
+
+    @staticmethod
+    def _settings() -> Tuple[bool, int, float]:
+        cfg = config.get_config()
+        return (
+            bool(cfg.get("cache", "listing_cache_enabled", True)),
+            int(cfg.get("cache", "listing_cache_max_entries", 200000)),
+            float(cfg.get("cache", "listing_cache_ttl_seconds", 300)),
+        )
+
+    def get(self, path: str) -> Optional[_CachedListing]:
+        """
+        Return the cached listing for a directory, scanning it on a miss.
+        Returns None when the cache is disabled, in which case callers scan
+        the directory themselves.
+        """
+        enabled, max_entries, ttl = self._settings()
+        if not enabled:
+            if self._entries:
+                self.clear()
+            return None
+
+        key = self._key(path)
+        st = os.stat(path)
+        with self._lock:
+            cached = self._entries.get(key)
+            if (
+                cached is not None
+                and cached.mtime_ns == st.st_mtime_ns
+                and time.monotonic() - cached.cached_at < ttl
+            ):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        records = tuple(listing.iter_directory(path))
+        fresh = _CachedListing(st.st_mtime_ns, records)
+        if len(records) > max_entries or time.time() - st.st_mtime < RACY_MTIME_WINDOW_SECONDS:
+            # Too large to cache or too new to trust the mtime; serve uncached
+            return fresh
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._record_count -= len(old.records)
+            self._entries[key] = fresh
+            self._record_count += len(records)
+            while self._record_count > max_entries and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._record_count -= len(evicted.records)
+                self.evictions += 1
+        return fresh
+
+    def invalidate(self, path: str):
+        """Drop the cached listing of a single directory"""
+        key = self._key(path)
+        with self._lock:
+            cached = self._entries.pop(key, None)
+            if cached is not None:
+                self._record_count -= len(cached.records)
+                self.invalidations += 1
+
+    def invalidate_parent(self, path: str):
+        """Drop the cached listing of the directory containing `path`"""
+        self.invalidate(os.path.dirname(os.path.abspath(path)))
+
+    def invalidate_tree(self, path: str):
+        """Drop the cached listings of a directory and everything below it"""
+        key = self._key(path)
+        prefix = key.rstrip(os.sep) + os.sep
+        with self._lock:
+            for cached_key in [k for k in self._entries if k == key or k.startswith(prefix)]:
+                cached = self._entries.pop(cached_key)
+                self._record_count -= len(cached.records)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._record_count = 0
+
+    def stats(self) -> dict:
+        enabled, max_entries, ttl = self._settings()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": enabled,
+                "directories": len(self._entries),
+                "records": self._record_count,
+                "max_records": max_entries,
+                "ttl_seconds": ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+listing_cache = ListingCache()
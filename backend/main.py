@@ -1,90 +1,24 @@
 import os
 import shutil
-from typing import List
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Request
+import time
+import aiofiles
+from typing import List, Optional, Tuple
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Request, Query
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
-from starlette.responses import FileResponse, HTMLResponse
+from starlette.responses import FileResponse, HTMLResponse, StreamingResponse
 
-from . import models, schemas, crud, database, auth, config, email_utils
+from . import models, schemas, crud, database, auth, config, email_utils, listing, uploads, resumable, downloads, archive, paths, permissions, hashing, executors, usage, dir_sizes, search
+from .listing_cache import listing_cache
+from .principal_cache import principal_cache
+from .share_index import share_index, normalize_path
+from .collab import manager
 from fastapi import WebSocket, WebSocketDisconnect
 import json
+from urllib.parse import quote
 
-class ConnectionManager:
-    def __init__(self):
-        # Map file_path -> list of {websocket, username, cursor_position}
-        self.active_connections: dict[str, List[dict]] = {}
-
-    async def connect(self, websocket: WebSocket, file_path: str, username: str):
-        await websocket.accept()
-        if file_path not in self.active_connections:
-            self.active_connections[file_path] = []
-        self.active_connections[file_path].append({
-            "websocket": websocket, 
-            "username": username,
-            "cursor_position": 0
-        })
-        # Send current user list and cursor positions
-        await self.broadcast_user_list(file_path)
-        await self.broadcast_cursors(file_path)
-
-    def disconnect(self, websocket: WebSocket, file_path: str):
-        if file_path in self.active_connections:
-            self.active_connections[file_path] = [
-                conn for conn in self.active_connections[file_path]
-                if conn["websocket"] != websocket
-            ]
-            if not self.active_connections[file_path]:
-                del self.active_connections[file_path]
-
-    async def broadcast_user_list(self, file_path: str):
-        if file_path in self.active_connections:
-            users = [conn["username"] for conn in self.active_connections[file_path]]
-            message = json.dumps({"type": "users_update", "users": users})
-            for connection in self.active_connections[file_path]:
-                try:
-                    await connection["websocket"].send_text(message)
-                except:
-                    pass
-
-    async def broadcast_cursors(self, file_path: str):
-        """Broadcast all cursor positions to all users"""
-        if file_path in self.active_connections:
-            cursors = [
-                {"username": conn["username"], "position": conn.get("cursor_position", 0)}
-                for conn in self.active_connections[file_path]
-            ]
-            message = json.dumps({"type": "cursors_update", "cursors": cursors})
-            for connection in self.active_connections[file_path]:
-                try:
-                    await connection["websocket"].send_text(message)
-                except:
-                    pass
-
-    def update_cursor(self, websocket: WebSocket, file_path: str, position: int):
-        """Update cursor position for a specific connection"""
-        if file_path in self.active_connections:
-            for conn in self.active_connections[file_path]:
-                if conn["websocket"] == websocket:
-                    conn["cursor_position"] = position
-                    return True
-        return False
-
-    async def broadcast_change(self, message: str, file_path: str, sender: WebSocket):
-        if file_path in self.active_connections:
-            for connection in self.active_connections[file_path]:
-                if connection["websocket"] != sender:
-                    try:
-                        await connection["websocket"].send_text(message)
-                    except:
-                        pass
-            print(f"WS Broadcast: Path={file_path} Recipients={len(self.active_connections[file_path])-1} MessageLen={len(message)}")
-        else:
-            print(f"WS Broadcast Error: Path={file_path} not in active connections. Active: {list(self.active_connections.keys())}")
-
-manager = ConnectionManager()
 
 app = FastAPI()
 
@@ -93,6 +27,8 @@ MAX_FILE_SIZE_MB = int(os.getenv("MAX_FILE_SIZE_MB", "100"))
 MAX_TOTAL_UPLOAD_SIZE_MB = int(os.getenv("MAX_TOTAL_UPLOAD_SIZE_MB", "500"))
 MAX_FILE_SIZE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
 MAX_TOTAL_UPLOAD_SIZE_BYTES = MAX_TOTAL_UPLOAD_SIZE_MB * 1024 * 1024
+# Uploaded text files larger than this are not pushed to open editors
+UPLOAD_BROADCAST_MAX_BYTES = 2 * 1024 * 1024
 
 # CORS - Use environment variable for allowed origins
 allowed_origins_str = os.getenv("ALLOWED_ORIGINS", "*")
@@ -108,6 +44,7 @@ app.add_middleware(
 
 # Database
 database.Base.metadata.create_all(bind=database.engine)
+search.index.setup(database.engine)
 
 def get_db():
     db = database.SessionLocal()
@@ -119,23 +56,36 @@ def get_db():
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/token")
 
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    """
+    Authenticate a request. Verified tokens and loaded users are kept in the
+    principal cache, so repeated requests skip JWT decoding and the DB.
+    The returned user is detached from the session: endpoints that modify
+    it must load their own copy with crud.get_user.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    payload = auth.verify_token(token)
-    if payload is None:
-        raise credentials_exception
-    
-    username = payload.get("sub")
+    username = principal_cache.get_token_subject(token)
     if username is None:
-        raise credentials_exception
+        payload = auth.verify_token(token)
+        if payload is None:
+            raise credentials_exception
+        
+        username = payload.get("sub")
+        if username is None:
+            raise credentials_exception
+        principal_cache.put_token(token, username, payload.get("exp"))
     
-    user = crud.get_user(db, username)
-    if user is None:
-        raise credentials_exception
-    return user
+    principal = principal_cache.get_principal(username)
+    if principal is None:
+        user = crud.get_user(db, username)
+        if user is None:
+            raise credentials_exception
+        crud.detach_user(db, user)
+        principal = principal_cache.put_principal(user, permissions.get_snapshot(user))
+    return principal.user
 
 def is_admin(user: models.User) -> bool:
     """Check if user is an admin (regular or super) based on group membership."""
@@ -159,53 +109,52 @@ def is_super_admin(user: models.User) -> bool:
 
 
 def get_safe_path(user: models.User, path: str = ""):
-    storage_root = os.path.abspath(os.getenv("STORAGE_ROOT", "./storage"))
-    
-    # Debug output
-    print(f"[DEBUG] get_safe_path called:")
-    print(f"  User: {user.username}")
-    print(f"  User root_path: {user.root_path}")
-    print(f"  Requested path: {path}")
-    print(f"  STORAGE_ROOT env: {os.getenv('STORAGE_ROOT', 'NOT SET')}")
-    print(f"  Resolved storage_root: {storage_root}")
-    
-    # Handle root path correctly
-    user_root_path = user.root_path.strip("/")
-    user_root = os.path.join(storage_root, user_root_path)
-    
-    print(f"  User root directory: {user_root}")
-    print(f"  User root exists: {os.path.exists(user_root)}")
-    
-    # Ensure user root exists
-    if not os.path.exists(user_root):
-        try:
-            os.makedirs(user_root, exist_ok=True)
-            print(f"  Created user root: {user_root}")
-        except OSError as e:
-            print(f"Error creating user root: {e}")
-            raise HTTPException(status_code=500, detail="[ERR_FS_CREATE] Could not create user storage directory")
+    """
+    Resolve a user-relative path to an absolute path inside the user's root.
+    Raises 403 on path traversal. Set FILESERVER_DEBUG_PATHS=1 for diagnostics.
+    """
+    return paths.resolver.resolve(user.root_path, path)
+
+def storage_relative_path(full_path: str) -> str:
+    """Path relative to the storage root, as folder permissions are stored"""
+    storage_root = paths.resolver.storage_root()
+    if not paths.is_within(full_path, storage_root):
+        return full_path
+    return os.path.relpath(full_path, storage_root).replace("\\", "/")
+
+def require_path_access(user: models.User, full_path: str, write: bool = False):
+    """
+    Enforce the folder permissions of the user's groups on an absolute path.
+    Raises 403 if the path may not be read (or written, with write=True).
+    """
+    snapshot = permissions.get_snapshot(user)
+    if not snapshot.restricts_paths:
+        return
+    rel_path = storage_relative_path(full_path)
+    allowed = snapshot.can_write_path(rel_path) if write else snapshot.can_read_path(rel_path)
+    if not allowed:
+        access = "write" if write else "read"
+        raise HTTPException(status_code=403, detail=f"[ERR_FOLDER_ACCESS] No {access} access to this folder")
+
+def resolve_shared_path(db: Session, user: models.User, path: str, write: bool = False) -> Optional[str]:
+    """
+    Resolve a path through a share granted to the user: the path in the
+    owner's root, or None if no share covers it. Raises 403 if write is set
+    and the share is read-only.
+    """
+    grant = share_index.lookup(db, user.username, path)
+    if grant is None:
+        return None
+    if write and not grant.can_write:
+        raise HTTPException(status_code=403, detail="[ERR_SHARE_READ_ONLY] This item is shared read-only")
+    try:
+        return paths.resolver.resolve(grant.owner_root, normalize_path(path))
+    except HTTPException:
+        return None
 
-    # Normalize user_root to ensure consistent comparison
-    user_root = os.path.normpath(user_root)
-
-    # Construct full path
-    full_path = os.path.abspath(os.path.join(user_root, path.strip("/")))
-    
-    print(f"  Final full_path: {full_path}")
-    print(f"  Full path exists: {os.path.exists(full_path)}")
-    if os.path.exists(full_path) and os.path.isdir(full_path):
-        try:
-            contents = os.listdir(full_path)
-            print(f"  Directory contents ({len(contents)} items): {contents[:5]}")
-        except:
-            print(f"  Could not list directory contents")
-    
-    # Security check: Ensure path is within user_root
-    if not full_path.startswith(user_root):
-        print(f"Access denied: {full_path} is not inside {user_root}")
-        raise HTTPException(status_code=403, detail="[ERR_ACCESS_DENIED] Access denied: Path traversal detected")
-    
-    return full_path
+def listing_filter(user: models.User, dir_path: str):
+    """Predicate for the directory entries a user may see, or None for all"""
+    return permissions.get_snapshot(user).child_filter(storage_relative_path(dir_path))
 
 # --- Auth Endpoints ---
 @app.post("/api/token")
@@ -217,7 +166,8 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
     if auth.is_ip_rate_limited(client_ip):
         raise HTTPException(
             status_code=429,
-            detail="Too many login attempts from this IP address. Please try again later."
+            detail="Too many login attempts from this IP address. Please try again later.",
+            headers={"Retry-After": str(max(1, auth.ip_failures.retry_after(client_ip)))}
         )
     
     # Check account lockout
@@ -231,7 +181,9 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
         )
     
     # Attempt authentication
+    started = time.perf_counter()
     user = crud.authenticate_user(db, form_data.username, form_data.password)
+    hashing.service.stats.record("login", time.perf_counter() - started)
     
     if not user:
         # Record failed login attempt
@@ -280,10 +232,14 @@ def register(
     username: str = Form(...),
     email: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    request: Request = None
 ):
     import re
     
+    client_ip = request.client.host if request else "unknown"
+    auth.check_rate_limit(auth.register_limiter, client_ip, "Too many registrations from this IP address. Please try again later.")
+    
     # Validate username
     if not re.match(r'^[a-zA-Z0-9_]+$', username):
         raise HTTPException(
@@ -343,12 +299,18 @@ def register(
 @app.post("/api/forgot-password")
 def forgot_password(
     email: str = Form(...),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    request: Request = None
 ):
     """Request password reset. Sends reset token to user email."""
     import secrets
     from datetime import datetime, timedelta
     
+    # Limit per IP and per address, so one mailbox can't be flooded from many IPs
+    client_ip = request.client.host if request else "unknown"
+    auth.check_rate_limit(auth.forgot_password_limiter, f"ip:{client_ip}", "Too many password reset requests. Please try again later.")
+    auth.check_rate_limit(auth.forgot_password_limiter, f"email:{email.strip().lower()}", "Too many password reset requests. Please try again later.")
+    
     user = db.query(models.User).filter(models.User.email == email).first()
     if not user:
         # Don't reveal if email exists
@@ -404,6 +366,7 @@ def reset_password(
     
     user.hashed_password = auth.get_password_hash(new_password)
     db.commit()
+    principal_cache.invalidate_user(user.username)
     
     del app.state.reset_tokens[token]
     
@@ -421,6 +384,11 @@ def update_account_settings(
     """Update user account settings (username, email, password)."""
     import re
     
+    # The authenticated user comes from the principal cache and is detached;
+    # load a session-bound copy so the changes below are persisted
+    old_username = current_user.username
+    current_user = crud.get_user(db, old_username)
+    
     # Verify current password
     if not auth.verify_password(current_password, current_user.hashed_password):
         raise HTTPException(status_code=401, detail="Current password is incorrect")
@@ -469,6 +437,7 @@ def update_account_settings(
     
     db.commit()
     db.refresh(current_user)
+    principal_cache.invalidate_user(old_username)
     
     # Create new token if username changed
     if new_username and new_username != current_user.username:
@@ -596,128 +565,409 @@ def change_password(
 
 
 # --- File Endpoints ---
+DEFAULT_LISTING_PAGE_SIZE = 500
+MAX_LISTING_PAGE_SIZE = 5000
+
+def get_listing_query(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_LISTING_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    sort: Optional[str] = None,
+    order: str = "asc",
+    dirs_first: bool = True,
+    prefix: str = "",
+    dir_sizes: bool = False
+) -> dict:
+    """Query parameters for paginated, sorted directory listings"""
+    if sort is not None and sort not in listing.SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"[ERR_BAD_SORT] Sort must be one of: {', '.join(listing.SORT_KEYS)}")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="[ERR_BAD_SORT] Order must be 'asc' or 'desc'")
+    return {"limit": limit, "cursor": cursor, "sort": sort, "order": order, "dirs_first": dirs_first, "prefix": prefix, "dir_sizes": dir_sizes}
+
+def build_listing_items(db: Session, records, dir_path: str, storage_root: str, path_prefix: str = "", known_ids: dict = None):
+    """
+    Build the JSON items for directory records. Encrypted IDs for all of
+    them are resolved in a single batch. `known_ids` is an optional
+    {name: url_id} map (from the listing cache) that is consulted first and
+    filled with the IDs resolved here.
+    """
+    # Calculate relative path from storage root once for the whole directory
+    try:
+        rel_dir = os.path.relpath(dir_path, start=storage_root).replace("\\", "/")
+    except ValueError:
+        # Fallback if path calculation fails (e.g. diff drives)
+        rel_dir = None
+    
+    url_ids = {}
+    rel_prefix = ""
+    if rel_dir is not None:
+        rel_prefix = "" if rel_dir == "." else rel_dir + "/"
+        if known_ids is None:
+            known_ids = {}
+        missing = {rel_prefix + record.name: record.is_dir for record in records if record.name not in known_ids}
+        if missing:
+            resolved = crud.get_or_create_file_entries(db, missing)
+            for rel_path, url_id in resolved.items():
+                known_ids[rel_path[len(rel_prefix):]] = url_id
+        url_ids = known_ids
+    
+    items = []
+    for record in records:
+        items.append({
+            "name": record.name,
+            "is_dir": record.is_dir,
+            "size": record.size,
+            "modified": record.mtime,
+            "path": f"{path_prefix}/{record.name}".replace("\\", "/") if path_prefix else record.name,
+            "url_id": url_ids.get(record.name)
+        })
+    return items
+
+def add_dir_sizes(db: Session, items: list, dir_path: str):
+    """
+    Replace the size of folder items with their recursive size from the
+    directory size index and add a recursive file count. Folders the index
+    does not know yet keep size 0 and get "files": None.
+    """
+    rel_dir = usage.relative_path(dir_path)
+    if rel_dir is None:
+        return
+    prefix = f"{rel_dir}/" if rel_dir else ""
+    folders = [item for item in items if item["is_dir"]]
+    sizes = dir_sizes.index.sizes(db, [prefix + item["name"] for item in folders])
+    for item in folders:
+        size = sizes.get(prefix + item["name"])
+        if size is not None:
+            item["size"] = size[0]
+        item["files"] = size[1] if size is not None else None
+
+def list_directory(db: Session, dir_path: str, storage_root: str, query: dict, path_prefix: str = "", visible=None):
+    """
+    List a directory for the API, served from the listing cache when it is
+    enabled and still valid for the directory.
+
+    Without limit/cursor the whole directory is returned as a plain array
+    (sorted/filtered only if requested), as older clients expect. With
+    paging, only the requested page is selected, given IDs and serialized,
+    and the response carries a continuation token for the next page.
+    `visible` is an optional name predicate from listing_filter. With the
+    dir_sizes option, folders carry their recursive size (see add_dir_sizes).
+    """
+    cached = listing_cache.get(dir_path)
+    known_ids = cached.url_ids if cached else None
+    records = cached.records if cached else None
+    if visible is not None:
+        source = records if records is not None else listing.iter_directory(dir_path)
+        records = [record for record in source if visible(record.name)]
+    
+    paged = query["limit"] is not None or query["cursor"] is not None
+    if not paged and query["sort"] is None and not query["prefix"]:
+        if records is None:
+            records = listing.scan_directory(dir_path)
+        items = build_listing_items(db, records, dir_path, storage_root, path_prefix, known_ids)
+        if query["dir_sizes"]:
+            add_dir_sizes(db, items, dir_path)
+        return items
+    
+    try:
+        page = listing.page_records(
+            records if records is not None else listing.iter_directory(dir_path),
+            limit=(query["limit"] or DEFAULT_LISTING_PAGE_SIZE) if paged else None,
+            cursor=query["cursor"],
+            sort=query["sort"] or "name",
+            descending=query["order"] == "desc",
+            dirs_first=query["dirs_first"],
+            prefix=query["prefix"]
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"[ERR_BAD_CURSOR] {e}")
+    
+    items = build_listing_items(db, page.records, dir_path, storage_root, path_prefix, known_ids)
+    if query["dir_sizes"]:
+        add_dir_sizes(db, items, dir_path)
+    if not paged:
+        return items
+    return {"items": items, "next_cursor": page.next_cursor, "total": page.total}
+
 @app.get("/api/f/{url_id}")
-def access_file_by_id(url_id: str, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def access_file_by_id(
+    url_id: str,
+    request: Request,
+    listing_query: dict = Depends(get_listing_query),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
     """Access file or folder by unique encrypted ID"""
     entry = crud.get_file_entry_by_id(db, url_id)
-    if not entry:
+    if not entry or paths.is_hidden(entry.path):
         raise HTTPException(status_code=404, detail="File ID not found")
     
     cfg = config.get_config()
     storage_root = os.path.abspath(cfg.get("storage", "root_path"))
-    abs_path = os.path.join(storage_root, entry.path)
+    abs_path = os.path.normpath(os.path.join(storage_root, entry.path))
     
     if not os.path.exists(abs_path):
         raise HTTPException(status_code=404, detail="File content not found")
         
     # Permission Check
     # 1. Admin always has access
+    shared = False
     if not is_admin(current_user):
         # 2. Check if inside user's root
         user_root = os.path.abspath(os.path.join(storage_root, current_user.root_path.strip("/")))
-        if not abs_path.startswith(user_root):
-            # 3. Check if explicitly shared with user
-            # This is complex as shares are stored by relative path. 
-            # For now, deny access if not in user root.
-            raise HTTPException(status_code=403, detail="Access denied")
+        if not paths.is_within(abs_path, user_root):
+            # 3. Check if a share with the user covers it
+            if not share_index.lookup_storage_path(db, current_user.username, entry.path):
+                raise HTTPException(status_code=403, detail="Access denied")
+            shared = True
+        if not shared:
+            require_path_access(current_user, abs_path)
 
     if os.path.isdir(abs_path):
         # Return directory listing for this ID
         try:
-            items = []
-            for item_name in os.listdir(abs_path):
-                item_path = os.path.join(abs_path, item_name)
-                is_dir = os.path.isdir(item_path)
-                size = 0 if is_dir else os.path.getsize(item_path)
-                modified = os.path.getmtime(item_path)
-                
-                # Get ID for child
-                rel_path = os.path.relpath(item_path, start=storage_root).replace("\\", "/")
-                child_entry = crud.get_or_create_file_entry(db, rel_path, is_directory=is_dir)
-                
-                items.append({
-                    "name": item_name,
-                    "is_dir": is_dir,
-                    "size": size,
-                    "modified": modified,
-                    "path": item_name, # Path in ID view is just name? Or we shouldn't expose path?
-                    # The frontend expects 'path' for navigation. 
-                    # If we are in ID mode, maybe path should be ignored or relative?
-                    # For now keep name.
-                    "url_id": child_entry.url_id
-                })
-            return items
+            # Path in ID view is just the name; the frontend navigates by url_id here
+            visible = None if shared else listing_filter(current_user, abs_path)
+            return list_directory(db, abs_path, storage_root, listing_query, visible=visible)
         except OSError as e:
              raise HTTPException(status_code=500, detail=f"Failed to list directory: {e}")
              
     else:
-        return FileResponse(abs_path)
-
-@app.get("/api/files/{path:path}")
-def list_or_get_file(path: str = "", db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+        return downloads.file_response(request, abs_path)
+
+def resolve_readable_path(db: Session, user: models.User, path: str) -> Tuple[str, bool]:
+    """
+    Resolve a path the user may read: inside their own root, or covered by
+    a file or folder shared with them. Returns (path, whether it was reached
+    through a share). Raises 404 if neither exists, and 403 if the user's
+    folder permissions deny reading a path in their own root.
+    """
     safe_path = None
     try:
-        safe_path = get_safe_path(current_user, path)
+        safe_path = get_safe_path(user, path)
     except:
         pass
 
-    if not safe_path or not os.path.exists(safe_path):
-        share = db.query(models.FolderShare).filter(
-            models.FolderShare.shared_with_username == current_user.username,
-            models.FolderShare.folder_path == path,
-            models.FolderShare.is_file == True
-        ).first()
-        if share:
-            owner = crud.get_user(db, share.owner_username)
-            if owner:
-                try:
-                    safe_path = get_safe_path(owner, path)
-                except:
-                    pass
+    if safe_path and os.path.exists(safe_path):
+        require_path_access(user, safe_path)
+        return safe_path, False
 
+    safe_path = resolve_shared_path(db, user, path)
     if not safe_path or not os.path.exists(safe_path):
          raise HTTPException(status_code=404, detail="[ERR_NOT_FOUND] File or directory not found")
+    return safe_path, True
+
+@app.get("/api/files/{path:path}")
+def list_or_get_file(
+    request: Request,
+    path: str = "",
+    listing_query: dict = Depends(get_listing_query),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    safe_path, shared = resolve_readable_path(db, current_user, path)
     
     if os.path.isdir(safe_path):
         try:
             cfg = config.get_config()
             storage_root = os.path.abspath(cfg.get("storage", "root_path"))
-            
-            items = []
-            for item_name in os.listdir(safe_path):
-                item_path = os.path.join(safe_path, item_name)
-                is_dir = os.path.isdir(item_path)
-                size = 0 if is_dir else os.path.getsize(item_path)
-                modified = os.path.getmtime(item_path)
-                
-                # Get/Create Encrypted ID
-                # Calculate relative path from storage root
-                try:
-                    rel_path = os.path.relpath(item_path, start=storage_root).replace("\\", "/")
-                    entry = crud.get_or_create_file_entry(db, rel_path, is_directory=is_dir)
-                    url_id = entry.url_id
-                except ValueError:
-                    # Fallback if path calculation fails (e.g. diff drives)
-                    url_id = None
-                
-                items.append({
-                    "name": item_name,
-                    "is_dir": is_dir,
-                    "size": size,
-                    "modified": modified,
-                    "path": os.path.join(path, item_name).replace("\\", "/") if path else item_name,
-                    "url_id": url_id
-                })
-            return items
+            return list_directory(
+                db, safe_path, storage_root, listing_query, path_prefix=path,
+                visible=None if shared else listing_filter(current_user, safe_path)
+            )
         except OSError as e:
             print(f"List dir error: {e}")
             raise HTTPException(status_code=500, detail=f"[ERR_LIST_DIR] Failed to list directory: {str(e)}")
             
     elif os.path.isfile(safe_path):
-        return FileResponse(safe_path)
+        return downloads.file_response(request, safe_path)
     else:
         raise HTTPException(status_code=404, detail="[ERR_NOT_FOUND] File or directory not found")
 
+@app.get("/api/du/{path:path}")
+def disk_usage(
+    path: str = "",
+    limit: int = Query(100, ge=1, le=MAX_LISTING_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    Recursive size of a folder and of its largest subfolders, from the
+    directory size index. Sizes are None until the index has been built.
+    """
+    safe_path, shared = resolve_readable_path(db, current_user, path)
+    if not os.path.isdir(safe_path):
+        return {"path": path, "is_dir": False, "bytes": os.path.getsize(safe_path), "files": 1, "children": [], "total_children": 0}
+
+    cached = listing_cache.get(safe_path)
+    records = cached.records if cached else listing.scan_directory(safe_path)
+    visible = None if shared else listing_filter(current_user, safe_path)
+    names = [record.name for record in records if record.is_dir and (visible is None or visible(record.name))]
+
+    rel_dir = usage.relative_path(safe_path) or ""
+    prefix = f"{rel_dir}/" if rel_dir else ""
+    sizes = dir_sizes.index.sizes(db, [rel_dir] + [prefix + name for name in names])
+    children = []
+    for name in names:
+        size = sizes.get(prefix + name)
+        children.append({
+            "name": name,
+            "path": f"{path.rstrip('/')}/{name}" if path.strip("/") else name,
+            "bytes": size[0] if size else None,
+            "files": size[1] if size else None,
+        })
+    children.sort(key=lambda child: child["bytes"] if child["bytes"] is not None else -1, reverse=True)
+    total = sizes.get(rel_dir)
+    return {
+        "path": path,
+        "is_dir": True,
+        "bytes": total[0] if total else None,
+        "files": total[1] if total else None,
+        "children": children[:limit],
+        "total_children": len(children),
+    }
+
+MAX_SEARCH_PAGE_SIZE = 500
+
+@app.get("/api/search")
+def search_files(
+    q: str = "",
+    mode: str = "substring",
+    path: str = "",
+    type: Optional[str] = None,
+    ext: Optional[str] = None,
+    min_size: Optional[int] = Query(None, ge=0),
+    max_size: Optional[int] = Query(None, ge=0),
+    modified_after: Optional[float] = None,
+    modified_before: Optional[float] = None,
+    limit: int = Query(50, ge=1, le=MAX_SEARCH_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    Search file and folder names in the user's root and in everything shared
+    with them, or only below `path`. `mode` is substring, prefix or glob;
+    results are ordered by name and paged with `cursor`.
+    """
+    if type not in (None, "file", "dir"):
+        raise HTTPException(status_code=400, detail="[ERR_BAD_SEARCH] Type must be 'file' or 'dir'")
+    filters = search.SearchFilters(
+        is_dir=None if type is None else type == "dir",
+        extensions=tuple(
+            "." + part.strip().lower().lstrip(".") for part in (ext or "").split(",") if part.strip()
+        ),
+        min_size=min_size,
+        max_size=max_size,
+        modified_after=modified_after,
+        modified_before=modified_before,
+    )
+
+    own_root = usage.root_key(current_user.root_path)
+    if path.strip("/"):
+        safe_path, shared = resolve_readable_path(db, current_user, path)
+        if not os.path.isdir(safe_path):
+            raise HTTPException(status_code=400, detail="[ERR_BAD_SEARCH] Search path must be a folder")
+        scopes = [search.SearchScope(usage.relative_path(safe_path), False)]
+    else:
+        scopes = [search.SearchScope(own_root, False)]
+        scopes += [
+            search.SearchScope("/".join(permissions.split_path(f"{grant.owner_root}/{grant.folder_path}")), True)
+            for grant in share_index.grants(db, current_user.username)
+        ]
+
+    snapshot = permissions.get_snapshot(current_user)
+    def in_own_root(rel_path: str) -> bool:
+        return not own_root or rel_path.startswith(own_root + "/")
+
+    def visible(rel_path: str) -> bool:
+        if in_own_root(rel_path):
+            return snapshot.can_read_path(rel_path)
+        # Shared items are not subject to the recipient's folder permissions
+        return share_index.lookup_storage_path(db, current_user.username, rel_path) is not None
+
+    try:
+        entries, next_cursor = search.index.search(
+            db, scopes, q, mode, filters, limit=limit, cursor=cursor, visible=visible
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"[ERR_BAD_SEARCH] {e}")
+
+    url_ids = crud.get_or_create_file_entries(db, {entry.path: entry.is_dir for entry in entries}) if entries else {}
+    items = []
+    for entry in entries:
+        if in_own_root(entry.path):
+            user_path, owner = entry.path[len(own_root):].lstrip("/"), None
+        else:
+            grant = share_index.lookup_storage_path(db, current_user.username, entry.path)
+            owner_root = usage.root_key(grant.owner_root)
+            user_path, owner = entry.path[len(owner_root):].lstrip("/"), grant.owner_username
+        items.append({
+            "name": entry.name,
+            "is_dir": entry.is_dir,
+            "size": entry.size,
+            "modified": entry.mtime,
+            "path": user_path,
+            "url_id": url_ids.get(entry.path),
+            "shared_by": owner,
+        })
+    return {"items": items, "next_cursor": next_cursor}
+
+def check_quota(user: models.User, size: int, target_path: str) -> Optional[int]:
+    """
+    Raise 413 if writing `size` bytes to target_path would take the user over
+    their storage quota. Returns the size of the file being replaced, if any.
+    """
+    old_size = usage.file_size(target_path)
+    quota_remaining = usage.ledger.quota_remaining(user)
+    if quota_remaining is not None and size > quota_remaining + (old_size or 0):
+        raise HTTPException(status_code=413, detail="[ERR_QUOTA] Upload exceeds your storage quota")
+    return old_size
+
+def check_allowed_file_types(user: models.User, filenames: List[str]):
+    """Raise 403 if any filename has an extension the user's groups don't allow"""
+    perms = auth.resolve_user_permissions(user)
+    allowed_types = perms.get('allowed_file_types')
+    
+    if allowed_types:
+        allowed_set = set(t.strip().lower() for t in allowed_types.split(','))
+        for filename in filenames:
+            ext = os.path.splitext(filename)[1].lower()
+            if ext not in allowed_set:
+                 raise HTTPException(status_code=403, detail=f"File type not allowed: {ext}")
+
+@app.get("/api/archive/{path:path}")
+def download_archive(
+    path: str = "",
+    method: str = "deflate",
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """Download a folder as a ZIP archive streamed while it is being built"""
+    if method not in archive.COMPRESSION_METHODS:
+        raise HTTPException(status_code=400, detail=f"Method must be one of: {', '.join(archive.COMPRESSION_METHODS)}")
+    
+    safe_path, shared = resolve_readable_path(db, current_user, path)
+    if not os.path.isdir(safe_path):
+        raise HTTPException(status_code=400, detail="[ERR_NOT_A_FOLDER] Only folders can be archived")
+    
+    base_name = os.path.basename(safe_path.rstrip(os.sep)) or "files"
+    filename = f"{base_name}.zip"
+    include = None
+    snapshot = permissions.get_snapshot(current_user)
+    if snapshot.restricts_paths and not shared:
+        # Leave out members the user's folder permissions hide
+        rel_root = storage_relative_path(safe_path)
+        include = lambda rel_path: snapshot.can_read_path(f"{rel_root}/{rel_path}")
+    return StreamingResponse(
+        archive.stream_zip(safe_path, base_name, method, include),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}",
+            "Cache-Control": "no-store",
+        }
+    )
+
 @app.post("/api/upload/{path:path}")
 async def upload_files(
     path: str = "",
@@ -728,15 +978,7 @@ async def upload_files(
     auth.check_permission(current_user, 'can_upload')
     
     # Check file types if restricted
-    perms = auth.resolve_user_permissions(current_user)
-    allowed_types = perms.get('allowed_file_types')
-    
-    if allowed_types:
-        allowed_set = set(t.strip().lower() for t in allowed_types.split(','))
-        for file in files:
-            ext = os.path.splitext(file.filename)[1].lower()
-            if ext not in allowed_set:
-                 raise HTTPException(status_code=403, detail=f"File type not allowed: {ext}")
+    check_allowed_file_types(current_user, [file.filename for file in files])
 
     # Check max files limit for folder uploads (batch uploads)
     cfg = config.get_config()
@@ -750,78 +992,81 @@ async def upload_files(
 
     try:
         safe_path = get_safe_path(current_user, path)
-        os.makedirs(safe_path, exist_ok=True)
+        require_path_access(current_user, safe_path, write=True)
+        # Check every destination before writing anything
+        for file in files:
+            paths.require_visible(file.filename)
+            require_path_access(current_user, os.path.abspath(os.path.join(safe_path, file.filename.replace('\\', '/'))), write=True)
+        await executors.run_disk(os.makedirs, safe_path, exist_ok=True)
+        listing_cache.invalidate_parent(safe_path)
         
         uploaded_files = []
-        total_size = 0
+        quota_remaining = await executors.run_db(usage.ledger.quota_remaining, current_user)
+        budget = uploads.UploadBudget(MAX_FILE_SIZE_BYTES, MAX_TOTAL_UPLOAD_SIZE_BYTES, quota_remaining)
+        # Overwritten files give their old size back to the quota
+        targets = [os.path.join(safe_path, file.filename.replace('\\', '/')) for file in files]
+        old_sizes = await executors.run_disk(lambda: [usage.file_size(target) for target in targets])
+        if budget.quota_remaining is not None:
+            budget.quota_remaining += sum(size or 0 for size in old_sizes)
+        # Reject a batch that cannot fit before writing any of it
+        budget.check_batch([getattr(file, "size", None) for file in files])
         
-        for file in files:
-            # Check individual file size
-            file_content = await file.read()
-            file_size = len(file_content)
-            
-            if file_size > MAX_FILE_SIZE_BYTES:
-                raise HTTPException(
-                    status_code=413,
-                    detail=f"File {file.filename} exceeds maximum size of {MAX_FILE_SIZE_MB}MB"
-                )
-            
-            total_size += file_size
-            
-            # Check total upload size
-            if total_size > MAX_TOTAL_UPLOAD_SIZE_BYTES:
-                raise HTTPException(
-                    status_code=413,
-                    detail=f"Total upload size exceeds maximum of {MAX_TOTAL_UPLOAD_SIZE_MB}MB"
-                )
-            
+        for file, old_size in zip(files, old_sizes):
             # Handle folder structure - filename may contain relative path like "folder/subfolder/file.txt"
             # This happens when using webkitdirectory attribute
             file_relative_path = file.filename.replace('\\', '/')  # Normalize path separators
             full_file_path = os.path.join(safe_path, file_relative_path)
             
             # Security check for the relative path
-            if not os.path.abspath(full_file_path).startswith(safe_path):
+            if not paths.is_within(os.path.abspath(full_file_path), safe_path):
                  print(f"Skipping unsafe file path: {file.filename}")
                  continue
 
             # Create parent directories if they don't exist
             try:
-                os.makedirs(os.path.dirname(full_file_path), exist_ok=True)
+                await executors.run_disk(os.makedirs, os.path.dirname(full_file_path), exist_ok=True)
             except OSError as e:
                  raise HTTPException(status_code=500, detail=f"[ERR_DIR_CREATE] Failed to create directory for file: {str(e)}")
             
             try:
-                with open(full_file_path, "wb") as f:
-                    f.write(file_content)
+                # Stream to disk in chunks; size limits are enforced as bytes arrive
+                file_size = await uploads.stream_to_file(file, full_file_path, budget)
                 uploaded_files.append(file_relative_path)
+                await executors.run_db(usage.ledger.record, full_file_path, file_size - (old_size or 0), 0 if old_size is not None else 1)
+                await executors.run_db(dir_sizes.index.record, full_file_path, file_size - (old_size or 0), 0 if old_size is not None else 1)
+                await executors.run_db(search.index.updated, full_file_path)
+                listing_cache.invalidate_parent(full_file_path)
+            except OSError as e:
+                raise HTTPException(status_code=500, detail=f"[ERR_FILE_WRITE] Failed to write file {file.filename}: {str(e)}")
 
-                # Broadcast update to WebSocket clients
-                try:
-                    # Attempt to decode as text
-                    text_content = file_content.decode('utf-8')
-                    
-                    # Normalize path for broadcasting (must match websocket_endpoint logic)
-                    broadcast_path = os.path.abspath(full_file_path)
-                    if os.name == 'nt':
-                        broadcast_path = broadcast_path.lower()
-                    
-                    # Construct message
-                    msg = json.dumps({
-                        "type": "content_update",
-                        "content": text_content
-                    })
+            # Broadcast update to WebSocket clients editing this file
+            try:
+                # Normalize path for broadcasting (must match websocket_endpoint logic)
+                broadcast_path = os.path.abspath(full_file_path)
+                if os.name == 'nt':
+                    broadcast_path = broadcast_path.lower()
+                
+                # Only read the file back when someone has it open in the editor
+                if manager.is_room_active(broadcast_path) and file_size <= UPLOAD_BROADCAST_MAX_BYTES:
+                    async with aiofiles.open(full_file_path, "rb", executor=executors.disk.executor) as f:
+                        # Attempt to decode as text
+                        text_content = (await f.read()).decode('utf-8')
                     
-                    # Broadcast (sender=None means send to all)
-                    await manager.broadcast_change(msg, broadcast_path, None)
+                    # Editors receive the difference as an operation when the
+                    # room has a shared document, the full content otherwise
+                    if not await manager.replace_content(broadcast_path, text_content):
+                        msg = json.dumps({
+                            "type": "content_update",
+                            "content": text_content
+                        })
+                        # Broadcast (sender=None means send to all)
+                        await manager.broadcast_change(msg, broadcast_path, None, "content_update")
                     print(f"Saved and broadcasted update for: {broadcast_path}")
-                    
-                except UnicodeDecodeError:
-                    pass # Not a text file, skip broadcast
-                except Exception as e:
-                    print(f"Error broadcasting update: {e}")
-            except OSError as e:
-                raise HTTPException(status_code=500, detail=f"[ERR_FILE_WRITE] Failed to write file {file.filename}: {str(e)}")
+                
+            except UnicodeDecodeError:
+                pass # Not a text file, skip broadcast
+            except Exception as e:
+                print(f"Error broadcasting update: {e}")
         
         return {"status": "uploaded", "files": uploaded_files}
     except HTTPException as e:
@@ -830,14 +1075,106 @@ async def upload_files(
         print(f"Upload error: {e}")
         raise HTTPException(status_code=500, detail=f"[ERR_UPLOAD_GENERIC] Upload failed: {str(e)}")
 
+# --- Resumable Uploads ---
+@app.post("/api/uploads")
+def create_resumable_upload(
+    upload: schemas.ResumableUploadCreate,
+    current_user: models.User = Depends(get_current_user)
+):
+    """Start a resumable upload session for a single (possibly multi-GB) file"""
+    auth.check_permission(current_user, 'can_upload')
+    check_allowed_file_types(current_user, [upload.filename])
+    
+    cfg = config.get_config()
+    max_size_mb = cfg.get("uploads", "max_resumable_file_size_mb", 10240)
+    if upload.size < 0:
+        raise HTTPException(status_code=400, detail="Invalid file size")
+    if upload.size > max_size_mb * 1024 * 1024:
+        raise HTTPException(status_code=413, detail=f"File {upload.filename} exceeds maximum size of {max_size_mb}MB")
+    
+    safe_path = get_safe_path(current_user, upload.path)
+    file_relative_path = upload.filename.replace('\\', '/')
+    paths.require_visible(file_relative_path)
+    target_path = os.path.abspath(os.path.join(safe_path, file_relative_path))
+    if not paths.is_within(target_path, safe_path) or target_path == safe_path:
+        raise HTTPException(status_code=400, detail="[ERR_ACCESS_DENIED] Invalid file name")
+    require_path_access(current_user, target_path, write=True)
+    check_quota(current_user, upload.size, target_path)
+    
+    store = resumable.get_store()
+    store.collect_garbage(resumable.session_ttl_seconds())
+    try:
+        session = store.create(current_user.username, target_path, file_relative_path, upload.size)
+    except OSError as e:
+        raise HTTPException(status_code=500, detail=f"[ERR_UPLOAD_SESSION] Failed to create upload session: {str(e)}")
+    
+    status_info = session.status()
+    status_info["chunk_size"] = int(cfg.get("uploads", "resumable_chunk_size_mb", 8) * 1024 * 1024)
+    return status_info
+
+@app.get("/api/uploads/{upload_id}")
+def get_resumable_upload(upload_id: str, current_user: models.User = Depends(get_current_user)):
+    """Report received byte ranges so a client can resume after an interruption"""
+    return resumable.get_store().get(upload_id, current_user.username).status()
+
+@app.put("/api/uploads/{upload_id}")
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    current_user: models.User = Depends(get_current_user)
+):
+    """Write the raw request body at `offset`. Chunks may be sent in parallel."""
+    store = resumable.get_store()
+    session = store.get(upload_id, current_user.username)
+    try:
+        session = await store.write_chunk(session, offset, request.stream())
+    except OSError as e:
+        raise HTTPException(status_code=500, detail=f"[ERR_FILE_WRITE] Failed to write chunk: {str(e)}")
+    return session.status()
+
+@app.post("/api/uploads/{upload_id}/complete")
+def complete_resumable_upload(upload_id: str, current_user: models.User = Depends(get_current_user)):
+    """Move a fully received upload into place"""
+    # Permissions may have changed while the upload was running
+    auth.check_permission(current_user, 'can_upload')
+    store = resumable.get_store()
+    session = store.get(upload_id, current_user.username)
+    require_path_access(current_user, session.target_path, write=True)
+    # Other uploads may have used up the quota meanwhile
+    old_size = check_quota(current_user, session.size, session.target_path)
+    try:
+        store.finalize(session)
+    except OSError as e:
+        raise HTTPException(status_code=500, detail=f"[ERR_FILE_WRITE] Failed to finalize upload: {str(e)}")
+    usage.ledger.record(session.target_path, session.size - (old_size or 0), 0 if old_size is not None else 1)
+    dir_sizes.index.record(session.target_path, session.size - (old_size or 0), 0 if old_size is not None else 1)
+    search.index.updated(session.target_path)
+    listing_cache.invalidate_parent(session.target_path)
+    return {"status": "uploaded", "files": [session.display_path]}
+
+@app.delete("/api/uploads/{upload_id}")
+def abort_resumable_upload(upload_id: str, current_user: models.User = Depends(get_current_user)):
+    """Cancel an upload session and delete its partial data"""
+    store = resumable.get_store()
+    store.get(upload_id, current_user.username)
+    store.discard(upload_id)
+    return {"status": "aborted"}
+
 @app.post("/api/save-file")
 async def save_file(
     file_path: str = Form(...),
     content: str = Form(...),
+    version: Optional[int] = Form(None),
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Save file content - used by editor autosave. Checks file access permission."""
+    """
+    Save file content - used by editor autosave. Checks file access permission.
+    Editors using the operation protocol pass the document version their
+    content is based on: the shared document is saved instead, with any
+    difference from that version applied to it as an edit.
+    """
     try:
         # Try to resolve path in user's root
         safe_path = None
@@ -846,47 +1183,50 @@ async def save_file(
         except:
             pass
         
-        # If not in user's root, check if it's a shared file
-        if not safe_path or not os.path.exists(safe_path):
-            share = db.query(models.FolderShare).filter(
-                models.FolderShare.shared_with_username == current_user.username,
-                models.FolderShare.folder_path == file_path,
-                models.FolderShare.is_file == True
-            ).first()
-            
-            if share:
-                owner = crud.get_user(db, share.owner_username)
-                if owner:
-                    try:
-                        safe_path = get_safe_path(owner, file_path)
-                    except:
-                        pass
+        if safe_path and await executors.run_disk(os.path.exists, safe_path):
+            require_path_access(current_user, safe_path, write=True)
+        # If not in user's root, check if a share covers it
+        else:
+            safe_path = await executors.run_db(resolve_shared_path, db, current_user, file_path, write=True)
         
         if not safe_path:
             raise HTTPException(status_code=404, detail="File not found or access denied")
         
+        # Normalize path to the room key used by websocket_endpoint
+        broadcast_path = os.path.abspath(safe_path)
+        if os.name == 'nt':
+            broadcast_path = broadcast_path.lower()
+
+        if version is not None:
+            saved = await manager.save_document(broadcast_path, version, content)
+            if saved is None:
+                raise HTTPException(status_code=503, detail="[ERR_SAVE_TIMEOUT] The editing session did not respond, please try again", headers={"Retry-After": "1"})
+            if saved:
+                return {"status": "saved"}
+
         # Write content
-        with open(safe_path, "w", encoding="utf-8") as f:
-            f.write(content)
+        old_size = await executors.run_disk(usage.file_size, safe_path)
+        # Temp file and rename, like the collaborative write-back
+        await executors.run_disk(uploads.write_text_atomic, safe_path, content)
+        new_size = await executors.run_disk(usage.file_size, safe_path)
+        await executors.run_db(usage.ledger.record, safe_path, (new_size or 0) - (old_size or 0), 0 if old_size is not None else 1)
+        await executors.run_db(dir_sizes.index.record, safe_path, (new_size or 0) - (old_size or 0), 0 if old_size is not None else 1)
+        await executors.run_db(search.index.updated, safe_path)
+        listing_cache.invalidate_parent(safe_path)
         
         # Broadcast update to WebSocket clients
-        try:
-            # Normalize path for broadcasting
-            broadcast_path = os.path.abspath(safe_path)
-            if os.name == 'nt':
-                broadcast_path = broadcast_path.lower()
-            
-            # Construct message
-            msg = json.dumps({
-                "type": "content_update",
-                "content": content
-            })
-            
-            # Broadcast (sender=None means send to all)
-            await manager.broadcast_change(msg, broadcast_path, None)
-            print(f"Saved and broadcasted update for: {broadcast_path}")
-        except Exception as e:
-            print(f"Error broadcasting update: {e}")
+        if version is None:
+            try:
+                if not await manager.replace_content(broadcast_path, content):
+                    msg = json.dumps({
+                        "type": "content_update",
+                        "content": content
+                    })
+                    # Broadcast (sender=None means send to all)
+                    await manager.broadcast_change(msg, broadcast_path, None, "content_update")
+                print(f"Saved and broadcasted update for: {broadcast_path}")
+            except Exception as e:
+                print(f"Error broadcasting update: {e}")
         
         return {"status": "saved"}
         
@@ -902,11 +1242,15 @@ def create_directory(path: str, current_user: models.User = Depends(get_current_
     auth.check_permission(current_user, 'can_create_folders')
     try:
         safe_path = get_safe_path(current_user, path)
+        require_path_access(current_user, safe_path, write=True)
         
         if os.path.exists(safe_path):
              raise HTTPException(status_code=409, detail="[ERR_EXISTS] Folder already exists")
 
         os.makedirs(safe_path, exist_ok=True)
+        dir_sizes.index.created(safe_path)
+        search.index.updated(safe_path)
+        listing_cache.invalidate_parent(safe_path)
         return {"status": "created"}
     except HTTPException as e:
         raise e
@@ -923,12 +1267,17 @@ def create_folder(path: str = "", name: str = Form(...), current_user: models.Us
     # Deprecated/Legacy support if needed, but /mkdir/ is what frontend uses
     try:
         safe_path = get_safe_path(current_user, path)
+        paths.require_visible(name)
         new_folder = os.path.join(safe_path, name)
+        require_path_access(current_user, os.path.abspath(new_folder), write=True)
         
         if os.path.exists(new_folder):
              raise HTTPException(status_code=409, detail="[ERR_EXISTS] Folder already exists")
 
         os.makedirs(new_folder, exist_ok=True)
+        dir_sizes.index.created(new_folder)
+        search.index.updated(new_folder)
+        listing_cache.invalidate(safe_path)
         return {"status": "created"}
     except HTTPException as e:
         raise e
@@ -943,10 +1292,19 @@ def create_folder(path: str = "", name: str = Form(...), current_user: models.Us
 def delete_file(path: str, current_user: models.User = Depends(get_current_user)):
     auth.check_permission(current_user, 'can_delete')
     safe_path = get_safe_path(current_user, path)
-    if os.path.isdir(safe_path):
+    require_path_access(current_user, safe_path, write=True)
+    freed_bytes, freed_files = usage.tree_size(safe_path)
+    is_dir = os.path.isdir(safe_path)
+    if is_dir:
         shutil.rmtree(safe_path)
     else:
         os.remove(safe_path)
+    usage.ledger.removed(safe_path, freed_bytes, freed_files, is_dir)
+    dir_sizes.index.removed(safe_path, freed_bytes, freed_files, is_dir)
+    search.index.removed(safe_path)
+    listing_cache.invalidate_tree(safe_path)
+    listing_cache.invalidate_parent(safe_path)
+    paths.resolver.invalidate()
     return {"status": "deleted"}
 
 @app.post("/api/rename")
@@ -967,18 +1325,31 @@ def rename_item(
         # Calculate new path
         # The new name is just the name, not a path. It stays in the same directory.
         parent_dir = os.path.dirname(safe_old_path)
+        paths.require_visible(item.new_name)
         safe_new_path = os.path.join(parent_dir, item.new_name)
         
         # Verify the new path is safe (still within allowed root)
         # This is implicitly safe if parent_dir is safe, but good to double check 
         # against navigation attacks like "../../foo"
-        if not os.path.abspath(safe_new_path).startswith(parent_dir):
+        if not paths.is_within(os.path.abspath(safe_new_path), parent_dir) or os.path.abspath(safe_new_path) == parent_dir:
              raise HTTPException(status_code=400, detail="Invalid new name")
              
+        require_path_access(current_user, safe_old_path, write=True)
+        require_path_access(current_user, os.path.abspath(safe_new_path), write=True)
+        
         if os.path.exists(safe_new_path):
              raise HTTPException(status_code=409, detail="Item with that name already exists")
              
+        # Same parent directory, so usage above it is unchanged; user roots
+        # inside a renamed folder are corrected by reconciliation
         shutil.move(safe_old_path, safe_new_path)
+        if os.path.isdir(safe_new_path):
+            usage.ledger.moved(safe_old_path, safe_new_path)
+            dir_sizes.index.moved(safe_old_path, safe_new_path)
+        search.index.moved(safe_old_path, safe_new_path)
+        listing_cache.invalidate_tree(safe_old_path)
+        listing_cache.invalidate_parent(safe_old_path)
+        paths.resolver.invalidate()
         return {"status": "renamed"}
         
     except HTTPException as e:
@@ -1001,9 +1372,11 @@ def share_folder(
     
     # Check if it's a file
     safe_path = get_safe_path(current_user, share.folder_path)
+    require_path_access(current_user, safe_path)
     is_file = os.path.isfile(safe_path)
     
     crud.create_folder_share(db, share.folder_path, current_user.username, share.username, share.permission, is_file=is_file)
+    share_index.invalidate(share.username)
     return {"status": "shared"}
 
 @app.get("/api/shared-with-me", response_model=List[schemas.FolderShareInfo])
@@ -1015,15 +1388,19 @@ def get_shared_with_me(db: Session = Depends(get_db), current_user: models.User
 
 @app.delete("/api/share/{share_id}")
 async def unshare_folder(share_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    share = db.query(models.FolderShare).filter(models.FolderShare.id == share_id).first()
-    if not share:
-        raise HTTPException(status_code=404, detail="Share not found")
-    
-    if share.owner_username != current_user.username:
-        raise HTTPException(status_code=403, detail="Not authorized")
-    
-    db.delete(share)
-    db.commit()
+    def delete_share() -> str:
+        share = db.query(models.FolderShare).filter(models.FolderShare.id == share_id).first()
+        if not share:
+            raise HTTPException(status_code=404, detail="Share not found")
+        
+        if share.owner_username != current_user.username:
+            raise HTTPException(status_code=403, detail="Not authorized")
+        
+        db.delete(share)
+        db.commit()
+        return share.shared_with_username
+
+    share_index.invalidate(await executors.run_db(delete_share))
     return {"status": "unshared"}
 
 # --- Group Endpoints ---
@@ -1074,8 +1451,43 @@ def delete_group(group_name: str, db: Session = Depends(get_db), current_user: m
         raise HTTPException(status_code=404, detail="Group not found")
     db.delete(db_group)
     db.commit()
+    permissions.bump_version()
+    principal_cache.invalidate_all()
     return {"status": "deleted"}
 
+def resolve_editor_path(db: Session, user: models.User, file_path: str) -> Tuple[Optional[str], bool]:
+    """
+    Canonical path of a file the user may open in the editor (or None), and
+    whether they may change it, by the same checks save_file applies.
+    """
+    canonical_path = None
+    can_write = False
+    
+    # 1. Try resolving in user's root using safe path logic
+    try:
+        candidate_path = get_safe_path(user, file_path)
+        if os.path.exists(candidate_path) and permissions.get_snapshot(user).can_read_path(storage_relative_path(candidate_path)):
+            canonical_path = candidate_path
+            try:
+                require_path_access(user, candidate_path, write=True)
+                can_write = True
+            except HTTPException:
+                pass
+    except:
+        pass
+        
+    # 2. If not found locally, check the file and folder shares covering it
+    if not canonical_path:
+        shared_path = resolve_shared_path(db, user, file_path)
+        # Verify the file actually exists in owner's space
+        if shared_path and os.path.exists(shared_path):
+            canonical_path = shared_path
+            try:
+                can_write = resolve_shared_path(db, user, file_path, write=True) is not None
+            except HTTPException:
+                pass
+    return canonical_path, can_write
+
 @app.websocket("/ws/{file_path:path}")
 async def websocket_endpoint(
     websocket: WebSocket, 
@@ -1092,7 +1504,7 @@ async def websocket_endpoint(
             return
             
         # Get user for permission check
-        user = crud.get_user(db, username)
+        user = await executors.run_db(crud.get_user, db, username)
         if not user:
              await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
              return
@@ -1100,57 +1512,9 @@ async def websocket_endpoint(
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
 
-    # Resolve canonical path
-    canonical_path = None
-    
-    # 1. Try resolving in user's root using safe path logic
-    try:
-        candidate_path = get_safe_path(user, file_path)
-        if os.path.exists(candidate_path):
-            canonical_path = candidate_path
-    except:
-        pass
-        
-    # 2. If not found locally, check shares
-    if not canonical_path:
-        # Check direct file share
-        share = db.query(models.FolderShare).filter(
-            models.FolderShare.shared_with_username == username,
-            models.FolderShare.folder_path == file_path,
-            models.FolderShare.is_file == True
-        ).first()
-
-        if share:
-            owner = crud.get_user(db, share.owner_username)
-            if owner:
-                try:
-                    canonical_path = get_safe_path(owner, file_path)
-                except:
-                    pass
-        
-        # Check folder shares (recursive parent check)
-        if not canonical_path:
-            path_parts = file_path.split('/')
-            for i in range(len(path_parts), 0, -1):
-                check_path = "/".join(path_parts[:i])
-                share = db.query(models.FolderShare).filter(
-                    models.FolderShare.shared_with_username == username,
-                    models.FolderShare.folder_path == check_path,
-                    models.FolderShare.is_file == False
-                ).first()
-                if share:
-                    owner = crud.get_user(db, share.owner_username)
-                    if owner:
-                        try:
-                            # Verify the file actually exists in owner's space
-                            possible_path = get_safe_path(owner, file_path)
-                            if os.path.exists(possible_path):
-                                canonical_path = possible_path
-                        except:
-                            pass
-                    break
-
-    print(f"WS Connect: User={username} ReqPath={file_path} Canonical={canonical_path}")
+    canonical_path, can_write = await executors.run_db(resolve_editor_path, db, user, file_path)
+
+    print(f"WS Connect: User={username} ReqPath={file_path} Canonical={canonical_path} Write={can_write}")
 
     if not canonical_path:
          print(f"WS Connect Failed: Access Denied for {username} to {file_path}")
@@ -1161,10 +1525,11 @@ async def websocket_endpoint(
     if os.name == 'nt':
         canonical_path = canonical_path.lower()
 
-    await manager.connect(websocket, canonical_path, username)
+    conn = await manager.connect(websocket, canonical_path, username, can_write)
     try:
         while True:
             data = await websocket.receive_text()
+            manager.touch(conn)
             # Parse and handle different message types
             try:
                 message = json.loads(data)
@@ -1172,18 +1537,27 @@ async def websocket_endpoint(
                 # Handle cursor position updates
                 if message.get("type") == "cursor_update":
                     position = message.get("position", 0)
-                    manager.update_cursor(websocket, canonical_path, position)
-                    await manager.broadcast_cursors(canonical_path)
+                    # Sent to the room with the next presence tick
+                    manager.update_cursor(conn, position)
+                elif message.get("type") in ("sync", "op", "content_update") and \
+                        await manager.handle_document_message(conn, message):
+                    # Applied to the room's shared document and sent out as operations
+                    pass
                 else:
-                    # Broadcast other changes (content updates, etc.)
-                    await manager.broadcast_change(data, canonical_path, websocket)
+                    # Broadcast other changes (content updates of files without a
+                    # shared document, etc.); a newer full-content update
+                    # supersedes one still queued for a client
+                    coalesce_key = "content_update" if message.get("type") == "content_update" else None
+                    await manager.broadcast_change(data, canonical_path, conn, coalesce_key)
             except json.JSONDecodeError:
-                # If not JSON, just forward it (backward compatibility)
-                await manager.broadcast_change(data, canonical_path, websocket)
-    except WebSocketDisconnect:
-        manager.disconnect(websocket, canonical_path)
+                # If not JSON, just forward it (backward compatibility); it
+                # may be content, so read-only editors can't send it
+                if conn.can_write:
+                    await manager.broadcast_change(data, canonical_path, conn)
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError: the socket was closed server-side, e.g. as a slow consumer or after a failed send
+        manager.disconnect(conn)
         await manager.broadcast_user_list(canonical_path)
-        await manager.broadcast_cursors(canonical_path)
 
 # --- Python Runner Endpoints ---
 from .python_runner import runner
@@ -1209,10 +1583,11 @@ async def run_python(request: RunPythonRequest, current_user: models.User = Depe
         # Resolve the path to a real filesystem path
         # request.path is the directory containing the file (from frontend currentPath)
         safe_path = get_safe_path(current_user, request.path)
+        require_path_access(current_user, safe_path)
         
-        if os.path.isdir(safe_path):
+        if await executors.run_disk(os.path.isdir, safe_path):
             source_dir = safe_path
-        elif os.path.isfile(safe_path):
+        elif await executors.run_disk(os.path.isfile, safe_path):
             source_dir = os.path.dirname(safe_path)
             
     except Exception as e:
@@ -1231,13 +1606,54 @@ async def install_package(request: InstallPackageRequest, current_user: models.U
 @app.delete("/api/python/cleanup/{session_id}")
 async def cleanup_environment(session_id: str, current_user: models.User = Depends(get_current_user)):
     """Clean up the isolated environment"""
-    runner.cleanup_environment(session_id)
+    await executors.run_disk(runner.cleanup_environment, session_id)
     return {"status": "cleaned up"}
 
 @app.on_event("shutdown")
 def shutdown_event():
     """Clean up all environments on shutdown"""
     runner.cleanup_all()
+    hashing.service.shutdown()
+
+@app.on_event("startup")
+async def start_usage_reconciliation():
+    """Periodically recount storage usage against the disk"""
+    usage.ledger.start()
+
+@app.on_event("shutdown")
+async def stop_usage_reconciliation():
+    await usage.ledger.stop()
+
+@app.on_event("startup")
+async def start_dir_size_index():
+    """Build the directory size index if missing and refresh it periodically"""
+    dir_sizes.index.start()
+
+@app.on_event("shutdown")
+async def stop_dir_size_index():
+    await dir_sizes.index.stop()
+
+@app.on_event("startup")
+async def start_search_crawler():
+    """Fill the search index if it is empty and re-crawl the storage periodically"""
+    search.index.start()
+
+@app.on_event("shutdown")
+async def stop_search_crawler():
+    await search.index.stop()
+
+@app.on_event("startup")
+async def start_collaboration():
+    """Connect to the collaboration backplane"""
+    executors.loop_monitor.start()
+    await manager.start()
+
+@app.on_event("shutdown")
+async def stop_collaboration():
+    await manager.stop()
+    await executors.loop_monitor.stop()
+    # After the collaboration manager has written its documents back
+    executors.shutdown()
 
 
 # Group Management Endpoints
@@ -1344,52 +1760,62 @@ def get_server_info(current_user: models.User = Depends(get_current_user)):
     
     cfg = config.get_config()
     
-    # Calculate active connections (sum of all files)
-    active_connections = sum(len(conns) for conns in manager.active_connections.values())
-    
     return {
         "version": "1.1.0",
-        "active_websocket_connections": active_connections,
+        "active_websocket_connections": manager.connection_count,
+        "collaboration": manager.stats(),
         "storage_root": os.path.abspath(cfg.get("storage", "root_path")),
-        "db_path": os.path.abspath("./fileserver.db")
+        "db_path": database.database_path()
+    }
+
+@app.get("/api/server/cache")
+def get_cache_stats(current_user: models.User = Depends(get_current_user)):
+    """Get directory listing cache statistics"""
+    if not is_admin(current_user):
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return {
+        "listing_cache": listing_cache.stats(),
+        "principal_cache": principal_cache.stats(),
+        "share_index": share_index.stats(),
     }
 
+@app.get("/api/server/hashing")
+def get_hashing_stats(current_user: models.User = Depends(get_current_user)):
+    """Get password hashing pool settings, queue depth and latencies"""
+    if not is_admin(current_user):
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return hashing.service.describe()
 
-# WebSocket endpoint for collaborative editing
-@app.websocket("/ws/{file_path:path}")
-async def websocket_endpoint(websocket: WebSocket, file_path: str, token: str = None):
-    # Authenticate the WebSocket connection
-    if not token:
-        await websocket.close(code=1008)
-        return
-    
-    try:
-        # Verify token and get user
-        payload = auth.verify_token(token)
-        username = payload.get("sub")
-        if not username:
-            await websocket.close(code=1008)
-            return
-        
-        # Accept the connection
-        await websocket.accept()
-        await manager.connect(websocket, file_path, username)
-        
-        try:
-            while True:
-                # Receive message from client
-                data = await websocket.receive_text()
-                # Broadcast to all other clients editing the same file
-                await manager.broadcast_change(data, file_path, websocket)
-        except WebSocketDisconnect:
-            manager.disconnect(websocket, file_path)
-            await manager.broadcast_user_list(file_path)
-    except Exception as e:
-        print(f"WebSocket error: {e}")
-        try:
-            await websocket.close(code=1011)
-        except:
-            pass
+@app.get("/api/server/usage")
+def get_storage_usage(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """Get storage usage and quotas per user and group from the usage ledger"""
+    if not is_admin(current_user):
+        raise HTTPException(status_code=403, detail="Not authorized")
+    report = usage.ledger.report(db)
+    report["dir_sizes"] = dir_sizes.index.last_recompute
+    return report
+
+@app.get("/api/server/search")
+def get_search_stats(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """Get search index size, trigram index availability and the last crawl"""
+    if not is_admin(current_user):
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return search.index.stats(db)
+
+@app.get("/api/server/executors")
+def get_executor_stats(current_user: models.User = Depends(get_current_user)):
+    """Get disk, database and CPU thread pool usage and event loop lag"""
+    if not is_admin(current_user):
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return executors.stats()
+
+@app.post("/api/server/cache/clear")
+def clear_cache(current_user: models.User = Depends(get_current_user)):
+    """Drop all cached directory listings"""
+    if not is_admin(current_user):
+        raise HTTPException(status_code=403, detail="Not authorized")
+    listing_cache.clear()
+    return {"message": "Cache cleared"}
 
 
 # Initialize Admin User
@@ -1434,6 +1860,9 @@ def startup_event():
             print("Added admin user to super_admins group")
     
     db.close()
+    
+    # Drop resumable uploads abandoned while the server was down
+    resumable.get_store().collect_garbage(resumable.session_ttl_seconds())
 
 # Serve static files
 if os.path.exists("frontend/dist"):
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, Text
+from sqlalchemy import Boolean, Column, Float, Integer, String, ForeignKey, Text
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -73,3 +73,53 @@ class FileEntry(Base):
     path = Column(String, unique=True, index=True)  # Path relative to storage root
     url_id = Column(String(16), unique=True, index=True)
     is_directory = Column(Boolean, default=False)
+
+class StorageUsage(Base):
+    __tablename__ = "storage_usage"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    root_path = Column(String, unique=True, index=True)  # User root relative to the storage root, "" for the whole storage
+    bytes = Column(Integer, default=0)
+    files = Column(Integer, default=0)
+    reconciled_at = Column(Float, default=0)  # Last full scan (epoch seconds)
+
+class DirSize(Base):
+    __tablename__ = "dir_sizes"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    path = Column(String, unique=True, index=True)  # Directory relative to the storage root, "" for the root itself
+    bytes = Column(Integer, default=0)  # Everything below the directory
+    files = Column(Integer, default=0)
+    recomputed_at = Column(Float, default=0)  # Full recompute that last corrected the row (epoch seconds)
+
+class FileIndexEntry(Base):
+    __tablename__ = "file_index"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    path = Column(String, unique=True, index=True)  # Path relative to storage root
+    parent = Column(String, index=True)  # Containing directory, "" for the storage root
+    name = Column(String)
+    name_key = Column(String, index=True)  # Lowercased name for prefix search and ordering
+    extension = Column(String, index=True)  # Lowercased, with the dot; "" for folders
+    size = Column(Integer, default=0)
+    mtime = Column(Float, default=0)
+    is_dir = Column(Boolean, default=False)
+
+class SizeWalk(Base):
+    __tablename__ = "size_walks"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    walk = Column(String, unique=True, index=True)  # Full walk in progress, e.g. "usage"
+    started = Column(Float, default=0)  # Epoch seconds
+
+class SizeJournalEntry(Base):
+    __tablename__ = "size_journal"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    walk = Column(String, index=True)  # Walk the change was recorded during
+    kind = Column(String)  # 'change', 'created', 'removed' or 'moved'
+    path = Column(String)  # Changed file or directory relative to the storage root
+    target = Column(String, nullable=True)  # New path of a move
+    bytes = Column(Integer, default=0)
+    files = Column(Integer, default=0)
+    recorded_at = Column(Float, default=0)  # Epoch seconds
@@ -0,0 +1,251 @@
+"""
+Operational transformation for plain text
+An operation is a list of components applied left to right over the whole
+document, in the format used by ot.js:
+- int n > 0: retain n characters
+- int n < 0: delete -n characters
+- str: insert it
+Lengths count Unicode code points.
+
+Document keeps the authoritative text of a collaborative editing room with
+a version number and a bounded history of applied operations. Operations
+based on an older version are transformed against everything applied
+since, so concurrent edits never overwrite each other.
+"""
+
+from collections import deque
+from typing import List, Optional, Tuple, Union
+
+Component = Union[int, str]
+Operation = List[Component]
+
+# Operations kept for transforming late edits and catching up reconnecting clients
+HISTORY_LIMIT = 1000
+
+
+class OperationError(ValueError):
+    pass
+
+
+class StaleVersion(Exception):
+    """The base version is older than the kept history; the client must resync"""
+
+
+def _is_retain(c) -> bool:
+    return isinstance(c, int) and not isinstance(c, bool) and c > 0
+
+
+def _is_delete(c) -> bool:
+    return isinstance(c, int) and not isinstance(c, bool) and c < 0
+
+
+def _is_insert(c) -> bool:
+    return isinstance(c, str)
+
+
+class _Builder:
+    """Appends components, merging neighbours of the same kind"""
+
+    def __init__(self):
+        self.ops: Operation = []
+
+    def retain(self, n: int):
+        if n <= 0:
+            return
+        if self.ops and _is_retain(self.ops[-1]):
+            self.ops[-1] += n
+        else:
+            self.ops.append(n)
+
+    def insert(self, s: str):
+        if not s:
+            return
+        ops = self.ops
+        if ops and _is_insert(ops[-1]):
+            ops[-1] += s
+        elif ops and _is_delete(ops[-1]):
+            # Keep inserts before deletes so equal operations look the same
+            if len(ops) > 1 and _is_insert(ops[-2]):
+                ops[-2] += s
+            else:
+                ops.insert(len(ops) - 1, s)
+        else:
+            ops.append(s)
+
+    def delete(self, n: int):
+        if n <= 0:
+            return
+        if self.ops and _is_delete(self.ops[-1]):
+            self.ops[-1] -= n
+        else:
+            self.ops.append(-n)
+
+
+def normalize(op) -> Operation:
+    """Validate component types and merge neighbours; raises OperationError"""
+    if not isinstance(op, list):
+        raise OperationError("Operation must be a list")
+    builder = _Builder()
+    for c in op:
+        if _is_retain(c):
+            builder.retain(c)
+        elif _is_delete(c):
+            builder.delete(-c)
+        elif _is_insert(c):
+            builder.insert(c)
+        elif c == 0 or c == "":
+            continue
+        else:
+            raise OperationError(f"Invalid component: {c!r}")
+    return builder.ops
+
+
+def base_length(op: Operation) -> int:
+    """Length of the text the operation applies to"""
+    return sum(c if _is_retain(c) else -c for c in op if not _is_insert(c))
+
+
+def target_length(op: Operation) -> int:
+    """Length of the text the operation produces"""
+    return sum(c if _is_retain(c) else len(c) for c in op if not _is_delete(c))
+
+
+def is_noop(op: Operation) -> bool:
+    return all(_is_retain(c) for c in op)
+
+
+def apply(text: str, op: Operation) -> str:
+    if base_length(op) != len(text):
+        raise OperationError(f"Operation base length {base_length(op)} does not match document length {len(text)}")
+    parts = []
+    pos = 0
+    for c in op:
+        if _is_retain(c):
+            parts.append(text[pos:pos + c])
+            pos += c
+        elif _is_insert(c):
+            parts.append(c)
+        else:
+            pos -= c
+    return "".join(parts)
+
+
+def transform(a: Operation, b: Operation) -> Tuple[Operation, Operation]:
+    """
+    Transform two operations made concurrently on the same text. Returns
+    (a', b') such that apply(apply(t, a), b') == apply(apply(t, b), a').
+    When both insert at the same position, a's insert comes first.
+    """
+    if base_length(a) != base_length(b):
+        raise OperationError("Concurrent operations must have the same base length")
+    a_prime, b_prime = _Builder(), _Builder()
+    ia, ib = iter(a), iter(b)
+    ca, cb = next(ia, None), next(ib, None)
+
+    while ca is not None or cb is not None:
+        if ca is not None and _is_insert(ca):
+            a_prime.insert(ca)
+            b_prime.retain(len(ca))
+            ca = next(ia, None)
+            continue
+        if cb is not None and _is_insert(cb):
+            a_prime.retain(len(cb))
+            b_prime.insert(cb)
+            cb = next(ib, None)
+            continue
+        if ca is None or cb is None:
+            raise OperationError("Operations have different lengths")
+
+        if _is_retain(ca) and _is_retain(cb):
+            n = min(ca, cb)
+            a_prime.retain(n)
+            b_prime.retain(n)
+        elif _is_delete(ca) and _is_delete(cb):
+            # Both deleted the same text: nothing left to do
+            n = min(-ca, -cb)
+        elif _is_delete(ca) and _is_retain(cb):
+            n = min(-ca, cb)
+            a_prime.delete(n)
+        else:  # retain in a, delete in b
+            n = min(ca, -cb)
+            b_prime.delete(n)
+
+        ca = _consume(ca, n, ia)
+        cb = _consume(cb, n, ib)
+
+    return a_prime.ops, b_prime.ops
+
+
+def _consume(c: int, n: int, it):
+    """Shorten a retain/delete component by n, moving on when used up"""
+    if c > 0:
+        return c - n if c > n else next(it, None)
+    return c + n if -c > n else next(it, None)
+
+
+def diff(old: str, new: str) -> Operation:
+    """Operation turning `old` into `new`: one replaced span between the common prefix and suffix"""
+    if old == new:
+        return [len(old)] if old else []
+    limit = min(len(old), len(new))
+    prefix = 0
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+    builder = _Builder()
+    builder.retain(prefix)
+    builder.insert(new[prefix:len(new) - suffix])
+    builder.delete(len(old) - prefix - suffix)
+    builder.retain(suffix)
+    return builder.ops
+
+
+class Document:
+    def __init__(self, content: str, version: int = 0, history_limit: int = HISTORY_LIMIT):
+        self.content = content
+        self.version = version
+        # (op, op_id) pairs; history[i] turned version (version - len(history) + i) into the next one
+        self.history: deque = deque(maxlen=history_limit)
+
+    @property
+    def oldest_version(self) -> int:
+        return self.version - len(self.history)
+
+    def history_since(self, version: int) -> Optional[List[Tuple[Operation, Optional[str]]]]:
+        """(op, op_id) pairs applied after `version`, or None if they are no longer kept"""
+        if version > self.version or version < self.oldest_version:
+            return None
+        start = len(self.history) - (self.version - version)
+        return [self.history[i] for i in range(start, len(self.history))]
+
+    def apply(self, base_version: int, op, op_id: Optional[str] = None) -> Operation:
+        """
+        Apply an operation made against `base_version`. Returns the operation
+        as applied to the current text (transformed against everything
+        applied since); the document version is then self.version. op_id is
+        kept in the history so a client catching up can recognise its own edits.
+        """
+        op = normalize(op)
+        concurrent = self.history_since(base_version)
+        if concurrent is None:
+            raise StaleVersion(f"Version {base_version} is not available (have {self.oldest_version}-{self.version})")
+        for applied, _ in concurrent:
+            op, _ = transform(op, applied)
+        self.content = apply(self.content, op)
+        self.history.append((op, op_id))
+        self.version += 1
+        return op
+
+    def replace(self, content: str) -> Optional[Operation]:
+        """Set the whole text, recorded as a diff. Returns None if nothing changed."""
+        if content == self.content:
+            return None
+        return self.apply(self.version, diff(self.content, content))
+
+    def reset(self, content: str, version: int):
+        """Adopt a snapshot; the history no longer applies"""
+        self.content = content
+        self.version = version
+        self.history.clear()
@@ -0,0 +1,118 @@
+"""
+User path resolution
+Maps user-relative request paths to absolute paths inside the user's root,
+without touching the filesystem on the hot path
+"""
+
+import logging
+import os
+import threading
+from typing import Dict, Tuple
+
+from fastapi import HTTPException
+
+from .listing import HIDDEN_NAMES
+
+logger = logging.getLogger("fileserver.paths")
+
+# Opt-in diagnostics: FILESERVER_DEBUG_PATHS=1 logs every resolution
+if os.getenv("FILESERVER_DEBUG_PATHS", "").lower() in ("1", "true", "yes"):
+    logger.setLevel(logging.DEBUG)
+    if not logger.handlers:
+        _handler = logging.StreamHandler()
+        _handler.setFormatter(logging.Formatter("[DEBUG] %(name)s: %(message)s"))
+        logger.addHandler(_handler)
+
+
+def is_within(path: str, root: str) -> bool:
+    """
+    Containment test for normalized absolute paths. Unlike a bare
+    startswith, '/data/alice2' is not considered inside '/data/alice'.
+    """
+    path = os.path.normcase(path)
+    root = os.path.normcase(root)
+    if path == root:
+        return True
+    if not root.endswith(os.sep):
+        root += os.sep
+    return path.startswith(root)
+
+
+def is_hidden(path: str) -> bool:
+    """Whether a relative path names server state (e.g. .fileserver) at any depth"""
+    return any(part in HIDDEN_NAMES for part in path.replace("\\", "/").split("/"))
+
+
+def require_visible(path: str):
+    """Reject a user-supplied path that reaches into server state"""
+    if is_hidden(path):
+        logger.debug("Access denied: %r names server state", path)
+        raise HTTPException(status_code=403, detail="[ERR_ACCESS_DENIED] Access denied: Reserved path")
+
+
+class PathResolver:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._storage_roots: Dict[str, str] = {}
+        # (storage root, user root_path) -> absolute, normalized user root
+        self._user_roots: Dict[Tuple[str, str], str] = {}
+
+    def storage_root(self) -> str:
+        configured = os.getenv("STORAGE_ROOT", "./storage")
+        root = self._storage_roots.get(configured)
+        if root is None:
+            root = os.path.abspath(configured)
+            self._storage_roots[configured] = root
+        return root
+
+    def user_root(self, root_path: str) -> str:
+        """
+        Absolute root directory for a user's root_path setting. The directory
+        is created the first time it is resolved; afterwards the cached value
+        is returned without any filesystem access.
+        """
+        storage_root = self.storage_root()
+        key = (storage_root, root_path)
+        user_root = self._user_roots.get(key)
+        if user_root is not None:
+            return user_root
+
+        require_visible(root_path)
+        user_root = os.path.normpath(os.path.join(storage_root, root_path.strip("/")))
+        if not is_within(user_root, storage_root):
+            raise HTTPException(status_code=403, detail="[ERR_ACCESS_DENIED] Access denied: Invalid user root")
+        try:
+            os.makedirs(user_root, exist_ok=True)
+        except OSError as e:
+            print(f"Error creating user root: {e}")
+            raise HTTPException(status_code=500, detail="[ERR_FS_CREATE] Could not create user storage directory")
+
+        with self._lock:
+            self._user_roots[key] = user_root
+        logger.debug("Cached user root %r -> %s", root_path, user_root)
+        return user_root
+
+    def resolve(self, root_path: str, path: str = "") -> str:
+        """Resolve `path` inside the user root, raising 403 on traversal or server state"""
+        require_visible(path)
+        user_root = self.user_root(root_path)
+        full_path = os.path.normpath(os.path.join(user_root, path.strip("/")))
+
+        if not is_within(full_path, user_root):
+            logger.debug("Access denied: %s is not inside %s", full_path, user_root)
+            raise HTTPException(status_code=403, detail="[ERR_ACCESS_DENIED] Access denied: Path traversal detected")
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Resolved %r under root %r -> %s", path, root_path, full_path)
+        return full_path
+
+    def invalidate(self):
+        """
+        Forget cached user roots, e.g. after a delete or rename that may have
+        removed one, so the next resolution recreates it.
+        """
+        with self._lock:
+            self._user_roots.clear()
+
+
+resolver = PathResolver()
@@ -0,0 +1,246 @@
+"""
+Compiled permission engine
+Compiles a user's groups into an immutable snapshot: merged permission flags,
+a frozenset of allowed extensions and a path-prefix trie of folder
+permissions. Snapshots are versioned and only rebuilt after group data
+changes, so checking access to a path is O(depth) with no DB queries.
+"""
+
+import os
+import threading
+from typing import TYPE_CHECKING, Callable, Dict, FrozenSet, Optional, Tuple
+
+if TYPE_CHECKING:
+    from . import models
+
+ADMIN_GROUPS = frozenset({"admins", "super_admins"})
+
+# Folder permission levels, ordered so the most permissive group wins
+LEVEL_NONE = 0
+LEVEL_READ = 1
+LEVEL_WRITE = 2
+PERMISSION_LEVELS = {"none": LEVEL_NONE, "read": LEVEL_READ, "write": LEVEL_WRITE}
+
+FLAG_NAMES = ("can_upload", "can_download", "can_delete", "can_share", "can_create_folders")
+
+# Bumped whenever group definitions or memberships change
+_version = 0
+_version_lock = threading.Lock()
+
+# (user id, group ids) -> snapshot; entries from older versions are rebuilt
+_snapshots: Dict[Tuple[int, Tuple[int, ...]], "PermissionSnapshot"] = {}
+MAX_CACHED_SNAPSHOTS = 10000
+
+
+def bump_version():
+    """Mark all compiled snapshots as stale"""
+    global _version
+    with _version_lock:
+        _version += 1
+
+
+def current_version() -> int:
+    return _version
+
+
+def split_path(path: str) -> Tuple[str, ...]:
+    """Storage-relative path -> tuple of components"""
+    return tuple(part for part in path.replace("\\", "/").split("/") if part and part != ".")
+
+
+class _TrieNode:
+    __slots__ = ("children", "level", "subtree_level")
+
+    def __init__(self, level: int):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.level = level
+        # Highest level anywhere at or below this node
+        self.subtree_level = level
+
+
+class PermissionSnapshot:
+    """Immutable, precompiled permissions for one user at one version"""
+
+    __slots__ = (
+        "version", "is_admin", "can_upload", "can_download", "can_delete", "can_share",
+        "can_create_folders", "max_storage_quota", "allowed_extensions", "restricts_paths", "_trie",
+    )
+
+    def __init__(self, version: int, is_admin: bool, flags: dict, max_storage_quota: Optional[int],
+                 allowed_extensions: Optional[FrozenSet[str]], trie: _TrieNode, restricts_paths: bool):
+        self.version = version
+        self.is_admin = is_admin
+        self.can_upload = flags["can_upload"]
+        self.can_download = flags["can_download"]
+        self.can_delete = flags["can_delete"]
+        self.can_share = flags["can_share"]
+        self.can_create_folders = flags["can_create_folders"]
+        self.max_storage_quota = max_storage_quota  # None means unlimited
+        self.allowed_extensions = allowed_extensions  # None means all types allowed
+        self.restricts_paths = restricts_paths  # False when every path is writable
+        self._trie = trie
+
+    def as_dict(self) -> dict:
+        """Permissions in the format returned by auth.resolve_user_permissions"""
+        return {
+            "can_upload": self.can_upload,
+            "can_download": self.can_download,
+            "can_delete": self.can_delete,
+            "can_share": self.can_share,
+            "can_create_folders": self.can_create_folders,
+            "max_storage_quota": self.max_storage_quota,
+            "allowed_file_types": None if self.allowed_extensions is None else ",".join(sorted(self.allowed_extensions)),
+        }
+
+    def allows_extension(self, filename: str) -> bool:
+        if self.allowed_extensions is None:
+            return True
+        return os.path.splitext(filename)[1].lower() in self.allowed_extensions
+
+    def _lookup(self, rel_path: str) -> Tuple[int, Optional[_TrieNode]]:
+        """(level, trie node) for a path; the node is None below the deepest rule"""
+        node = self._trie
+        for part in split_path(rel_path):
+            child = node.children.get(part)
+            if child is None:
+                return node.level, None
+            node = child
+        return node.level, node
+
+    def path_level(self, rel_path: str) -> int:
+        """Folder permission level for a storage-relative path"""
+        return self._lookup(rel_path)[0]
+
+    def can_read_path(self, rel_path: str) -> bool:
+        """
+        Whether the path may be seen. A folder without read access is still
+        visible when something below it is readable, so users can navigate
+        down to the folders they were granted.
+        """
+        if not self.restricts_paths:
+            return True
+        level, node = self._lookup(rel_path)
+        return level >= LEVEL_READ or (node is not None and node.subtree_level >= LEVEL_READ)
+
+    def can_write_path(self, rel_path: str) -> bool:
+        return not self.restricts_paths or self.path_level(rel_path) >= LEVEL_WRITE
+
+    def child_filter(self, rel_dir: str) -> Optional[Callable[[str], bool]]:
+        """
+        Predicate for which entries of a directory may be listed, or None
+        when all of them may. Costs one trie walk for the whole directory.
+        """
+        if not self.restricts_paths:
+            return None
+        level, node = self._lookup(rel_dir)
+        readable = level >= LEVEL_READ
+        if node is None or not node.children:
+            # No rules below: every entry inherits the directory's level
+            return None if readable else (lambda name: False)
+        visible = {
+            name: child.level >= LEVEL_READ or child.subtree_level >= LEVEL_READ
+            for name, child in node.children.items()
+        }
+        return lambda name: visible.get(name, readable)
+
+
+def _compile_trie(groups) -> Tuple[_TrieNode, bool]:
+    """
+    Merge the folder permissions of all groups into one trie.
+
+    Within a group, the deepest rule covering a path applies; paths no rule
+    covers get LEVEL_NONE if the group is restricted to its folders, and
+    LEVEL_WRITE otherwise (the permission flags still gate each operation).
+    Across groups the most permissive level wins. Every trie node stores
+    that merged level, so lookups just follow the path.
+    """
+    defaults = [LEVEL_NONE if g.restrict_to_folders else LEVEL_WRITE for g in groups]
+    # Explicit rules per path: {components: {group index: level}}
+    rules: Dict[Tuple[str, ...], Dict[int, int]] = {}
+    for index, group in enumerate(groups):
+        for fp in group.folder_permissions:
+            level = PERMISSION_LEVELS.get((fp.permission or "read").lower(), LEVEL_READ)
+            rules.setdefault(split_path(fp.folder_path or ""), {})[index] = level
+
+    if not rules and all(level == LEVEL_WRITE for level in defaults):
+        return _TrieNode(LEVEL_WRITE), False
+
+    # Build the bare trie shape first
+    shape: Dict[Tuple[str, ...], Dict[str, Tuple[str, ...]]] = {(): {}}
+    for parts in rules:
+        for depth in range(1, len(parts) + 1):
+            prefix = parts[:depth]
+            shape.setdefault(prefix, {})
+            shape[parts[:depth - 1]][parts[depth - 1]] = prefix
+
+    def build(prefix: Tuple[str, ...], inherited):
+        levels = list(inherited)
+        for index, level in rules.get(prefix, {}).items():
+            levels[index] = level
+        node = _TrieNode(max(levels) if levels else LEVEL_WRITE)
+        for name, child_prefix in shape[prefix].items():
+            child = build(child_prefix, levels)
+            node.children[name] = child
+            node.subtree_level = max(node.subtree_level, child.subtree_level)
+        return node
+
+    return build((), defaults), True
+
+
+def compile_snapshot(user: "models.User") -> PermissionSnapshot:
+    """Compile a user's groups into a permission snapshot"""
+    version = current_version()
+    groups = list(user.groups or [])
+
+    if {g.name for g in groups} & ADMIN_GROUPS:
+        # Admins get full permissions
+        flags = {name: True for name in FLAG_NAMES}
+        return PermissionSnapshot(version, True, flags, None, None, _TrieNode(LEVEL_WRITE), False)
+
+    # Default permissions (restrictive): no groups means nothing is allowed
+    flags = {name: False for name in FLAG_NAMES}
+    if not groups:
+        return PermissionSnapshot(version, False, flags, 0, frozenset(), _TrieNode(LEVEL_WRITE), False)
+
+    has_unlimited_quota = False
+    max_quota = 0
+    has_unrestricted_files = False
+    allowed_extensions = set()
+
+    for group in groups:
+        for name in FLAG_NAMES:
+            if getattr(group, name):
+                flags[name] = True
+
+        # Quota: the most generous group wins
+        if group.max_storage_quota is None:
+            has_unlimited_quota = True
+        elif group.max_storage_quota > max_quota:
+            max_quota = group.max_storage_quota
+
+        # File types: union across groups, None means unrestricted
+        if group.allowed_file_types is None:
+            has_unrestricted_files = True
+        elif group.allowed_file_types:
+            allowed_extensions.update(e.strip().lower() for e in group.allowed_file_types.split(",") if e.strip())
+
+    # Groups that list no extensions at all leave types unrestricted, as before
+    extensions = None if has_unrestricted_files or not allowed_extensions else frozenset(allowed_extensions)
+    trie, restricts_paths = _compile_trie(groups)
+    return PermissionSnapshot(
+        version, False, flags, None if has_unlimited_quota else max_quota, extensions, trie, restricts_paths
+    )
+
+
+def get_snapshot(user: "models.User") -> PermissionSnapshot:
+    """Compiled permissions for a user, rebuilt only after group data changes"""
+    key = (user.id, tuple(sorted(g.id for g in (user.groups or []))))
+    snapshot = _snapshots.get(key)
+    if snapshot is not None and snapshot.version == current_version():
+        return snapshot
+
+    snapshot = compile_snapshot(user)
+    if len(_snapshots) >= MAX_CACHED_SNAPSHOTS:
+        _snapshots.clear()
+    _snapshots[key] = snapshot
+    return snapshot
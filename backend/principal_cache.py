@@ -0,0 +1,115 @@
+"""
+Authenticated principal cache
+Keeps decoded tokens and loaded users (with groups and compiled permissions)
+per process, so authenticated requests skip JWT verification and the user
+query. Entries expire after a TTL and are invalidated explicitly when users
+or groups change.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "30"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
+
+
+class Principal:
+    __slots__ = ("user", "group_names", "permissions", "expires_at")
+
+    def __init__(self, user, permissions, expires_at: float):
+        self.user = user  # Detached models.User with groups loaded
+        self.group_names = frozenset(g.name for g in user.groups)
+        self.permissions = permissions  # permissions.PermissionSnapshot
+        self.expires_at = expires_at
+
+
+class PrincipalCache:
+    def __init__(self, ttl_seconds: float = PRINCIPAL_CACHE_TTL_SECONDS, max_entries: int = PRINCIPAL_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._tokens: "OrderedDict[str, tuple]" = OrderedDict()  # token -> (username, expires_at)
+        self._principals: "OrderedDict[str, Principal]" = OrderedDict()  # username -> Principal
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    def get_token_subject(self, token: str) -> Optional[str]:
+        """Username for an already verified token, if cached and unexpired"""
+        with self._lock:
+            cached = self._tokens.get(token)
+            if cached is None:
+                return None
+            username, expires_at = cached
+            if time.time() >= expires_at:
+                del self._tokens[token]
+                return None
+            self._tokens.move_to_end(token)
+            return username
+
+    def put_token(self, token: str, username: str, token_exp: Optional[float]):
+        if not self.enabled:
+            return
+        expires_at = time.time() + self.ttl_seconds
+        if token_exp is not None:
+            # Never trust a token past its own expiry
+            expires_at = min(expires_at, token_exp)
+        with self._lock:
+            self._tokens[token] = (username, expires_at)
+            self._tokens.move_to_end(token)
+            while len(self._tokens) > self.max_entries:
+                self._tokens.popitem(last=False)
+
+    def get_principal(self, username: str) -> Optional[Principal]:
+        with self._lock:
+            principal = self._principals.get(username)
+            if principal is None or time.time() >= principal.expires_at:
+                if principal is not None:
+                    del self._principals[username]
+                self.misses += 1
+                return None
+            self._principals.move_to_end(username)
+            self.hits += 1
+            return principal
+
+    def put_principal(self, user, permissions) -> Principal:
+        principal = Principal(user, permissions, time.time() + self.ttl_seconds)
+        if self.enabled:
+            with self._lock:
+                self._principals[user.username] = principal
+                self._principals.move_to_end(user.username)
+                while len(self._principals) > self.max_entries:
+                    self._principals.popitem(last=False)
+        return principal
+
+    def invalidate_user(self, username: str):
+        """Drop a user's cached principal and every cached token for them"""
+        with self._lock:
+            self._principals.pop(username, None)
+            for token in [t for t, (name, _) in self._tokens.items() if name == username]:
+                del self._tokens[token]
+
+    def invalidate_all(self):
+        """Drop all principals, e.g. after a group change that affects many users"""
+        with self._lock:
+            self._principals.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "ttl_seconds": self.ttl_seconds,
+                "principals": len(self._principals),
+                "tokens": len(self._tokens),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+principal_cache = PrincipalCache()
@@ -0,0 +1,277 @@
+"""
+Rate limiting
+Sliding-window counters with lockouts, kept in a pluggable state backend:
+- memory: per process, bounded by a key cap and TTL eviction
+- sqlite: a shared database file, so all workers see the same counters
+  and limits survive restarts
+
+Configured with RATE_LIMIT_BACKEND (memory|sqlite), RATE_LIMIT_DB_PATH and
+RATE_LIMIT_MAX_KEYS.
+"""
+
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, NamedTuple, Optional, Tuple
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_DB_PATH = os.getenv("RATE_LIMIT_DB_PATH", "./ratelimit.db")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+# Expired entries are swept once every this many updates
+SWEEP_INTERVAL = 1000
+
+
+class WindowState(NamedTuple):
+    window_id: int  # floor(now / window)
+    previous: int  # Hits in the previous window
+    current: int  # Hits in the current window
+    locked_until: float  # Unix time, 0 if not locked
+
+
+# fn(state or None) -> (new state or None to delete, expires_at)
+UpdateFn = Callable[[Optional[WindowState]], Tuple[Optional[WindowState], float]]
+
+
+class MemoryBackend:
+    """Per-process state. Least recently used keys are evicted past max_keys."""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[WindowState, float]]" = OrderedDict()
+        self._updates = 0
+
+    def get(self, key: str) -> Optional[WindowState]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[key]
+                return None
+            return entry[0]
+
+    def update(self, key: str, fn: UpdateFn) -> Optional[WindowState]:
+        with self._lock:
+            now = time.time()
+            entry = self._entries.get(key)
+            state = entry[0] if entry is not None and entry[1] > now else None
+            state, expires_at = fn(state)
+            if state is None:
+                self._entries.pop(key, None)
+                return None
+            self._entries[key] = (state, expires_at)
+            self._entries.move_to_end(key)
+
+            self._updates += 1
+            if self._updates % SWEEP_INTERVAL == 0:
+                self._sweep(now)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+            return state
+
+    def _sweep(self, now: float):
+        for key in [k for k, (_, expires_at) in self._entries.items() if expires_at <= now]:
+            del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    """
+    State in a SQLite file shared by all workers. Each update is a single
+    IMMEDIATE transaction, so concurrent read-modify-writes don't lose hits.
+    """
+
+    def __init__(self, path: str = RATE_LIMIT_DB_PATH, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.path = path
+        self.max_keys = max_keys
+        self._local = threading.local()
+        self._updates = 0
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                key TEXT PRIMARY KEY,
+                window_id INTEGER NOT NULL,
+                previous INTEGER NOT NULL,
+                current INTEGER NOT NULL,
+                locked_until REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_rate_limits_expires_at ON rate_limits (expires_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode; transactions are opened explicitly
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[WindowState]:
+        row = self._connect().execute(
+            "SELECT window_id, previous, current, locked_until FROM rate_limits WHERE key = ? AND expires_at > ?",
+            (key, time.time())
+        ).fetchone()
+        return WindowState(*row) if row else None
+
+    def update(self, key: str, fn: UpdateFn) -> Optional[WindowState]:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute(
+                "SELECT window_id, previous, current, locked_until FROM rate_limits WHERE key = ? AND expires_at > ?",
+                (key, now)
+            ).fetchone()
+            state, expires_at = fn(WindowState(*row) if row else None)
+            if state is None:
+                conn.execute("DELETE FROM rate_limits WHERE key = ?", (key,))
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO rate_limits (key, window_id, previous, current, locked_until, expires_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, *state, expires_at)
+                )
+            self._updates += 1
+            if self._updates % SWEEP_INTERVAL == 0:
+                self._sweep(conn, now)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return state
+
+    def _sweep(self, conn: sqlite3.Connection, now: float):
+        conn.execute("DELETE FROM rate_limits WHERE expires_at <= ?", (now,))
+        excess = conn.execute("SELECT COUNT(*) FROM rate_limits").fetchone()[0] - self.max_keys
+        if excess > 0:
+            # Drop the entries closest to expiry first
+            conn.execute(
+                "DELETE FROM rate_limits WHERE key IN (SELECT key FROM rate_limits ORDER BY expires_at LIMIT ?)",
+                (excess,)
+            )
+
+    def clear(self):
+        self._connect().execute("DELETE FROM rate_limits")
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM rate_limits WHERE expires_at > ?", (time.time(),)).fetchone()[0]
+
+
+def create_backend(name: str = RATE_LIMIT_BACKEND):
+    if name == "memory":
+        return MemoryBackend()
+    if name == "sqlite":
+        return SQLiteBackend()
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {name}")
+
+
+class SlidingWindowLimiter:
+    """
+    Approximate sliding window: hits in the previous fixed window are
+    weighted by how much of it still overlaps the sliding window. Needs
+    O(1) state per key, unlike a log of timestamps.
+    """
+
+    def __init__(self, name: str, limit: int, window_seconds: float, backend):
+        self.name = name
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.backend = backend
+
+    def _key(self, key: str) -> str:
+        return f"{self.name}:{key}"
+
+    def _roll(self, state: Optional[WindowState], now: float) -> WindowState:
+        """State moved forward to the window containing `now`"""
+        window_id = int(now // self.window_seconds)
+        if state is None:
+            return WindowState(window_id, 0, 0, 0.0)
+        locked_until = state.locked_until if state.locked_until > now else 0.0
+        if state.window_id == window_id:
+            return state._replace(locked_until=locked_until)
+        if state.window_id == window_id - 1:
+            return WindowState(window_id, state.current, 0, locked_until)
+        return WindowState(window_id, 0, 0, locked_until)
+
+    def _estimate(self, state: WindowState, now: float) -> float:
+        elapsed = (now % self.window_seconds) / self.window_seconds
+        return state.previous * (1.0 - elapsed) + state.current
+
+    def _expires_at(self, state: WindowState) -> float:
+        # Hits stop counting two windows later; a lock may outlive them
+        return max((state.window_id + 2) * self.window_seconds, state.locked_until)
+
+    def hit(self, key: str) -> float:
+        """Record a hit and return the hit count in the sliding window"""
+        now = time.time()
+
+        def apply(state):
+            state = self._roll(state, now)
+            state = state._replace(current=state.current + 1)
+            return state, self._expires_at(state)
+
+        return self._estimate(self.backend.update(self._key(key), apply), now)
+
+    def count(self, key: str) -> float:
+        now = time.time()
+        state = self.backend.get(self._key(key))
+        return self._estimate(self._roll(state, now), now) if state else 0.0
+
+    def is_limited(self, key: str) -> bool:
+        return self.count(key) >= self.limit
+
+    def retry_after(self, key: str) -> int:
+        """Seconds until the key is below its limit again, rounded up"""
+        now = time.time()
+        state = self.backend.get(self._key(key))
+        if state is None:
+            return 0
+        state = self._roll(state, now)
+        if state.locked_until:
+            return max(0, math.ceil(state.locked_until - now))
+        if self._estimate(state, now) < self.limit:
+            return 0
+        window_end = (state.window_id + 1) * self.window_seconds
+        if state.current >= self.limit:
+            # Current hits decay through the next window once this one ends
+            return math.ceil(window_end - now + self.window_seconds * (1.0 - self.limit / state.current))
+        # Wait until the weighted previous window has decayed enough
+        fraction = 1.0 - (self.limit - state.current) / state.previous
+        return math.ceil(window_end - self.window_seconds * (1.0 - fraction) - now)
+
+    def lock(self, key: str, seconds: float):
+        """Lock a key for `seconds`; its hit count starts over"""
+        now = time.time()
+
+        def apply(state):
+            state = WindowState(int(now // self.window_seconds), 0, 0, now + seconds)
+            return state, self._expires_at(state)
+
+        self.backend.update(self._key(key), apply)
+
+    def locked_for(self, key: str) -> int:
+        """Remaining lock time in seconds, 0 if not locked"""
+        state = self.backend.get(self._key(key))
+        if state is None:
+            return 0
+        return max(0, math.ceil(state.locked_until - time.time()))
+
+    def reset(self, key: str):
+        self.backend.update(self._key(key), lambda state: (None, 0.0))
+
+
+backend = create_backend()
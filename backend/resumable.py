@@ -0,0 +1,238 @@
+"""
+Resumable upload sessions
+Large files are uploaded as chunks written at explicit offsets into a partial
+file kept under the storage root. Sessions survive restarts and client
+disconnects, and are garbage-collected once stale.
+"""
+
+import errno
+import json
+import os
+import secrets
+import shutil
+import threading
+import time
+from typing import List, Optional
+
+import aiofiles
+from fastapi import HTTPException
+
+from . import config, executors
+
+# Internal state lives in this directory under the storage root; listings hide it
+STATE_DIR_NAME = ".fileserver"
+SESSION_ID_BYTES = 16
+
+
+def _merge_range(ranges: List[List[int]], start: int, end: int) -> List[List[int]]:
+    """Add [start, end) to a sorted list of disjoint ranges, merging overlaps"""
+    merged = []
+    placed = False
+    for r_start, r_end in ranges:
+        if r_end < start:
+            merged.append([r_start, r_end])
+        elif end < r_start:
+            if not placed:
+                merged.append([start, end])
+                placed = True
+            merged.append([r_start, r_end])
+        else:
+            start, end = min(start, r_start), max(end, r_end)
+    if not placed:
+        merged.append([start, end])
+    return merged
+
+
+class UploadSession:
+    def __init__(self, upload_id: str, username: str, target_path: str, display_path: str, size: int,
+                 created_at: float = None, updated_at: float = None, ranges: List[List[int]] = None):
+        self.upload_id = upload_id
+        self.username = username
+        self.target_path = target_path  # Absolute destination path
+        self.display_path = display_path  # Destination as the client named it
+        self.size = size
+        self.created_at = created_at or time.time()
+        self.updated_at = updated_at or self.created_at
+        self.ranges = ranges or []
+
+    @property
+    def received(self) -> int:
+        """Length of the contiguous prefix received so far (the resume offset)"""
+        if self.ranges and self.ranges[0][0] == 0:
+            return self.ranges[0][1]
+        return 0
+
+    @property
+    def complete(self) -> bool:
+        return self.size == 0 or self.ranges == [[0, self.size]]
+
+    def to_dict(self) -> dict:
+        return {
+            "upload_id": self.upload_id,
+            "username": self.username,
+            "target_path": self.target_path,
+            "display_path": self.display_path,
+            "size": self.size,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "ranges": self.ranges,
+        }
+
+    def status(self) -> dict:
+        """Public view of the session returned by the API"""
+        return {
+            "upload_id": self.upload_id,
+            "path": self.display_path,
+            "size": self.size,
+            "received": self.received,
+            "ranges": self.ranges,
+            "complete": self.complete,
+        }
+
+
+class ResumableUploadStore:
+    def __init__(self, storage_root: str):
+        self.root = os.path.join(storage_root, STATE_DIR_NAME, "uploads")
+        self._lock = threading.Lock()
+        self._session_locks = {}
+
+    def _session_dir(self, upload_id: str) -> str:
+        # IDs are generated by us; reject anything that could escape the state dir
+        if not upload_id or not all(c.isalnum() or c in "-_" for c in upload_id):
+            raise HTTPException(status_code=404, detail="Upload session not found")
+        return os.path.join(self.root, upload_id)
+
+    def _data_path(self, upload_id: str) -> str:
+        return os.path.join(self._session_dir(upload_id), "data.part")
+
+    def _meta_path(self, upload_id: str) -> str:
+        return os.path.join(self._session_dir(upload_id), "meta.json")
+
+    def _session_lock(self, upload_id: str) -> threading.Lock:
+        with self._lock:
+            return self._session_locks.setdefault(upload_id, threading.Lock())
+
+    def _save(self, session: UploadSession):
+        meta_path = self._meta_path(session.upload_id)
+        tmp_path = meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(session.to_dict(), f)
+        os.replace(tmp_path, meta_path)
+
+    def create(self, username: str, target_path: str, display_path: str, size: int) -> UploadSession:
+        upload_id = secrets.token_urlsafe(SESSION_ID_BYTES)
+        session = UploadSession(upload_id, username, target_path, display_path, size)
+        os.makedirs(self._session_dir(upload_id), exist_ok=True)
+        open(self._data_path(upload_id), "wb").close()
+        self._save(session)
+        return session
+
+    def get(self, upload_id: str, username: str) -> UploadSession:
+        """Load a session owned by `username`, or raise 404"""
+        try:
+            with open(self._meta_path(upload_id), "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            raise HTTPException(status_code=404, detail="Upload session not found")
+        if data.get("username") != username:
+            # Don't reveal other users' sessions
+            raise HTTPException(status_code=404, detail="Upload session not found")
+        return UploadSession(**data)
+
+    async def write_chunk(self, session: UploadSession, offset: int, chunks) -> UploadSession:
+        """
+        Write a request body stream at `offset` into the partial file.
+        Chunks may arrive in any order and in parallel; received byte ranges
+        are merged into the session metadata after each write.
+        """
+        if offset < 0 or offset > session.size:
+            raise HTTPException(status_code=416, detail="Chunk offset outside of the file")
+
+        end = offset
+        async with aiofiles.open(self._data_path(session.upload_id), "r+b", executor=executors.disk.executor) as f:
+            await f.seek(offset)
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                if end + len(chunk) > session.size:
+                    raise HTTPException(status_code=413, detail="Chunk extends past the declared file size")
+                await f.write(chunk)
+                end += len(chunk)
+
+        if end > offset:
+            session = await executors.run_disk(self._record_range, session, offset, end)
+        return session
+
+    def _record_range(self, session: UploadSession, offset: int, end: int) -> UploadSession:
+        with self._session_lock(session.upload_id):
+            # Re-read so parallel chunk writers don't drop each other's ranges
+            session = self.get(session.upload_id, session.username)
+            session.ranges = _merge_range(session.ranges, offset, end)
+            session.updated_at = time.time()
+            self._save(session)
+        return session
+
+    def finalize(self, session: UploadSession):
+        """Move the completed file into place and remove the session"""
+        if not session.complete:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Upload incomplete: received {session.received} of {session.size} bytes"
+            )
+        data_path = self._data_path(session.upload_id)
+        os.makedirs(os.path.dirname(session.target_path), exist_ok=True)
+        try:
+            os.replace(data_path, session.target_path)
+        except OSError as e:
+            # Storage root and destination on different filesystems; anything
+            # else (e.g. a folder in the way) must not be worked around
+            if e.errno != errno.EXDEV:
+                raise
+            shutil.move(data_path, session.target_path)
+        self.discard(session.upload_id)
+
+    def discard(self, upload_id: str):
+        shutil.rmtree(self._session_dir(upload_id), ignore_errors=True)
+        with self._lock:
+            self._session_locks.pop(upload_id, None)
+
+    def collect_garbage(self, max_age_seconds: float) -> int:
+        """Remove sessions that have not received data for `max_age_seconds`"""
+        if not os.path.isdir(self.root):
+            return 0
+        removed = 0
+        cutoff = time.time() - max_age_seconds
+        for upload_id in os.listdir(self.root):
+            session_dir = os.path.join(self.root, upload_id)
+            try:
+                with open(os.path.join(session_dir, "meta.json"), "r") as f:
+                    updated_at = json.load(f).get("updated_at", 0)
+            except (OSError, ValueError):
+                # Half-created or corrupted session; fall back to the directory age
+                try:
+                    updated_at = os.path.getmtime(session_dir)
+                except OSError:
+                    continue
+            if updated_at < cutoff:
+                self.discard(upload_id)
+                removed += 1
+        if removed:
+            print(f"[Resumable Uploads] Removed {removed} stale upload session(s)")
+        return removed
+
+
+_store: Optional[ResumableUploadStore] = None
+
+
+def get_store() -> ResumableUploadStore:
+    """Get the upload store for the current storage root"""
+    global _store
+    storage_root = os.path.abspath(os.getenv("STORAGE_ROOT", "./storage"))
+    if _store is None or not _store.root.startswith(storage_root):
+        _store = ResumableUploadStore(storage_root)
+    return _store
+
+
+def session_ttl_seconds() -> float:
+    cfg = config.get_config()
+    return float(cfg.get("uploads", "resumable_session_ttl_hours", 24)) * 3600
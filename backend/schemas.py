@@ -86,6 +86,11 @@ class RenameItem(BaseModel):
     path: str
     new_name: str
 
+class ResumableUploadCreate(BaseModel):
+    path: str = ""  # Destination folder
+    filename: str  # May contain a relative path for folder uploads
+    size: int
+
 class ShareFolder(BaseModel):
     folder_path: str  # Can be file or folder path
     username: str
@@ -0,0 +1,438 @@
+"""
+File search index
+Keeps the name, extension, size and modification time of every file and
+folder in the file_index table, so searching does not walk directories.
+Names are matched by:
+- prefix: a range scan on the lowercased name
+- substring: an FTS5 trigram index on SQLite (a LIKE scan elsewhere, or for
+  terms shorter than three characters)
+- glob: the trigram index narrows candidates to names containing every
+  literal run of the pattern, which is then matched exactly
+
+Write endpoints update the entries they touch. A background crawler fills
+the index when it is empty and then re-walks the storage once per
+SEARCH_CRAWL_INTERVAL_SECONDS, fixing changes made outside the server one
+directory at a time.
+"""
+
+import asyncio
+import base64
+import fnmatch
+import json
+import os
+import re
+import time
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import and_, column, func, literal, or_, select, table, text, true
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from . import database, executors, listing, models, paths, usage
+
+SEARCH_CRAWL_INTERVAL_SECONDS = float(os.getenv("SEARCH_CRAWL_INTERVAL_SECONDS", "21600"))
+
+FTS_TABLE = "file_index_fts"
+# Candidate rows fetched per query while filling a page; rows the user may
+# not see are dropped after fetching, so a page may take several batches
+SCAN_BATCH_SIZE = 200
+MAX_SCAN_BATCHES = 25
+# Terms with at least this many trigram matches are searched by name order instead
+FTS_SELECTIVE_ROWS = 2000
+MODES = ("substring", "prefix", "glob")
+
+_FTS_SETUP = (
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(name, content='file_index', content_rowid='id', tokenize='trigram')",
+    f"""CREATE TRIGGER IF NOT EXISTS file_index_fts_insert AFTER INSERT ON file_index BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name) VALUES (new.id, new.name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS file_index_fts_delete AFTER DELETE ON file_index BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name) VALUES ('delete', old.id, old.name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS file_index_fts_update AFTER UPDATE OF name ON file_index BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO {FTS_TABLE}(rowid, name) VALUES (new.id, new.name);
+    END""",
+    # Index rows that were written before the trigram index existed
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+)
+
+
+def _subtree(col, rel_path: str, include_self: bool = True):
+    """Rows for everything below rel_path ("0" sorts right after "/")"""
+    if not rel_path:
+        return true() if include_self else col != ""
+    below = (col > rel_path + "/") & (col < rel_path + "0")
+    return (col == rel_path) | below if include_self else below
+
+
+def _like_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _fts_phrase(value: str) -> str:
+    return '"' + value.replace('"', '""') + '"'
+
+
+def glob_to_like(pattern: str) -> str:
+    """A LIKE pattern matching at least everything the glob matches"""
+    result = []
+    for token in re.findall(r"\[[^\]]*\]|.", pattern):
+        if token == "*":
+            result.append("%")
+        elif token == "?" or (len(token) > 1 and token.startswith("[")):
+            result.append("_")
+        else:
+            result.append(_like_escape(token))
+    return "".join(result)
+
+
+def glob_literals(pattern: str) -> List[str]:
+    """The runs of plain characters in a glob pattern"""
+    return [run for run in re.split(r"\[[^\]]*\]|[*?]", pattern) if run]
+
+
+def encode_cursor(name_key: str, path: str) -> str:
+    payload = json.dumps([name_key, path], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        name_key, path = json.loads(base64.urlsafe_b64decode(padded))
+    except Exception:
+        raise ValueError("Malformed cursor")
+    if not isinstance(name_key, str) or not isinstance(path, str):
+        raise ValueError("Malformed cursor")
+    return name_key, path
+
+
+class SearchFilters(NamedTuple):
+    is_dir: Optional[bool] = None
+    extensions: Tuple[str, ...] = ()
+    min_size: Optional[int] = None
+    max_size: Optional[int] = None
+    modified_after: Optional[float] = None
+    modified_before: Optional[float] = None
+
+
+class SearchScope(NamedTuple):
+    """A storage-relative folder whose contents may be searched"""
+    rel_path: str
+    include_self: bool
+
+
+def _row_values(rel_path: str, record: listing.DirRecord) -> dict:
+    parent, _, name = rel_path.rpartition("/")
+    return {
+        "path": rel_path,
+        "parent": parent,
+        "name": name,
+        "name_key": name.lower(),
+        "extension": "" if record.is_dir else os.path.splitext(name)[1].lower(),
+        "size": record.size,
+        "mtime": record.mtime,
+        "is_dir": record.is_dir,
+    }
+
+
+def _stat_record(abs_path: str) -> Optional[listing.DirRecord]:
+    try:
+        st = os.stat(abs_path)
+    except OSError:
+        return None
+    is_dir = os.path.isdir(abs_path)
+    return listing.DirRecord(os.path.basename(abs_path), is_dir, 0 if is_dir else st.st_size, st.st_mtime)
+
+
+class FileIndex:
+    def __init__(self, crawl_interval: float = SEARCH_CRAWL_INTERVAL_SECONDS):
+        self.crawl_interval = crawl_interval
+        self.fts = False
+        self.last_crawl: Optional[dict] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def setup(self, engine):
+        """Create the trigram index and its triggers when the database supports them"""
+        if engine.url.get_backend_name() != "sqlite":
+            return
+        try:
+            with engine.begin() as conn:
+                exists = conn.execute(
+                    text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}
+                ).first()
+                if not exists:
+                    for statement in _FTS_SETUP:
+                        conn.execute(text(statement))
+            self.fts = True
+        except OperationalError as e:
+            print(f"Warning: SQLite FTS5 trigram index unavailable, search falls back to LIKE scans: {e}")
+
+    # --- Incremental updates ---
+
+    def updated(self, abs_path: str):
+        """A file or folder was written or created; folders created above it are added too"""
+        rel_path = usage.relative_path(abs_path)
+        if not rel_path:
+            return
+        entries = usage.ancestors(rel_path)[1:]
+        storage_root = paths.resolver.storage_root()
+        entry_table = models.FileIndexEntry
+        for attempt in range(2):
+            db = database.SessionLocal()
+            try:
+                existing = {path for (path,) in db.query(entry_table.path).filter(entry_table.path.in_(entries[:-1]))}
+                for path in entries:
+                    if path in existing:
+                        continue
+                    record = _stat_record(os.path.join(storage_root, path))
+                    if record is None:
+                        continue
+                    values = _row_values(path, record)
+                    if path == rel_path:
+                        updated = db.query(entry_table).filter(entry_table.path == path).update(values, synchronize_session=False)
+                        if updated:
+                            continue
+                    db.add(entry_table(**values))
+                db.commit()
+                return
+            except IntegrityError:
+                # Another request added one of the rows first; retry as an update
+                db.rollback()
+            finally:
+                db.close()
+
+    def removed(self, abs_path: str):
+        """A file or folder tree was deleted"""
+        rel_path = usage.relative_path(abs_path)
+        if not rel_path:
+            return
+        db = database.SessionLocal()
+        try:
+            db.query(models.FileIndexEntry).filter(_subtree(models.FileIndexEntry.path, rel_path)).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def moved(self, old_abs_path: str, new_abs_path: str):
+        """An item was renamed within the same parent; entries below it follow"""
+        old_rel, new_rel = usage.relative_path(old_abs_path), usage.relative_path(new_abs_path)
+        if not old_rel or not new_rel:
+            return
+        entry_table = models.FileIndexEntry
+        db = database.SessionLocal()
+        try:
+            offset = len(old_rel) + 1
+            db.query(entry_table).filter(_subtree(entry_table.path, old_rel, include_self=False)).update({
+                entry_table.path: literal(new_rel) + func.substr(entry_table.path, offset),
+                entry_table.parent: literal(new_rel) + func.substr(entry_table.parent, offset),
+            }, synchronize_session=False)
+            db.query(entry_table).filter(entry_table.path == old_rel).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+        self.updated(new_abs_path)
+
+    # --- Crawler ---
+
+    def _walk(self) -> Iterator[Tuple[str, List[Tuple[str, listing.DirRecord]]]]:
+        """(storage-relative dir, [(rel path, record)]) for every directory, without following symlinks"""
+        stack = [("", paths.resolver.storage_root())]
+        while stack:
+            rel_dir, abs_dir = stack.pop()
+            try:
+                records = listing.scan_directory(abs_dir)
+            except OSError:
+                continue
+            entries = []
+            for record in records:
+                rel_path = f"{rel_dir}/{record.name}" if rel_dir else record.name
+                entries.append((rel_path, record))
+                if record.is_dir:
+                    abs_path = os.path.join(abs_dir, record.name)
+                    if not os.path.islink(abs_path):
+                        stack.append((rel_path, abs_path))
+            yield rel_dir, entries
+
+    def crawl(self) -> dict:
+        """Walk the storage and bring the index in line with it, one directory at a time"""
+        started = time.time()
+        entry_table = models.FileIndexEntry
+        counts = {"directories": 0, "added": 0, "updated": 0, "removed": 0}
+        db = database.SessionLocal()
+        try:
+            for rel_dir, entries in self._walk():
+                counts["directories"] += 1
+                rows = {
+                    path: (row_id, is_dir, size, mtime)
+                    for row_id, path, is_dir, size, mtime in db.query(
+                        entry_table.id, entry_table.path, entry_table.is_dir, entry_table.size, entry_table.mtime
+                    ).filter(entry_table.parent == rel_dir)
+                }
+                added = []
+                changed = False
+                for rel_path, record in entries:
+                    row = rows.pop(rel_path, None)
+                    if row is None:
+                        added.append(_row_values(rel_path, record))
+                    elif row[1:] != (record.is_dir, record.size, record.mtime):
+                        db.query(entry_table).filter(entry_table.id == row[0]).update(
+                            {entry_table.is_dir: record.is_dir, entry_table.size: record.size, entry_table.mtime: record.mtime},
+                            synchronize_session=False,
+                        )
+                        counts["updated"] += 1
+                        changed = True
+                for path, (row_id, is_dir, size, mtime) in rows.items():
+                    # Gone from disk, with everything that was indexed below it
+                    db.query(entry_table).filter(_subtree(entry_table.path, path)).delete(synchronize_session=False)
+                    counts["removed"] += 1
+                    changed = True
+                if added:
+                    db.execute(models.FileIndexEntry.__table__.insert(), added)
+                    counts["added"] += len(added)
+                    changed = True
+                if changed:
+                    try:
+                        db.commit()
+                    except IntegrityError:
+                        # A write endpoint indexed one of these entries meanwhile
+                        db.rollback()
+        finally:
+            db.close()
+        self.last_crawl = {"at": started, "duration_seconds": round(time.time() - started, 3), **counts}
+        return self.last_crawl
+
+    def _is_empty(self) -> bool:
+        db = database.SessionLocal()
+        try:
+            return db.query(models.FileIndexEntry.id).first() is None
+        finally:
+            db.close()
+
+    async def _run(self):
+        due_in = 0 if await executors.run_db(self._is_empty) else self.crawl_interval
+        while True:
+            await asyncio.sleep(max(1.0, due_in))
+            try:
+                result = await executors.run_disk(self.crawl)
+                print(f"Search index crawled: {result['directories']} directories in {result['duration_seconds']}s, "
+                      f"{result['added']} added, {result['updated']} updated, {result['removed']} removed")
+                due_in = self.crawl_interval
+            except Exception as e:
+                print(f"Search index crawl failed: {e}")
+                due_in = 60
+
+    def start(self):
+        if self._task is None and self.crawl_interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # --- Queries ---
+
+    def _name_condition(self, db, query: str, mode: str):
+        entry_table = models.FileIndexEntry
+        key = query.lower()
+        if mode == "prefix":
+            return and_(entry_table.name_key >= key, entry_table.name_key < key + "\U0010ffff")
+        # The trigram index only finds runs of at least three characters
+        literals = [run for run in (glob_literals(key) if mode == "glob" else [key]) if len(run) >= 3]
+        if mode == "glob":
+            condition = entry_table.name_key.like(glob_to_like(key), escape="\\")
+        else:
+            condition = entry_table.name_key.like(f"%{_like_escape(key)}%", escape="\\")
+        if self.fts and literals:
+            matches = select(column("rowid")).select_from(table(FTS_TABLE)).where(
+                text(f"{FTS_TABLE} MATCH :match").bindparams(match=" AND ".join(_fts_phrase(run) for run in literals))
+            )
+            # A common term is found sooner by walking the name index in
+            # result order than by collecting and sorting all of its matches
+            common = db.execute(
+                select(func.count()).select_from(matches.limit(FTS_SELECTIVE_ROWS).subquery())
+            ).scalar() >= FTS_SELECTIVE_ROWS
+            if not common:
+                condition = and_(entry_table.id.in_(matches), condition)
+        return condition
+
+    def search(
+        self,
+        db,
+        scopes: List[SearchScope],
+        query: str = "",
+        mode: str = "substring",
+        filters: SearchFilters = SearchFilters(),
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        visible=None,
+    ) -> Tuple[List[models.FileIndexEntry], Optional[str]]:
+        """
+        One page of entries under the given scopes, ordered by name then
+        path. `visible` is an optional predicate on storage-relative paths
+        applied to the fetched rows. Returns (entries, next_cursor); raises
+        ValueError for a bad mode or cursor.
+        """
+        if mode not in MODES:
+            raise ValueError(f"Mode must be one of: {', '.join(MODES)}")
+        if not scopes:
+            return [], None
+        entry_table = models.FileIndexEntry
+        conditions = [or_(*[_subtree(entry_table.path, scope.rel_path, scope.include_self) for scope in scopes])]
+        if query:
+            conditions.append(self._name_condition(db, query, mode))
+        if filters.is_dir is not None:
+            conditions.append(entry_table.is_dir == filters.is_dir)
+        if filters.extensions:
+            conditions.append(entry_table.extension.in_(filters.extensions))
+        if filters.min_size is not None:
+            conditions.append(entry_table.size >= filters.min_size)
+        if filters.max_size is not None:
+            conditions.append(entry_table.size <= filters.max_size)
+        if filters.modified_after is not None:
+            conditions.append(entry_table.mtime >= filters.modified_after)
+        if filters.modified_before is not None:
+            conditions.append(entry_table.mtime <= filters.modified_before)
+        pattern = query.lower() if query and mode == "glob" else None
+
+        after = decode_cursor(cursor) if cursor else None
+        results: List[models.FileIndexEntry] = []
+        for _ in range(MAX_SCAN_BATCHES):
+            page_conditions = list(conditions)
+            if after is not None:
+                page_conditions.append(or_(
+                    entry_table.name_key > after[0],
+                    and_(entry_table.name_key == after[0], entry_table.path > after[1]),
+                ))
+            rows = db.query(entry_table).filter(*page_conditions).order_by(
+                entry_table.name_key, entry_table.path
+            ).limit(SCAN_BATCH_SIZE).all()
+            for row in rows:
+                after = (row.name_key, row.path)
+                if pattern is not None and not fnmatch.fnmatchcase(row.name_key, pattern):
+                    continue
+                if visible is not None and not visible(row.path):
+                    continue
+                results.append(row)
+                if len(results) == limit:
+                    return results, encode_cursor(*after)
+            if len(rows) < SCAN_BATCH_SIZE:
+                return results, None
+        # Scanned enough rows for one request; the client continues from here
+        return results, encode_cursor(*after)
+
+    def stats(self, db) -> dict:
+        return {
+            "entries": db.query(models.FileIndexEntry.id).count(),
+            "fts": self.fts,
+            "crawl_interval_seconds": self.crawl_interval,
+            "last_crawl": self.last_crawl,
+        }
+
+
+index = FileIndex()
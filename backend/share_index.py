@@ -0,0 +1,163 @@
+"""
+Share resolution index
+Keeps, per recipient, a path-prefix trie of the shares granted to them, so
+finding the share that covers a path is one trie walk instead of a query per
+ancestor. Shares are addressed by their path in the owner's root; a folder
+share covers everything below it, a file share only the file itself.
+
+Tries are built from one query per recipient, dropped when that user's
+shares change, and expire after a TTL so shares made on other workers show
+up without a restart.
+"""
+
+import os
+import posixpath
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models
+from .permissions import split_path
+
+SHARE_INDEX_TTL_SECONDS = float(os.getenv("SHARE_INDEX_TTL_SECONDS", "30"))
+SHARE_INDEX_MAX_ENTRIES = int(os.getenv("SHARE_INDEX_MAX_ENTRIES", "10000"))
+
+
+class ShareGrant:
+    """One share as seen by its recipient"""
+
+    __slots__ = ("share_id", "owner_username", "owner_root", "folder_path", "permission", "is_file")
+
+    def __init__(self, share: models.FolderShare, owner_root: str):
+        self.share_id = share.id
+        self.owner_username = share.owner_username
+        self.owner_root = owner_root
+        self.folder_path = share.folder_path
+        self.permission = (share.permission or "read").lower()
+        self.is_file = bool(share.is_file)
+
+    @property
+    def can_write(self) -> bool:
+        return self.permission == "write"
+
+
+class _ShareNode:
+    __slots__ = ("children", "folder", "file")
+
+    def __init__(self):
+        self.children: Dict[str, "_ShareNode"] = {}
+        self.folder: Optional[ShareGrant] = None
+        self.file: Optional[ShareGrant] = None
+
+
+class _RecipientShares:
+    __slots__ = ("grants", "by_path", "by_storage_path", "expires_at")
+
+    def __init__(self, grants: List[ShareGrant], expires_at: float):
+        self.grants = grants
+        # Keyed by the path in the owner's root (what the recipient requests)
+        # and by the path relative to the storage root (for file IDs)
+        self.by_path = _ShareNode()
+        self.by_storage_path = _ShareNode()
+        for grant in grants:
+            parts = split_path(grant.folder_path or "")
+            _add(self.by_path, parts, grant)
+            _add(self.by_storage_path, split_path(grant.owner_root or "") + parts, grant)
+        self.expires_at = expires_at
+
+
+def _add(root: _ShareNode, parts: Tuple[str, ...], grant: ShareGrant):
+    node = root
+    for part in parts:
+        node = node.children.setdefault(part, _ShareNode())
+    slot = "file" if grant.is_file else "folder"
+    current = getattr(node, slot)
+    # Several owners may share the same path; the most permissive share wins
+    if current is None or (grant.can_write and not current.can_write):
+        setattr(node, slot, grant)
+
+
+def normalize_path(path: str) -> str:
+    """Collapse '.' and '..' so a path cannot climb out of the share that matched it"""
+    return posixpath.normpath("/" + path.replace("\\", "/")).lstrip("/")
+
+
+def _lookup(root: _ShareNode, path: str) -> Optional[ShareGrant]:
+    """The deepest folder share above the path, or a share of the path itself"""
+    node = root
+    grant = node.folder
+    for part in split_path(normalize_path(path)):
+        node = node.children.get(part)
+        if node is None:
+            return grant
+        grant = node.folder or grant
+    return node.file or grant
+
+
+class ShareIndex:
+    def __init__(self, ttl_seconds: float = SHARE_INDEX_TTL_SECONDS, max_entries: int = SHARE_INDEX_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._recipients: "OrderedDict[str, _RecipientShares]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _shares_for(self, db: Session, username: str) -> _RecipientShares:
+        with self._lock:
+            shares = self._recipients.get(username)
+            if shares is not None and time.time() < shares.expires_at:
+                self._recipients.move_to_end(username)
+                self.hits += 1
+                return shares
+            self.misses += 1
+
+        rows = db.query(models.FolderShare, models.User.root_path).join(
+            models.User, models.User.username == models.FolderShare.owner_username
+        ).filter(models.FolderShare.shared_with_username == username).all()
+        shares = _RecipientShares([ShareGrant(share, root) for share, root in rows], time.time() + self.ttl_seconds)
+
+        if self.ttl_seconds > 0:
+            with self._lock:
+                self._recipients[username] = shares
+                self._recipients.move_to_end(username)
+                while len(self._recipients) > self.max_entries:
+                    self._recipients.popitem(last=False)
+        return shares
+
+    def lookup(self, db: Session, username: str, path: str) -> Optional[ShareGrant]:
+        """The share granting `username` access to `path` (in the owner's root), if any"""
+        return _lookup(self._shares_for(db, username).by_path, path)
+
+    def lookup_storage_path(self, db: Session, username: str, rel_path: str) -> Optional[ShareGrant]:
+        """Like lookup, for a path relative to the storage root"""
+        return _lookup(self._shares_for(db, username).by_storage_path, rel_path)
+
+    def grants(self, db: Session, username: str) -> List[ShareGrant]:
+        """Every share granted to `username`"""
+        return self._shares_for(db, username).grants
+
+    def invalidate(self, username: str):
+        """Drop a recipient's index after their shares change"""
+        with self._lock:
+            self._recipients.pop(username, None)
+
+    def invalidate_all(self):
+        """Drop every index, e.g. after a share owner's root changes"""
+        with self._lock:
+            self._recipients.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "ttl_seconds": self.ttl_seconds,
+                "recipients": len(self._recipients),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+share_index = ShareIndex()
@@ -0,0 +1,138 @@
+"""
+Streaming upload pipeline
+Copies uploaded files to disk in fixed-size chunks, enforcing size limits as
+bytes arrive and publishing each file with an atomic rename
+"""
+
+import os
+import secrets
+import stat
+from typing import List, Optional
+
+import aiofiles
+from fastapi import HTTPException, UploadFile
+
+from . import executors
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+
+class UploadBudget:
+    """
+    Tracks bytes received for one upload request against the per-file,
+    per-batch and storage quota limits. `None` means unlimited.
+    """
+
+    def __init__(self, max_file_bytes: Optional[int], max_total_bytes: Optional[int], quota_remaining: Optional[int] = None):
+        self.max_file_bytes = max_file_bytes
+        self.max_total_bytes = max_total_bytes
+        self.quota_remaining = quota_remaining
+        self.total_bytes = 0
+
+    def check_declared(self, filename: str, size: Optional[int]):
+        """Reject a file up front when the client already declared its size"""
+        if size is None:
+            return
+        if self.max_file_bytes is not None and size > self.max_file_bytes:
+            raise self._too_large_file(filename)
+        if self.max_total_bytes is not None and self.total_bytes + size > self.max_total_bytes:
+            raise self._too_large_batch()
+        if self.quota_remaining is not None and self.total_bytes + size > self.quota_remaining:
+            raise self._over_quota()
+
+    def check_batch(self, sizes: List[Optional[int]]):
+        """Reject a whole batch before anything is written when its declared sizes cannot fit"""
+        total = sum(size for size in sizes if size)
+        if self.max_total_bytes is not None and total > self.max_total_bytes:
+            raise self._too_large_batch()
+        if self.quota_remaining is not None and total > self.quota_remaining:
+            raise self._over_quota()
+
+    def consume(self, filename: str, file_bytes: int, chunk_bytes: int):
+        """Account for a received chunk; `file_bytes` already includes it"""
+        self.total_bytes += chunk_bytes
+        if self.max_file_bytes is not None and file_bytes > self.max_file_bytes:
+            raise self._too_large_file(filename)
+        if self.max_total_bytes is not None and self.total_bytes > self.max_total_bytes:
+            raise self._too_large_batch()
+        if self.quota_remaining is not None and self.total_bytes > self.quota_remaining:
+            raise self._over_quota()
+
+    def _too_large_file(self, filename: str) -> HTTPException:
+        return HTTPException(
+            status_code=413,
+            detail=f"File {filename} exceeds maximum size of {self.max_file_bytes // (1024 * 1024)}MB"
+        )
+
+    def _too_large_batch(self) -> HTTPException:
+        return HTTPException(
+            status_code=413,
+            detail=f"Total upload size exceeds maximum of {self.max_total_bytes // (1024 * 1024)}MB"
+        )
+
+    def _over_quota(self) -> HTTPException:
+        return HTTPException(status_code=413, detail="[ERR_QUOTA] Upload exceeds your storage quota")
+
+
+def temp_path_for(dest_path: str) -> str:
+    """Hidden temp file next to the destination, so the final rename stays on one filesystem"""
+    directory, name = os.path.split(dest_path)
+    return os.path.join(directory, f".{name}.{secrets.token_hex(6)}.part")
+
+
+def write_text_atomic(dest_path: str, content: str):
+    """
+    Replace (or create) a file with text content through a synced temp file
+    and a rename, so a crash never leaves a truncated file. An existing
+    file keeps its permission bits.
+    """
+    try:
+        mode = stat.S_IMODE(os.stat(dest_path).st_mode)
+    except FileNotFoundError:
+        mode = None
+    tmp_path = temp_path_for(dest_path)
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+async def stream_to_file(upload: UploadFile, dest_path: str, budget: UploadBudget, chunk_size: int = UPLOAD_CHUNK_SIZE) -> int:
+    """
+    Stream an UploadFile to `dest_path` without holding it in memory.
+    Data goes to a temp file that atomically replaces the destination once
+    complete; on any error (including a limit being hit) the temp file is
+    removed and the destination is left untouched. Returns bytes written.
+    """
+    budget.check_declared(upload.filename, getattr(upload, "size", None))
+
+    tmp_path = temp_path_for(dest_path)
+    written = 0
+    try:
+        async with aiofiles.open(tmp_path, "wb", executor=executors.disk.executor) as out:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                written += len(chunk)
+                budget.consume(upload.filename, written, len(chunk))
+                await out.write(chunk)
+        await executors.run_disk(os.replace, tmp_path, dest_path)
+    except BaseException:
+        try:
+            # Inline, so the temp file is removed even when the request was cancelled
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return written
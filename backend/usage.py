@@ -0,0 +1,458 @@
+"""
+Storage usage ledger
+Keeps bytes and file counts per user root in the storage_usage table, so
+quotas can be checked without walking the user's tree. Write endpoints
+record the size change of every file they touch; the change is added to the
+row of each tracked root above the file (roots may be nested, e.g. an admin
+rooted at the storage root). A background reconciliation walks the storage
+once per USAGE_RECONCILE_INTERVAL_SECONDS to correct drift from changes made
+outside the server.
+
+Changes recorded while a walk runs are also written to a journal (see
+WalkJournal), so the walk can tell which of them its totals already include.
+"""
+
+import asyncio
+import os
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import Float, Integer, String, literal, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import database, executors, models, paths, permissions
+from .resumable import STATE_DIR_NAME
+
+USAGE_RECONCILE_INTERVAL_SECONDS = float(os.getenv("USAGE_RECONCILE_INTERVAL_SECONDS", "21600"))
+
+
+def relative_path(abs_path: str) -> Optional[str]:
+    """Path relative to the storage root ("" for the root itself), or None if outside it"""
+    storage_root = paths.resolver.storage_root()
+    abs_path = os.path.abspath(abs_path)
+    if not paths.is_within(abs_path, storage_root):
+        return None
+    rel_path = os.path.relpath(abs_path, storage_root).replace("\\", "/")
+    return "" if rel_path == "." else rel_path
+
+
+def root_key(root_path: str) -> str:
+    """A user's root_path setting as a storage-relative ledger key"""
+    return "/".join(permissions.split_path(root_path or ""))
+
+
+def ancestors(rel_path: str) -> List[str]:
+    """"" and every prefix of the path, including the path itself"""
+    parts = permissions.split_path(rel_path)
+    return [""] + ["/".join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+
+def parent_path(rel_path: str) -> str:
+    return "/".join(permissions.split_path(rel_path)[:-1])
+
+
+def scan(abs_dir: str, rel_dir: str, read_at: Optional[Dict[str, float]] = None) -> Iterator[Tuple[str, int, int]]:
+    """
+    Walk a directory tree without following symlinks, yielding
+    (storage-relative dir, bytes, files) for the files directly in each
+    directory. Server state under the storage root is skipped. read_at, if
+    given, gets the time each directory was read.
+    """
+    stack = [(abs_dir, rel_dir)]
+    while stack:
+        abs_path, rel_path = stack.pop()
+        if read_at is not None:
+            read_at[rel_path] = time.time()
+        total = count = 0
+        try:
+            with os.scandir(abs_path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not rel_path and entry.name == STATE_DIR_NAME:
+                                continue
+                            stack.append((entry.path, f"{rel_path}/{entry.name}" if rel_path else entry.name))
+                        elif entry.is_file(follow_symlinks=False):
+                            total += entry.stat(follow_symlinks=False).st_size
+                            count += 1
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+        yield rel_path, total, count
+
+
+class WalkJournal:
+    """
+    Size changes recorded while a full walk of the storage runs (usage
+    reconciliation, directory size recompute). A walk's totals already
+    include a change if the directory was read after it; replay() applies
+    the others. Changes are logged in the transaction that records them and
+    the walk ends in the transaction that writes its results, so none are
+    missed or counted twice in between.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def log(self, db: Session, kind: str, rel_path: str, delta_bytes: int = 0, delta_files: int = 0, target: Optional[str] = None):
+        """Journal a change in the caller's transaction; a no-op unless a walk is running"""
+        running = select(models.SizeWalk.id).where(models.SizeWalk.walk == self.name).exists()
+        db.execute(models.SizeJournalEntry.__table__.insert().from_select(
+            ["walk", "kind", "path", "target", "bytes", "files", "recorded_at"],
+            select(
+                literal(self.name, String), literal(kind, String), literal(rel_path, String), literal(target, String),
+                literal(delta_bytes, Integer), literal(delta_files, Integer), literal(time.time(), Float),
+            ).where(running),
+        ))
+
+    def walk(self, read_at: Dict[str, float]) -> Dict[str, List[int]]:
+        """{rel_dir: [bytes, files]} of the files directly in every directory of the storage"""
+        storage_root = paths.resolver.storage_root()
+        own = {
+            rel_dir: [dir_bytes, dir_files]
+            for rel_dir, dir_bytes, dir_files in scan(storage_root, "", read_at)
+        }
+        # A directory moved before the walk got to it was read under neither name
+        db = database.SessionLocal()
+        try:
+            targets = [target for (target,) in db.query(models.SizeJournalEntry.target).filter(
+                models.SizeJournalEntry.walk == self.name, models.SizeJournalEntry.kind == "moved",
+            )]
+        finally:
+            db.close()
+        for target in targets:
+            if target not in read_at:
+                for rel_dir, dir_bytes, dir_files in scan(os.path.join(storage_root, target), target, read_at):
+                    own[rel_dir] = [dir_bytes, dir_files]
+        return own
+
+    def begin(self, stale_after: float) -> bool:
+        """Start journalling; False if another worker is walking (and started less than stale_after ago)"""
+        now = time.time()
+        db = database.SessionLocal()
+        try:
+            db.query(models.SizeWalk).filter(
+                models.SizeWalk.walk == self.name, models.SizeWalk.started < now - stale_after,
+            ).delete(synchronize_session=False)
+            db.query(models.SizeJournalEntry).filter(models.SizeJournalEntry.walk == self.name).delete(synchronize_session=False)
+            db.add(models.SizeWalk(walk=self.name, started=now))
+            db.commit()
+            return True
+        except IntegrityError:
+            db.rollback()
+            return False
+        finally:
+            db.close()
+
+    def end(self, db: Session) -> List[models.SizeJournalEntry]:
+        """
+        Stop journalling and take the entries, in the transaction that writes
+        the walk's results. Ending first takes the write lock, so changes
+        recorded from here on wait and apply on top of the results.
+        """
+        db.query(models.SizeWalk).filter(models.SizeWalk.walk == self.name).delete(synchronize_session=False)
+        entries = db.query(models.SizeJournalEntry).filter(
+            models.SizeJournalEntry.walk == self.name,
+        ).order_by(models.SizeJournalEntry.id).all()
+        db.query(models.SizeJournalEntry).filter(models.SizeJournalEntry.walk == self.name).delete(synchronize_session=False)
+        return entries
+
+    def abort(self):
+        """Drop the walk's marker and entries after it failed"""
+        db = database.SessionLocal()
+        try:
+            db.query(models.SizeWalk).filter(models.SizeWalk.walk == self.name).delete(synchronize_session=False)
+            db.query(models.SizeJournalEntry).filter(models.SizeJournalEntry.walk == self.name).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    @staticmethod
+    def replay(own: Dict[str, List[int]], read_at: Dict[str, float], entries: List[models.SizeJournalEntry]):
+        """
+        Apply the entries the walk didn't see to its per-directory totals
+        ({rel_dir: [bytes, files]} of the files directly in each directory)
+        """
+        def unseen(rel_dir: str, at: float) -> bool:
+            return read_at.get(rel_dir, 0) < at
+
+        def subtree(rel_path: str) -> List[str]:
+            return [d for d in own if d == rel_path or d.startswith(rel_path + "/")]
+
+        for entry in entries:
+            at = entry.recorded_at
+            if entry.kind == "created":
+                for rel_dir in ancestors(entry.path):
+                    own.setdefault(rel_dir, [0, 0])
+                continue
+            if entry.kind == "moved":
+                for rel_dir in subtree(entry.path):
+                    if unseen(rel_dir, at):
+                        totals = own.pop(rel_dir)
+                        moved_to = entry.target + rel_dir[len(entry.path):]
+                        # A directory read under its new name is already counted there
+                        if unseen(moved_to, at):
+                            own[moved_to] = totals
+            elif entry.kind == "removed":
+                # A directory tree: drop what the walk read of it before
+                for rel_dir in subtree(entry.path):
+                    if unseen(rel_dir, at):
+                        del own[rel_dir]
+            else:
+                # A file changed (or was removed) in its directory
+                rel_dir = parent_path(entry.path)
+                if unseen(rel_dir, at):
+                    totals = own.setdefault(rel_dir, [0, 0])
+                    totals[0] += entry.bytes or 0
+                    totals[1] += entry.files or 0
+
+
+def tree_size(abs_path: str) -> Tuple[int, int]:
+    """(bytes, files) of a file or everything below a directory"""
+    try:
+        if os.path.islink(abs_path):
+            return 0, 0
+        if not os.path.isdir(abs_path):
+            return os.stat(abs_path).st_size, 1
+    except OSError:
+        return 0, 0
+    total = count = 0
+    for _, dir_bytes, dir_files in scan(abs_path, relative_path(abs_path) or ""):
+        total += dir_bytes
+        count += dir_files
+    return total, count
+
+
+def file_size(abs_path: str) -> Optional[int]:
+    """Size of an existing file, or None if there is none"""
+    try:
+        return os.stat(abs_path).st_size
+    except OSError:
+        return None
+
+
+class UsageLedger:
+    def __init__(self, reconcile_interval: float = USAGE_RECONCILE_INTERVAL_SECONDS):
+        self.reconcile_interval = reconcile_interval
+        self.journal = WalkJournal("usage")
+        self.last_reconcile: Optional[dict] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # --- Incremental updates ---
+
+    def _apply(self, kind: str, rel_path: str, delta_bytes: int, delta_files: int):
+        db = database.SessionLocal()
+        try:
+            db.query(models.StorageUsage).filter(models.StorageUsage.root_path.in_(ancestors(rel_path))).update({
+                models.StorageUsage.bytes: models.StorageUsage.bytes + delta_bytes,
+                models.StorageUsage.files: models.StorageUsage.files + delta_files,
+            }, synchronize_session=False)
+            self.journal.log(db, kind, rel_path, delta_bytes, delta_files)
+            db.commit()
+        finally:
+            db.close()
+
+    def record(self, abs_path: str, delta_bytes: int, delta_files: int = 0):
+        """A file at abs_path grew by delta_bytes (and delta_files files appeared)"""
+        rel_path = relative_path(abs_path)
+        if rel_path is None or (not delta_bytes and not delta_files):
+            return
+        self._apply("change", rel_path, delta_bytes, delta_files)
+
+    def removed(self, abs_path: str, freed_bytes: int, freed_files: int, is_dir: bool):
+        """A file or directory tree holding freed_bytes in freed_files files was deleted"""
+        rel_path = relative_path(abs_path)
+        if not rel_path:
+            return
+        self._apply("removed" if is_dir else "change", rel_path, -freed_bytes, -freed_files)
+
+    def moved(self, old_abs_path: str, new_abs_path: str):
+        """A directory was renamed within the same parent; only a running reconciliation needs to know"""
+        old_rel, new_rel = relative_path(old_abs_path), relative_path(new_abs_path)
+        if not old_rel or not new_rel:
+            return
+        db = database.SessionLocal()
+        try:
+            self.journal.log(db, "moved", old_rel, target=new_rel)
+            db.commit()
+        finally:
+            db.close()
+
+    # --- Queries ---
+
+    def usage(self, db: Session, root_path: str) -> Tuple[int, int]:
+        """(bytes, files) under a user root; a root seen for the first time is scanned once"""
+        key = root_key(root_path)
+        row = db.query(models.StorageUsage).filter(models.StorageUsage.root_path == key).first()
+        if row is None:
+            row = self._track(db, key)
+        return max(0, row.bytes or 0), max(0, row.files or 0)
+
+    def _track(self, db: Session, key: str) -> models.StorageUsage:
+        # Start tracking before scanning, so writes during the scan are not lost
+        row = models.StorageUsage(root_path=key, bytes=0, files=0, reconciled_at=0)
+        db.add(row)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            return db.query(models.StorageUsage).filter(models.StorageUsage.root_path == key).one()
+        total, count = tree_size(os.path.join(paths.resolver.storage_root(), key))
+        db.query(models.StorageUsage).filter(models.StorageUsage.root_path == key).update({
+            models.StorageUsage.bytes: models.StorageUsage.bytes + total,
+            models.StorageUsage.files: models.StorageUsage.files + count,
+            models.StorageUsage.reconciled_at: time.time(),
+        }, synchronize_session=False)
+        db.commit()
+        db.refresh(row)
+        return row
+
+    def quota_remaining(self, user: models.User) -> Optional[int]:
+        """Bytes the user may still store, or None without a quota"""
+        quota = permissions.get_snapshot(user).max_storage_quota
+        if quota is None:
+            return None
+        db = database.SessionLocal()
+        try:
+            used, _ = self.usage(db, user.root_path)
+        finally:
+            db.close()
+        return max(0, quota - used)
+
+    def report(self, db: Session) -> dict:
+        """Usage and quota per user and group, from the ledger alone"""
+        rows = {row.root_path: row for row in db.query(models.StorageUsage).all()}
+        users = []
+        for user in db.query(models.User).all():
+            row = rows.get(root_key(user.root_path))
+            users.append({
+                "username": user.username,
+                "root_path": user.root_path,
+                "bytes": max(0, row.bytes) if row else None,
+                "files": max(0, row.files) if row else None,
+                "quota": permissions.get_snapshot(user).max_storage_quota,
+                "reconciled_at": row.reconciled_at if row else None,
+            })
+        groups = []
+        for group in db.query(models.Group).all():
+            keys = {root_key(user.root_path) for user in group.users}
+            # Members rooted inside another member's root are already counted
+            outer = [key for key in keys if not any(other in ancestors(key)[:-1] for other in keys)]
+            tracked = [rows[key] for key in outer if key in rows]
+            groups.append({
+                "name": group.name,
+                "members": len(group.users),
+                "bytes": sum(max(0, row.bytes) for row in tracked),
+                "files": sum(max(0, row.files) for row in tracked),
+                "untracked_roots": len(outer) - len(tracked),
+                "quota": group.max_storage_quota,
+            })
+        return {"users": users, "groups": groups, "last_reconcile": self.last_reconcile}
+
+    # --- Reconciliation ---
+
+    def reconcile(self) -> Optional[dict]:
+        """
+        Recount every user root in one walk of the storage. Changes recorded
+        while the walk runs are kept (see WalkJournal). Returns None if
+        another worker is already reconciling.
+        """
+        started = time.time()
+        db = database.SessionLocal()
+        try:
+            keys = {root_key(root) for (root,) in db.query(models.User.root_path).distinct()}
+            for key in keys:
+                if not db.query(models.StorageUsage.id).filter(models.StorageUsage.root_path == key).first():
+                    db.add(models.StorageUsage(root_path=key, bytes=0, files=0, reconciled_at=0))
+                    try:
+                        db.commit()
+                    except IntegrityError:
+                        db.rollback()
+        finally:
+            db.close()
+
+        if not self.journal.begin(self.reconcile_interval):
+            return None
+        try:
+            read_at: Dict[str, float] = {}
+            own = self.journal.walk(read_at)
+            db = database.SessionLocal()
+            try:
+                self.journal.replay(own, read_at, self.journal.end(db))
+                totals = {key: [0, 0] for key in keys}
+                for rel_dir, (dir_bytes, dir_files) in own.items():
+                    for key in ancestors(rel_dir):
+                        if key in totals:
+                            totals[key][0] += dir_bytes
+                            totals[key][1] += dir_files
+
+                before = {
+                    row.root_path: row.bytes or 0
+                    for row in db.query(models.StorageUsage).filter(models.StorageUsage.root_path.in_(list(keys)))
+                }
+                drift = 0
+                for key, (total, count) in totals.items():
+                    drift += abs(total - before.get(key, 0))
+                    db.query(models.StorageUsage).filter(models.StorageUsage.root_path == key).update({
+                        models.StorageUsage.bytes: total,
+                        models.StorageUsage.files: count,
+                        models.StorageUsage.reconciled_at: started,
+                    }, synchronize_session=False)
+                # Roots no user has any more
+                db.query(models.StorageUsage).filter(~models.StorageUsage.root_path.in_(list(keys))).delete(synchronize_session=False)
+                db.commit()
+            finally:
+                db.close()
+        except Exception:
+            self.journal.abort()
+            raise
+        self.last_reconcile = {
+            "at": started,
+            "duration_seconds": round(time.time() - started, 3),
+            "roots": len(totals),
+            "drift_bytes": drift,
+        }
+        return self.last_reconcile
+
+    def _due_in(self) -> float:
+        """Seconds until the oldest root needs reconciling (any worker may have done it)"""
+        db = database.SessionLocal()
+        try:
+            oldest = db.query(models.StorageUsage.reconciled_at).order_by(models.StorageUsage.reconciled_at).first()
+        finally:
+            db.close()
+        if oldest is None:
+            return 0
+        return oldest[0] + self.reconcile_interval - time.time()
+
+    async def _run(self):
+        while True:
+            try:
+                due_in = await executors.run_db(self._due_in)
+                if due_in <= 0:
+                    result = await executors.run_disk(self.reconcile)
+                    if result is not None:
+                        print(f"Storage usage reconciled: {result['roots']} roots in {result['duration_seconds']}s, drift {result['drift_bytes']} bytes")
+                    due_in = self.reconcile_interval
+            except Exception as e:
+                print(f"Storage usage reconciliation failed: {e}")
+                due_in = 60
+            await asyncio.sleep(max(1.0, due_in))
+
+    def start(self):
+        if self._task is None and self.reconcile_interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+ledger = UsageLedger()
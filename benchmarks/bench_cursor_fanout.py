@@ -0,0 +1,97 @@
+"""
+Benchmark: WebSocket messages per second for cursor traffic in editing rooms.
+
+Every editor in a room moves their cursor at a fixed rate. Compares the
+previous behaviour, where each move sent the full cursor list to everyone
+in the room, with the tick-based batching in ConnectionManager, which
+sends each client at most one message per tick containing only the
+cursors that moved.
+
+Usage: python benchmarks/bench_cursor_fanout.py [seconds] [moves_per_second]
+"""
+
+import asyncio
+import json
+import os
+import random
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import collab
+from backend.backplane import LocalBackplane
+from backend.collab import ConnectionManager
+
+ROOM_SIZES = (2, 10, 50)
+TICKS_MS = (20, 50)
+ROOM = "/bench/room.txt"
+
+
+class CountingSocket:
+    """Stands in for a WebSocket; counts what would have been sent"""
+
+    def __init__(self, counters: dict):
+        self.counters = counters
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        self.counters["messages"] += 1
+        self.counters["bytes"] += len(message)
+
+    async def close(self, code=None):
+        pass
+
+
+async def legacy_move(manager: ConnectionManager, conn, position: int):
+    """Previous handler: record the move and send every cursor to everyone"""
+    conn.cursor_position = position
+    message = json.dumps({"type": "cursors_update", "cursors": manager._all_cursors(ROOM)})
+    await manager._send_local(ROOM, message, coalesce_key="cursors_update")
+
+
+async def batched_move(manager: ConnectionManager, conn, position: int):
+    manager.update_cursor(conn, position)
+
+
+async def run_room(editors: int, seconds: float, rate: float, move) -> dict:
+    counters = {"messages": 0, "bytes": 0}
+    manager = ConnectionManager(LocalBackplane())
+    conns = [await manager.connect(CountingSocket(counters), ROOM, f"user{i}") for i in range(editors)]
+    await asyncio.sleep(0.2)  # Let join traffic drain before measuring
+    counters.update(messages=0, bytes=0)
+
+    async def editor(conn):
+        position = 0
+        await asyncio.sleep(random.random() / rate)
+        loop = asyncio.get_running_loop()
+        end = loop.time() + seconds
+        while loop.time() < end:
+            position += 1
+            await move(manager, conn, position)
+            await asyncio.sleep(1 / rate)
+
+    await asyncio.gather(*(editor(conn) for conn in conns))
+    await asyncio.sleep(0.2)  # Last tick and send queues
+    for conn in conns:
+        manager.disconnect(conn)
+    return {"msgs_per_s": counters["messages"] / seconds, "kb_per_s": counters["bytes"] / seconds / 1024}
+
+
+async def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    print(f"{seconds:g}s per run, each editor moves its cursor {rate:g} times/s\n")
+    print(f"{'editors':>7}  {'mode':<16} {'msgs/s':>10} {'KB/s':>10}")
+    for editors in ROOM_SIZES:
+        result = await run_room(editors, seconds, rate, legacy_move)
+        print(f"{editors:>7}  {'per move':<16} {result['msgs_per_s']:>10.0f} {result['kb_per_s']:>10.1f}")
+        for tick in TICKS_MS:
+            collab.COLLAB_CURSOR_TICK_MS = tick
+            result = await run_room(editors, seconds, rate, batched_move)
+            print(f"{editors:>7}  {f'tick {tick} ms':<16} {result['msgs_per_s']:>10.0f} {result['kb_per_s']:>10.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
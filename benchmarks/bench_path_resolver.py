@@ -0,0 +1,76 @@
+"""
+Microbenchmark: per-call cost of resolving a user path.
+
+Compares the PathResolver used by get_safe_path with the previous
+implementation, which printed debug output and probed the filesystem
+(exists/isdir/listdir) on every call.
+
+Usage: python benchmarks/bench_path_resolver.py [iterations]
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.paths import PathResolver
+
+
+def legacy_get_safe_path(root_path: str, path: str = ""):
+    """The pre-PathResolver get_safe_path, minus the HTTPException import"""
+    storage_root = os.path.abspath(os.getenv("STORAGE_ROOT", "./storage"))
+    print(f"[DEBUG] get_safe_path called:")
+    print(f"  User root_path: {root_path}")
+    print(f"  Requested path: {path}")
+    print(f"  STORAGE_ROOT env: {os.getenv('STORAGE_ROOT', 'NOT SET')}")
+    print(f"  Resolved storage_root: {storage_root}")
+    user_root_path = root_path.strip("/")
+    user_root = os.path.join(storage_root, user_root_path)
+    print(f"  User root directory: {user_root}")
+    print(f"  User root exists: {os.path.exists(user_root)}")
+    if not os.path.exists(user_root):
+        os.makedirs(user_root, exist_ok=True)
+    user_root = os.path.normpath(user_root)
+    full_path = os.path.abspath(os.path.join(user_root, path.strip("/")))
+    print(f"  Final full_path: {full_path}")
+    print(f"  Full path exists: {os.path.exists(full_path)}")
+    if os.path.exists(full_path) and os.path.isdir(full_path):
+        contents = os.listdir(full_path)
+        print(f"  Directory contents ({len(contents)} items): {contents[:5]}")
+    if not full_path.startswith(user_root):
+        raise PermissionError(full_path)
+    return full_path
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    with tempfile.TemporaryDirectory() as storage:
+        os.environ["STORAGE_ROOT"] = storage
+        target = os.path.join(storage, "users", "alice", "projects", "demo")
+        os.makedirs(target)
+        for i in range(200):
+            open(os.path.join(target, f"file{i}.txt"), "w").close()
+
+        resolver = PathResolver()
+        request_path = "projects/demo"
+
+        def run_legacy():
+            with contextlib.redirect_stdout(io.StringIO()):
+                legacy_get_safe_path("/users/alice", request_path)
+
+        def run_resolver():
+            resolver.resolve("/users/alice", request_path)
+
+        assert resolver.resolve("/users/alice", request_path) == target
+
+        for name, fn in (("legacy get_safe_path", run_legacy), ("PathResolver.resolve", run_resolver)):
+            seconds = min(timeit.repeat(fn, number=iterations, repeat=3))
+            print(f"{name:<22} {seconds / iterations * 1e6:8.2f} us/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Benchmark: name search latency in the file index.
+
+Seeds a temporary database with synthetic file_index rows spread over many
+folders, then times substring, prefix and glob searches through
+FileIndex.search, once with the FTS5 trigram index and once with the LIKE
+scan used when the index is unavailable. Each search returns one page of
+50 results scoped to the whole storage.
+
+Usage: python benchmarks/bench_search.py [entries] [repeats]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.orm import sessionmaker
+
+from backend import config, database, models, search
+
+WORDS = ["report", "invoice", "photo", "backup", "notes", "draft", "final", "budget", "scan", "meeting", "summary", "data"]
+EXTENSIONS = [".pdf", ".txt", ".jpg", ".docx", ".csv", ".png"]
+QUERIES = [
+    ("substring", "voice"),
+    ("substring", "2023_07"),
+    ("substring", "zzzz"),
+    ("prefix", "budget_2021"),
+    ("glob", "final_*_0042*.pdf"),
+]
+
+
+def seed(engine, entries: int):
+    rng = random.Random(1)
+    rows = []
+    with engine.begin() as conn:
+        for i in range(entries):
+            parent = f"user{i % 50}/project{i % 997}"
+            ext = rng.choice(EXTENSIONS)
+            name = f"{rng.choice(WORDS)}_{2015 + i % 10}_{i % 12 + 1:02d}_{i:07d}{ext}"
+            rows.append({
+                "path": f"{parent}/{name}", "parent": parent, "name": name, "name_key": name.lower(),
+                "extension": ext, "size": rng.randrange(1 << 20), "mtime": 1.6e9 + i, "is_dir": False,
+            })
+            if len(rows) == 10000:
+                conn.execute(models.FileIndexEntry.__table__.insert(), rows)
+                rows = []
+        if rows:
+            conn.execute(models.FileIndexEntry.__table__.insert(), rows)
+
+
+def time_queries(index: search.FileIndex, Session, repeats: int) -> dict:
+    results = {}
+    scopes = [search.SearchScope("", False)]
+    with Session() as db:
+        for mode, query in QUERIES:
+            start = time.perf_counter()
+            for _ in range(repeats):
+                entries, _ = index.search(db, scopes, query, mode, limit=50)
+            results[(mode, query)] = ((time.perf_counter() - start) / repeats * 1000, len(entries))
+    return results
+
+
+def main():
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = database.build_engine({**config.DEFAULT_CONFIG["database"], "path": os.path.join(tmp, "bench.db")})
+        models.Base.metadata.create_all(bind=engine)
+        index = search.FileIndex()
+        index.setup(engine)
+        start = time.perf_counter()
+        seed(engine, entries)
+        print(f"Seeded {entries} entries in {time.perf_counter() - start:.1f}s (trigram index: {index.fts})\n")
+
+        Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        fts = time_queries(index, Session, repeats)
+        index.fts = False
+        scan = time_queries(index, Session, repeats)
+        engine.dispose()
+
+    print(f"{'mode':<10} {'query':<20} {'results':>8} {'trigram ms':>11} {'LIKE ms':>9}")
+    for mode, query in QUERIES:
+        fts_ms, count = fts[(mode, query)]
+        scan_ms, _ = scan[(mode, query)]
+        print(f"{mode:<10} {query:<20} {count:>8} {fts_ms:>11.1f} {scan_ms:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
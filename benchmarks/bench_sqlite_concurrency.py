@@ -0,0 +1,108 @@
+"""
+Benchmark: concurrent read/write throughput of the SQLite database.
+
+Reader threads look up file entries by path and by URL ID while writer
+threads register new paths with get_or_create_file_entry, as listing and
+upload requests do. Compares an engine with SQLite defaults (rollback
+journal, no busy timeout: the previous database.py) with the engine built
+by database.build_engine (WAL, synchronous=NORMAL, busy_timeout, cache and
+mmap pragmas, pool sized from config). Failed operations are mostly
+"database is locked" errors.
+
+Usage: python benchmarks/bench_sqlite_concurrency.py [seconds] [readers] [writers]
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import config, crud, database, models
+
+SEED_ENTRIES = 20000
+
+
+def legacy_engine(path: str):
+    return create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+
+
+def tuned_engine(path: str):
+    return database.build_engine({**config.DEFAULT_CONFIG["database"], "path": path})
+
+
+def seed(Session):
+    with Session() as db:
+        db.add_all(
+            models.FileEntry(path=f"seed/{i // 100}/file{i}.txt", url_id=crud.generate_url_id(), is_directory=False)
+            for i in range(SEED_ENTRIES)
+        )
+        db.commit()
+        return [url_id for (url_id,) in db.query(models.FileEntry.url_id).limit(1000)]
+
+
+def run(make_engine, seconds: float, readers: int, writers: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(os.path.join(tmp, "bench.db"))
+        models.Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        url_ids = seed(Session)
+        counts = {"reads": 0, "writes": 0, "errors": 0}
+        lock = threading.Lock()
+        stop = time.perf_counter() + seconds
+
+        def count(key: str):
+            with lock:
+                counts[key] += 1
+
+        def reader(n: int):
+            i = n
+            while time.perf_counter() < stop:
+                i += 1
+                try:
+                    with Session() as db:
+                        db.query(models.FileEntry).filter(models.FileEntry.path == f"seed/{i % 200}/file{i % SEED_ENTRIES}.txt").first()
+                        crud.get_file_entry_by_id(db, url_ids[i % len(url_ids)])
+                    count("reads")
+                except Exception:
+                    count("errors")
+
+        def writer(n: int):
+            i = 0
+            while time.perf_counter() < stop:
+                i += 1
+                try:
+                    with Session() as db:
+                        crud.get_or_create_file_entry(db, f"new/{n}/file{i}.txt")
+                    count("writes")
+                except Exception:
+                    count("errors")
+
+        threads = [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+        threads += [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        engine.dispose()
+    return {key: value / seconds for key, value in counts.items()}
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    readers = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    writers = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+    print(f"{seconds:g}s per run, {readers} reader and {writers} writer threads, {SEED_ENTRIES} seeded entries\n")
+    print(f"{'engine':<10} {'reads/s':>10} {'writes/s':>10} {'errors/s':>10}")
+    for name, make_engine in (("default", legacy_engine), ("tuned", tuned_engine)):
+        result = run(make_engine, seconds, readers, writers)
+        print(f"{name:<10} {result['reads']:>10.0f} {result['writes']:>10.0f} {result['errors']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
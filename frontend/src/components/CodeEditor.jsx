@@ -209,7 +209,7 @@ const CodeEditor = ({ value, onChange, language = 'javascript', readOnly = false
                                     const coords = getCursorCoordinates(cursor.position);
                                     return (
                                         <div
-                                            key={cursor.username}
+                                            key={cursor.id || cursor.username}
                                             className="absolute transition-all duration-100 group pointer-events-auto"
                                             style={{
                                                 top: `${coords.top}px`,
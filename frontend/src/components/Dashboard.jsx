@@ -1,6 +1,7 @@
 import React, { useState, useEffect, useRef } from 'react';
 import { useLocation, useNavigate, Link } from 'react-router-dom';
 import api from '../api';
+import { CollabDocument } from '../ot';
 import CodeEditor from './CodeEditor';
 import AccountSettings from './AccountSettings';
 import {
@@ -10,10 +11,15 @@ import {
     ArrowUpDown, ArrowUp, ArrowDown, User, Link as LinkIcon, Mail
 } from 'lucide-react';
 
+// Number of directory entries requested per listing page
+const LISTING_PAGE_SIZE = 500;
+
 export default function Dashboard() {
     const location = useLocation();
     const navigate = useNavigate();
     const [items, setItems] = useState([]);
+    const [nextCursor, setNextCursor] = useState(null);
+    const [loadingMore, setLoadingMore] = useState(false);
     const [loading, setLoading] = useState(true);
     const [user, setUser] = useState(null);
     const fileInputRef = useRef(null);
@@ -45,6 +51,7 @@ export default function Dashboard() {
     const [editorFilePath, setEditorFilePath] = useState(''); // Full path to the file being edited
     const [editorSaving, setEditorSaving] = useState(false);
     const socketRef = useRef(null); // Use ref for socket
+    const collabRef = useRef(null); // Shared document state for the open file
     const [activeUsers, setActiveUsers] = useState([]);
     const [pythonOutput, setPythonOutput] = useState('');
     const [pythonRunning, setPythonRunning] = useState(false);
@@ -62,10 +69,14 @@ export default function Dashboard() {
 
     useEffect(() => {
         fetchUser();
-        fetchItems();
         fetchUsers();
     }, [currentPath, viewMode]);
 
+    useEffect(() => {
+        // Listings are paged server-side, so a new sort needs a fresh first page
+        fetchItems();
+    }, [currentPath, viewMode, sortBy, sortOrder]);
+
     useEffect(() => {
         const handleClick = () => setContextMenu(null);
         document.addEventListener('click', handleClick);
@@ -124,6 +135,7 @@ export default function Dashboard() {
 
     const fetchItems = async () => {
         setLoading(true);
+        setNextCursor(null);
         try {
             if (viewMode === 'shared') {
                 // Show folders/files shared with the current user
@@ -141,10 +153,11 @@ export default function Dashboard() {
                 })));
             } else {
                 const path = currentPath || '';
-                const res = await api.get(`/files/${path}`);
+                const res = await api.get(`/files/${path}`, { params: listingParams() });
 
-                if (Array.isArray(res.data)) {
-                    setItems(res.data);
+                if (res.data && Array.isArray(res.data.items)) {
+                    setItems(res.data.items);
+                    setNextCursor(res.data.next_cursor);
                 }
             }
         } catch (err) {
@@ -154,6 +167,29 @@ export default function Dashboard() {
         }
     };
 
+    const listingParams = (cursor = null) => ({
+        limit: LISTING_PAGE_SIZE,
+        sort: sortBy === 'date' ? 'mtime' : sortBy,
+        order: sortOrder,
+        dirs_first: true,
+        ...(cursor ? { cursor } : {})
+    });
+
+    const loadMoreItems = async () => {
+        if (!nextCursor || loadingMore) return;
+        setLoadingMore(true);
+        try {
+            const path = currentPath || '';
+            const res = await api.get(`/files/${path}`, { params: listingParams(nextCursor) });
+            setItems(prev => [...prev, ...res.data.items]);
+            setNextCursor(res.data.next_cursor);
+        } catch (err) {
+            console.error(err);
+        } finally {
+            setLoadingMore(false);
+        }
+    };
+
     const handleUpload = async (e) => {
         const file = e.target.files[0];
         if (!file) return;
@@ -186,6 +222,24 @@ export default function Dashboard() {
         }
     };
 
+    const handleDownloadFolder = async (itemName) => {
+        try {
+            const path = currentPath ? `${currentPath}/${itemName}` : itemName;
+            const response = await api.get(`/archive/${path}`, { responseType: 'blob' });
+
+            const url = window.URL.createObjectURL(response.data);
+            const link = document.createElement('a');
+            link.href = url;
+            link.download = `${itemName}.zip`;
+            document.body.appendChild(link);
+            link.click();
+            document.body.removeChild(link);
+            window.URL.revokeObjectURL(url);
+        } catch (err) {
+            alert('Download failed');
+        }
+    };
+
     const handleDownload = async (itemName) => {
         try {
             const path = currentPath ? `${currentPath}/${itemName}` : itemName;
@@ -448,55 +502,86 @@ export default function Dashboard() {
         const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
         const wsUrl = `${protocol}//${window.location.host}/ws/${editorFilePath}?token=${token}`;
 
-        console.log('Connecting WS to', wsUrl);
-        const ws = new WebSocket(wsUrl);
-        socketRef.current = ws;
-
-        ws.onopen = () => {
-            console.log('Connected to collaboration room');
-        };
-
-        ws.onmessage = (event) => {
-            try {
-                const data = JSON.parse(event.data);
-                if (data.type === 'users_update') {
-                    setActiveUsers(data.users);
-                } else if (data.type === 'cursor_update') {
-                    if (data.username !== user.username) { // Use user instead of currentUser
-                        setCursors(prev => {
-                            const otherCursors = prev.filter(c => c.username !== data.username);
-                            return [...otherCursors, {
-                                username: data.username,
-                                position: data.position,
-                                color: getUserColor(data.username)
-                            }];
-                        });
+        // Edits are exchanged as operations on the server's copy of the file;
+        // after a reconnect the document catches up from its last version
+        const collab = new CollabDocument(
+            (message) => {
+                if (socketRef.current && socketRef.current.readyState === WebSocket.OPEN) {
+                    socketRef.current.send(JSON.stringify(message));
+                }
+            },
+            (text) => setEditorContent(text)
+        );
+        collabRef.current = collab;
+        let closed = false;
+        let reconnectTimer = null;
+
+        const connect = () => {
+            console.log('Connecting WS to', wsUrl);
+            const ws = new WebSocket(wsUrl);
+            socketRef.current = ws;
+
+            ws.onopen = () => {
+                console.log('Connected to collaboration room');
+                collab.sync();
+            };
+
+            ws.onmessage = (event) => {
+                try {
+                    const data = JSON.parse(event.data);
+                    if (collab.handleMessage(data)) {
+                        return;
                     }
-                } else if (data.type === 'content_update') {
-                    console.log('WS Received content:', data.content);
-                    setEditorContent(prev => {
-                        if (data.content !== prev) {
-                            return data.content;
+                    if (data.type === 'users_update') {
+                        setActiveUsers(data.users);
+                    } else if (data.type === 'cursors_update') {
+                        // Full list on joins and leaves, only the moved cursors otherwise
+                        const incoming = data.cursors
+                            .filter(c => c.username !== user.username)
+                            .map(c => ({ ...c, color: getUserColor(c.username) }));
+                        if (data.partial) {
+                            setCursors(prev => {
+                                const moved = new Set(incoming.map(c => c.id));
+                                return [...prev.filter(c => !moved.has(c.id)), ...incoming];
+                            });
+                        } else {
+                            setCursors(incoming);
                         }
-                        return prev;
-                    });
+                    } else if (data.type === 'content_update') {
+                        setEditorContent(prev => {
+                            if (data.content !== prev) {
+                                return data.content;
+                            }
+                            return prev;
+                        });
+                    }
+                } catch (e) {
+                    console.error('WS Parse error', e);
                 }
-            } catch (e) {
-                console.error('WS Parse error', e);
-            }
-        };
+            };
 
-        ws.onclose = (e) => {
-            console.log('WS Closed:', e.code, e.reason);
-        };
+            ws.onclose = (e) => {
+                console.log('WS Closed:', e.code, e.reason);
+                if (!closed && socketRef.current === ws) {
+                    reconnectTimer = setTimeout(connect, 2000);
+                }
+            };
 
-        ws.onerror = (e) => {
-            console.error('WS Error:', e);
+            ws.onerror = (e) => {
+                console.error('WS Error:', e);
+            };
         };
 
+        connect();
+
         return () => {
-            ws.close();
+            closed = true;
+            clearTimeout(reconnectTimer);
+            if (socketRef.current) {
+                socketRef.current.close();
+            }
             socketRef.current = null;
+            collabRef.current = null;
             setActiveUsers([]);
             setCursors([]);
         };
@@ -552,7 +637,14 @@ export default function Dashboard() {
             // Use new save-file endpoint
             const formData = new FormData();
             formData.append('file_path', editorFilePath);
-            formData.append('content', editorContent);
+            const collab = collabRef.current;
+            // Send edits still waiting on an ack first; the server then saves its own copy
+            if (collab && collab.synced && await collab.whenSettled()) {
+                formData.append('content', collab.text);
+                formData.append('version', collab.version);
+            } else {
+                formData.append('content', editorContent);
+            }
 
             await api.post('/save-file', formData);
 
@@ -579,6 +671,8 @@ export default function Dashboard() {
     // Autosave Effect
     useEffect(() => {
         if (!showEditor || !editorFile) return;
+        // Shared documents are written to disk by the server
+        if (collabRef.current && collabRef.current.synced) return;
 
         const timer = setTimeout(() => {
             saveFileInternal(true);
@@ -1186,6 +1280,18 @@ export default function Dashboard() {
                                     </button>
                                 </>
                             )}
+                            {contextMenu.item.is_dir && (
+                                <button
+                                    onClick={() => {
+                                        handleDownloadFolder(contextMenu.item.name);
+                                        setContextMenu(null);
+                                    }}
+                                    className="w-full px-4 py-3 md:py-2 text-left hover:bg-white/10 flex items-center gap-3 text-slate-200 transition-colors active:bg-white/20"
+                                >
+                                    <Download className="w-5 h-5 md:w-4 md:h-4" />
+                                    Download as ZIP
+                                </button>
+                            )}
                             {user?.user_level !== 'read-only' && (
                                 <>
                                     <button
@@ -1786,6 +1892,18 @@ export default function Dashboard() {
                         </div>
                     )
                 }
+
+                {nextCursor && viewMode !== 'shared' && (
+                    <div className="flex justify-center mt-4">
+                        <button
+                            onClick={loadMoreItems}
+                            disabled={loadingMore}
+                            className="px-4 py-2 rounded-lg text-sm bg-white/5 text-slate-300 hover:bg-white/10 hover:text-white transition-colors disabled:opacity-50"
+                        >
+                            {loadingMore ? 'Loading...' : 'Load more'}
+                        </button>
+                    </div>
+                )}
             </main >
 
             {/* Preview Modal */}
@@ -1903,6 +2021,9 @@ export default function Dashboard() {
                                 onChange={(e) => {
                                     const newContent = e.target.value;
                                     setEditorContent(newContent);
+                                    if (collabRef.current && collabRef.current.localChange(newContent)) {
+                                        return;
+                                    }
                                     if (socketRef.current && socketRef.current.readyState === WebSocket.OPEN) {
                                         socketRef.current.send(JSON.stringify({
                                             type: 'content_update',
@@ -349,6 +349,19 @@ const ServerSettings = () => {
                                     <span className="text-xs text-slate-500">Allow execution of Python scripts (security risk)</span>
                                 </div>
                             </div>
+
+                            <div className="flex items-center space-x-3 p-4 bg-white/5 rounded-lg border border-white/5 hover:bg-white/10 transition-colors">
+                                <input
+                                    type="checkbox"
+                                    checked={config.cache?.listing_cache_enabled ?? true}
+                                    onChange={(e) => updateConfig('cache', 'listing_cache_enabled', e.target.checked)}
+                                    className="rounded border-slate-600 bg-slate-700 text-blue-500 focus:ring-blue-500 w-5 h-5"
+                                />
+                                <div>
+                                    <span className="text-sm font-medium text-slate-200 block">Enable Directory Listing Cache</span>
+                                    <span className="text-xs text-slate-500">Keep recent directory listings in memory to speed up navigation</span>
+                                </div>
+                            </div>
                         </div>
                     </div>
                 )}
@@ -0,0 +1,312 @@
+// Operational transformation client for the collaborative editor.
+// Operations use the server's format (backend/ot.py): a positive number
+// retains that many characters, a negative number deletes, a string is
+// inserted. Lengths count Unicode code points, not UTF-16 units.
+
+// Resync if the server hasn't acknowledged an operation by then
+const ACK_TIMEOUT_MS = 10000;
+
+const isHighSurrogate = (code) => code >= 0xD800 && code <= 0xDBFF;
+const isLowSurrogate = (code) => code >= 0xDC00 && code <= 0xDFFF;
+
+const codePointLength = (text) => {
+    let length = 0;
+    for (let i = 0; i < text.length; i++) {
+        if (!(isLowSurrogate(text.charCodeAt(i)) && i > 0 && isHighSurrogate(text.charCodeAt(i - 1)))) {
+            length++;
+        }
+    }
+    return length;
+};
+
+// UTF-16 index `count` code points after `index`
+const advance = (text, index, count) => {
+    while (count > 0 && index < text.length) {
+        index += isHighSurrogate(text.charCodeAt(index)) && isLowSurrogate(text.charCodeAt(index + 1)) ? 2 : 1;
+        count--;
+    }
+    return index;
+};
+
+const isRetain = (c) => typeof c === 'number' && c > 0;
+const isDelete = (c) => typeof c === 'number' && c < 0;
+const isInsert = (c) => typeof c === 'string';
+
+class Builder {
+    constructor() {
+        this.ops = [];
+    }
+
+    last(offset = 1) {
+        return this.ops[this.ops.length - offset];
+    }
+
+    retain(n) {
+        if (n <= 0) return;
+        if (isRetain(this.last())) this.ops[this.ops.length - 1] += n;
+        else this.ops.push(n);
+    }
+
+    insert(s) {
+        if (!s) return;
+        if (isInsert(this.last())) {
+            this.ops[this.ops.length - 1] += s;
+        } else if (isDelete(this.last())) {
+            // Inserts go before deletes, as on the server
+            if (isInsert(this.last(2))) this.ops[this.ops.length - 2] += s;
+            else this.ops.splice(this.ops.length - 1, 0, s);
+        } else {
+            this.ops.push(s);
+        }
+    }
+
+    delete(n) {
+        if (n <= 0) return;
+        if (isDelete(this.last())) this.ops[this.ops.length - 1] -= n;
+        else this.ops.push(-n);
+    }
+}
+
+export const apply = (text, op) => {
+    const parts = [];
+    let index = 0;
+    for (const c of op) {
+        if (isRetain(c)) {
+            const end = advance(text, index, c);
+            parts.push(text.slice(index, end));
+            index = end;
+        } else if (isInsert(c)) {
+            parts.push(c);
+        } else {
+            index = advance(text, index, -c);
+        }
+    }
+    if (index !== text.length) {
+        throw new Error('Operation does not match the document length');
+    }
+    return parts.join('');
+};
+
+// Returns [a', b'] with apply(apply(t, a), b') === apply(apply(t, b), a');
+// a's inserts come first when both insert at the same place
+export const transform = (a, b) => {
+    const aPrime = new Builder();
+    const bPrime = new Builder();
+    let ia = 0;
+    let ib = 0;
+    let ca = a[ia++];
+    let cb = b[ib++];
+
+    while (ca !== undefined || cb !== undefined) {
+        if (ca !== undefined && isInsert(ca)) {
+            aPrime.insert(ca);
+            bPrime.retain(codePointLength(ca));
+            ca = a[ia++];
+            continue;
+        }
+        if (cb !== undefined && isInsert(cb)) {
+            aPrime.retain(codePointLength(cb));
+            bPrime.insert(cb);
+            cb = b[ib++];
+            continue;
+        }
+        if (ca === undefined || cb === undefined) {
+            throw new Error('Operations have different lengths');
+        }
+
+        let n;
+        if (isRetain(ca) && isRetain(cb)) {
+            n = Math.min(ca, cb);
+            aPrime.retain(n);
+            bPrime.retain(n);
+        } else if (isDelete(ca) && isDelete(cb)) {
+            n = Math.min(-ca, -cb);
+        } else if (isDelete(ca)) {
+            n = Math.min(-ca, cb);
+            aPrime.delete(n);
+        } else {
+            n = Math.min(ca, -cb);
+            bPrime.delete(n);
+        }
+
+        if (Math.abs(ca) > n) ca = ca > 0 ? ca - n : ca + n;
+        else ca = a[ia++];
+        if (Math.abs(cb) > n) cb = cb > 0 ? cb - n : cb + n;
+        else cb = b[ib++];
+    }
+    return [aPrime.ops, bPrime.ops];
+};
+
+// Operation turning `oldText` into `newText`: the span between the common prefix and suffix is replaced
+export const diff = (oldText, newText) => {
+    const limit = Math.min(oldText.length, newText.length);
+    let prefix = 0;
+    while (prefix < limit && oldText.charCodeAt(prefix) === newText.charCodeAt(prefix)) prefix++;
+    if (prefix > 0 && isHighSurrogate(oldText.charCodeAt(prefix - 1))) prefix--;
+    let suffix = 0;
+    while (suffix < limit - prefix &&
+        oldText.charCodeAt(oldText.length - 1 - suffix) === newText.charCodeAt(newText.length - 1 - suffix)) suffix++;
+    if (suffix > 0 && isLowSurrogate(oldText.charCodeAt(oldText.length - suffix))) suffix--;
+
+    const builder = new Builder();
+    builder.retain(codePointLength(oldText.slice(0, prefix)));
+    builder.insert(newText.slice(prefix, newText.length - suffix));
+    builder.delete(codePointLength(oldText.slice(prefix, oldText.length - suffix)));
+    builder.retain(codePointLength(oldText.slice(oldText.length - suffix)));
+    return builder.ops;
+};
+
+// Client side of the editing protocol. At most one operation is in flight;
+// edits made meanwhile are sent once it is acknowledged.
+export class CollabDocument {
+    constructor(send, onText) {
+        this.send = send; // Sends a message object over the socket
+        this.onText = onText; // Called when remote edits change the text
+        this.version = null; // Server version serverText corresponds to
+        this.serverText = '';
+        this.text = ''; // Local text, including unacknowledged edits
+        this.outstanding = null; // {op, id} sent and not yet acknowledged
+        this.pendingText = ''; // serverText with the outstanding op applied
+        this.unsupported = false; // The server keeps no shared document for this file
+        this.syncing = false;
+        this.ackTimer = null;
+        this.settleWaiters = [];
+    }
+
+    get synced() {
+        return this.version !== null && !this.unsupported;
+    }
+
+    // Every local edit has been acknowledged by the server
+    get settled() {
+        return this.synced && !this.syncing && !this.outstanding && this.text === this.serverText;
+    }
+
+    // Sends pending edits; resolves true once settled, or false after the timeout
+    whenSettled(timeoutMs = ACK_TIMEOUT_MS) {
+        this.flush();
+        if (this.settled) return Promise.resolve(true);
+        return new Promise((resolve) => {
+            const waiter = (done) => {
+                clearTimeout(timer);
+                resolve(done);
+            };
+            const timer = setTimeout(() => {
+                this.settleWaiters = this.settleWaiters.filter(w => w !== waiter);
+                resolve(false);
+            }, timeoutMs);
+            this.settleWaiters.push(waiter);
+        });
+    }
+
+    notifySettled() {
+        if (!this.settled || !this.settleWaiters.length) return;
+        const waiters = this.settleWaiters;
+        this.settleWaiters = [];
+        waiters.forEach(waiter => waiter(true));
+    }
+
+    sync() {
+        this.syncing = true;
+        this.send({ type: 'sync', version: this.version });
+    }
+
+    // Returns false if the edit must be sent as full content instead
+    localChange(text) {
+        if (this.unsupported) return false;
+        this.text = text;
+        this.flush();
+        return true;
+    }
+
+    flush() {
+        if (!this.synced || this.syncing || this.outstanding || this.text === this.serverText) return;
+        const op = diff(this.serverText, this.text);
+        const id = `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`;
+        this.outstanding = { op, id };
+        this.pendingText = this.text;
+        this.send({ type: 'op', version: this.version, op, id });
+        this.ackTimer = setTimeout(() => this.sync(), ACK_TIMEOUT_MS);
+    }
+
+    acknowledge(version) {
+        clearTimeout(this.ackTimer);
+        this.serverText = this.pendingText;
+        this.version = version;
+        this.outstanding = null;
+    }
+
+    applyRemote(op) {
+        // Local edits not sent yet, on top of the outstanding op
+        const unsent = diff(this.outstanding ? this.pendingText : this.serverText, this.text);
+        let incoming = op;
+        if (this.outstanding) {
+            const [outstanding, transformed] = transform(this.outstanding.op, incoming);
+            this.outstanding.op = outstanding;
+            this.pendingText = apply(this.pendingText, transformed);
+            incoming = transformed;
+        }
+        const [, local] = transform(unsent, incoming);
+        this.text = apply(this.text, local);
+        this.serverText = apply(this.serverText, op);
+        this.version++;
+    }
+
+    reset(version, content) {
+        clearTimeout(this.ackTimer);
+        this.version = version;
+        this.serverText = content;
+        this.pendingText = content;
+        this.text = content;
+        this.outstanding = null;
+        this.onText(content);
+    }
+
+    // Returns true if the message belongs to the editing protocol
+    handleMessage(data) {
+        if (data.type === 'sync') {
+            this.syncing = false;
+            if (data.version === null) {
+                this.unsupported = true;
+            } else if (data.content !== undefined) {
+                this.reset(data.version, data.content);
+            } else {
+                const before = this.text;
+                data.ops.forEach(({ op, id }) => {
+                    if (this.outstanding && id === this.outstanding.id) this.acknowledge(this.version + 1);
+                    else this.applyRemote(op);
+                });
+                if (this.outstanding) {
+                    // Never applied: its edits are still in this.text and get sent again
+                    clearTimeout(this.ackTimer);
+                    this.outstanding = null;
+                }
+                if (this.text !== before) this.onText(this.text);
+                this.flush();
+            }
+            this.notifySettled();
+            return true;
+        }
+        if (data.type === 'ack') {
+            if (this.outstanding && data.id === this.outstanding.id) {
+                this.acknowledge(data.version);
+                this.flush();
+                this.notifySettled();
+            }
+            return true;
+        }
+        if (data.type === 'op') {
+            if (!this.synced || this.syncing) return true;
+            if (data.version !== this.version + 1) {
+                // Missed an operation (e.g. dropped for a slow connection): catch up
+                this.sync();
+                return true;
+            }
+            this.applyRemote(data.op);
+            this.onText(this.text);
+            return true;
+        }
+        // Full content is only meaningful when there is no shared document
+        return data.type === 'content_update' && this.synced;
+    }
+}
@@ -4,6 +4,7 @@ This script starts the FastAPI server with the bundled frontend.
 """
 import os
 import sys
+import multiprocessing
 import uvicorn
 from pathlib import Path
 
@@ -44,4 +45,7 @@ def main():
     )
 
 if __name__ == "__main__":
+    # Needed in frozen builds so password hashing worker processes start
+    # as workers instead of re-running the launcher
+    multiprocessing.freeze_support()
     main()